@@ -0,0 +1,252 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Benchmarks of the code paths that have to stay fast as the books grow.
+
+Run them with `python benchmarks/bench.py <name>`, each prints the time taken
+by every step and exits with a non zero status if a result is wrong.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from decimal import Decimal as D
+from typing import Callable, Optional
+
+from atom.api import Atom, Float, Int, Str
+
+from zerobooks.models.invoice import Invoice, InvoiceItem
+
+
+class Timing(Atom):
+    #: Description of the step
+    name = Str()
+
+    #: Number of operations done in the step
+    ops = Int()
+
+    #: Time taken by the step
+    seconds = Float()
+
+    def __str__(self) -> str:
+        us = 1e6 * self.seconds / self.ops if self.ops else 0.0
+        return (
+            f"{self.name:<32} {self.ops:>8} ops {self.seconds * 1000:>10.1f}ms "
+            f"{us:>8.1f}us/op"
+        )
+
+
+class BenchmarkFailed(Exception):
+    """Raised when a benchmark gives a wrong result or is over budget."""
+
+
+def timed(name: str, ops: int, fn: Callable[[], object]) -> Timing:
+    start = time.perf_counter()
+    fn()
+    return Timing(name=name, ops=ops, seconds=time.perf_counter() - start)
+
+
+def check_totals(invoice: Invoice):
+    """Raise BenchmarkFailed if the running totals of the invoice do not
+    match the totals computed from all of the items.
+
+    """
+    for name in ("subtotal", "taxable_subtotal", "total_tax", "total_amount"):
+        value = getattr(invoice, name)
+        expected = getattr(invoice, f"_default_{name}")()
+        if value != expected:
+            raise BenchmarkFailed(f"The {name} is {value} instead of {expected}")
+
+
+def bench_totals(lines: int = 10000) -> list[Timing]:
+    """Time editing the line items of an invoice with many lines.
+
+    Parameters
+    ----------
+    lines: int
+        Number of line items
+
+    Returns
+    -------
+    timings: list[Timing]
+        The time taken by each step
+
+    """
+
+    def new_item(i: int) -> InvoiceItem:
+        return InvoiceItem(
+            name=f"Item {i}",
+            quantity=D(i % 7 + 1),
+            rate=D(i % 1000) / 100,
+            taxable=i % 3 == 0,
+        )
+
+    invoice = Invoice(tax_rate=D("0.0825"))
+    items = [new_item(i) for i in range(lines)]
+    timings = []
+
+    def add():
+        for item in items:
+            invoice.items.append(item)
+
+    def edit():
+        for item in items:
+            item.rate += 1
+
+    def toggle():
+        for item in items:
+            item.taxable = not item.taxable
+
+    def replace():
+        for i in range(0, lines, 2):
+            invoice.items[i] = new_item(i)
+
+    def remove():
+        for i in range(len(invoice.items)):
+            invoice.items.pop()
+
+    def paste():
+        invoice.items.extend(items)
+
+    def delete():
+        del invoice.items[lines // 4 : lines // 2]
+
+    def full():
+        # What every edit cost when the totals were summed from scratch
+        invoice._default_subtotal()
+        invoice._default_taxable_subtotal()
+
+    for name, ops, fn in (
+        ("append one at a time", lines, add),
+        ("edit the rate of each", lines, edit),
+        ("toggle taxable of each", lines, toggle),
+        ("replace every other", lines // 2, replace),
+        ("pop one at a time", lines, remove),
+        ("paste all at once", 1, paste),
+        ("delete a quarter at once", 1, delete),
+        ("sum all items (per edit before)", 1, full),
+    ):
+        timings.append(timed(name, ops, fn))
+        check_totals(invoice)
+    return timings
+
+
+#: Imports the app does at startup, run in a new interpreter for each sample
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import enaml
+import zerobooks.app
+app = time.perf_counter()
+with enaml.imports():
+    import zerobooks.core
+    import zerobooks.manifest
+print(json.dumps({
+    "app": app - start,
+    "views": time.perf_counter() - app,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+#: Modules that must only be imported when the dock item using them is opened
+DEFERRED_MODULES = (
+    "PyQt5.QtWebEngineWidgets",
+    "PyQt6.QtWebEngineWidgets",
+    "PySide2.QtWebEngineWidgets",
+    "PySide6.QtWebEngineWidgets",
+    "PyQt5.Qsci",
+    "PyQt6.Qsci",
+    "weasyprint",
+    "web.impl.lxml_components",
+    "zerobooks.designer",
+    "zerobooks.preview",
+    "zerobooks.views.designer",
+    "zerobooks.views.preview",
+)
+
+#: Milliseconds the imports done at startup may take
+STARTUP_BUDGET = 1500
+
+
+def bench_startup(samples: int = 5, budget: float = STARTUP_BUDGET) -> list[Timing]:
+    """Time the imports done when the app starts in a new interpreter.
+
+    Parameters
+    ----------
+    samples: int
+        Number of times the app is started, the fastest is used
+    budget: float
+        Milliseconds the imports may take
+
+    Returns
+    -------
+    timings: list[Timing]
+        The time taken by each step
+
+    """
+    results = []
+    for i in range(samples):
+        process = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1:]
+            raise BenchmarkFailed(f"The app failed to start: {error}")
+        results.append(json.loads(process.stdout.splitlines()[-1]))
+    best = min(results, key=lambda r: r["app"] + r["views"])
+    loaded = [name for name in DEFERRED_MODULES if name in best["modules"]]
+    if loaded:
+        raise BenchmarkFailed(f"Imported at startup: {', '.join(loaded)}")
+    total = (best["app"] + best["views"]) * 1000
+    if total > budget:
+        raise BenchmarkFailed(f"Startup took {total:.0f}ms, the budget is {budget}ms")
+    return [
+        Timing(name="import zerobooks.app", ops=1, seconds=best["app"]),
+        Timing(name="import the views", ops=1, seconds=best["views"]),
+    ]
+
+
+#: Benchmarks by name
+BENCHMARKS = {
+    "startup": lambda args: bench_startup(args.samples, args.budget),
+    "totals": lambda args: bench_totals(args.lines),
+}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python benchmarks/bench.py",
+        description="Time the code paths that must stay fast",
+    )
+    parser.add_argument("name", choices=BENCHMARKS)
+    parser.add_argument(
+        "--lines", type=int, default=10000, help="Line items of the invoice"
+    )
+    parser.add_argument(
+        "--samples", type=int, default=5, help="Number of times the app is started"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=STARTUP_BUDGET,
+        help="Milliseconds the imports done at startup may take",
+    )
+    args = parser.parse_args(argv)
+    try:
+        timings = BENCHMARKS[args.name](args)
+    except BenchmarkFailed as e:
+        print(f"FAIL {e}")
+        return 1
+    for t in timings:
+        print(t)
+    print(f"{sum(t.seconds for t in timings):.2f}s total")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
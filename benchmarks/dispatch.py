@@ -0,0 +1,112 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Compare the submit-to-start latency and idle loop wakeups of the old polling
+queue used by ZeroApplication.main with the TaskDispatcher.
+
+Run with `python benchmarks/dispatch.py`.
+"""
+import asyncio
+import statistics
+import time
+from queue import Empty, Queue
+
+from zerobooks.tasks import TaskDispatcher
+
+SAMPLES = 50
+IDLE_SECONDS = 2.0
+
+
+class CountingLoop(asyncio.SelectorEventLoop):
+    """Event loop that counts how many times it wakes up."""
+
+    wakeups = 0
+
+    def _run_once(self):
+        self.wakeups += 1
+        super()._run_once()
+
+
+class PollingDispatcher:
+    """The loop ZeroApplication.main used before the TaskDispatcher."""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.running = True
+
+    def submit(self, coro):
+        self.queue.put(coro)
+
+    def stop(self):
+        self.running = False
+
+    async def run(self):
+        while self.running:
+            try:
+                task = self.queue.get(block=False)
+                if task is None:
+                    break
+                await task
+            except Empty:
+                await asyncio.sleep(0.1)
+
+
+async def measure(dispatcher):
+    runner = asyncio.ensure_future(dispatcher.run())
+    await asyncio.sleep(0.05)
+
+    latencies = []
+    for i in range(SAMPLES):
+        started = asyncio.Event()
+        submitted = time.perf_counter()
+
+        async def job():
+            latencies.append(time.perf_counter() - submitted)
+            started.set()
+
+        dispatcher.submit(job())
+        await started.wait()
+        # Submit at different points of the polling interval
+        await asyncio.sleep(0.013 * (i % 7))
+
+    loop = asyncio.get_running_loop()
+    wakeups = loop.wakeups
+    cpu = time.process_time()
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_wakeups = loop.wakeups - wakeups - 1  # The sleep above wakes once
+    idle_cpu = time.process_time() - cpu
+
+    dispatcher.stop()
+    await runner
+    return latencies, idle_wakeups, idle_cpu
+
+
+def report(name, latencies, idle_wakeups, idle_cpu):
+    ms = [t * 1000 for t in latencies]
+    print(
+        f"{name:<16} "
+        f"median {statistics.median(ms):8.3f} ms  "
+        f"max {max(ms):8.3f} ms  "
+        f"idle wakeups/s {idle_wakeups / IDLE_SECONDS:6.1f}  "
+        f"idle cpu {idle_cpu * 1000:6.2f} ms"
+    )
+
+
+def main():
+    for name, factory in (
+        ("polling (old)", PollingDispatcher),
+        ("TaskDispatcher", TaskDispatcher),
+    ):
+        loop = CountingLoop()
+        try:
+            report(name, *loop.run_until_complete(measure(factory())))
+        finally:
+            loop.close()
+
+
+if __name__ == "__main__":
+    main()
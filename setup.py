@@ -45,6 +45,7 @@ setup(
     extras_require={
       "webengine": "pyqt6-webengine",
       "editor": "pyqt6-qscintilla",
+      "analytics": "numpy",
     },
     entry_points={
         'console_scripts': ['zerobooks = zerobooks.app:main'],
@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import asyncio
+import os
+import shutil
+from datetime import datetime
+from decimal import Decimal as D
+
+import pytest
+from alembic import command
+from alembic.config import Config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def migrate(path: str, revision: str = "head"):
+    """Create or upgrade the database at the path to the revision."""
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option(
+        "script_location", os.path.join(ROOT, "zerobooks", "migrations")
+    )
+    config.attributes["db_file"] = path
+    # The migrations run on the current event loop, which the async tests
+    # that ran before may have closed
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        command.upgrade(config, revision)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+@pytest.fixture(scope="module")
+def app():
+    """The application the html components of enaml-web need."""
+    from web.core.app import WebApplication
+
+    class TestApplication(WebApplication):
+        def stop(self):
+            pass  # There is no event loop to stop
+
+    app = TestApplication()
+    yield app
+    app.destroy()
+
+
+@pytest.fixture(scope="session")
+def migrated_db(tmp_path_factory) -> str:
+    """Path of a database with every migration applied. Do not modify it,
+    use `db_file` to get a copy.
+
+    """
+    path = str(tmp_path_factory.mktemp("migrated") / "zerobooks.db")
+    migrate(path)
+    return path
+
+
+@pytest.fixture
+def db_file(migrated_db, tmp_path) -> str:
+    """Path of a copy of the migrated database."""
+    path = str(tmp_path / "zerobooks.db")
+    shutil.copy(migrated_db, path)
+    return path
+
+
+@pytest.fixture
+async def db(db_file):
+    """Open a copy of the migrated database for the models."""
+    from zerobooks.db import close_database, open_database
+
+    engine = await open_database(db_file)
+    try:
+        yield engine
+    finally:
+        await close_database()
+
+
+@pytest.fixture
+async def company(db):
+    from zerobooks.models.api import Customer
+
+    company = Customer(internal=True, company="Acme", email="info@acme.com")
+    await company.save()
+    return company
+
+
+@pytest.fixture
+async def customer(db):
+    from zerobooks.models.api import Customer
+
+    customer = Customer(first_name="John", last_name="Doe", email="john@doe.com")
+    await customer.save()
+    return customer
+
+
+@pytest.fixture
+async def reports(db):
+    from zerobooks.models.balance import ledger
+    from zerobooks.reports import Reports
+
+    reports = Reports()
+    yield reports
+    ledger.unobserve("changed", reports._invalidate)
+
+
+async def new_invoice(company, customer, day: datetime, amount, **kwargs):
+    """Save an open invoice of the customer with one item of the amount."""
+    from zerobooks.models.api import Invoice, InvoiceItem
+
+    invoice = Invoice(
+        owner=company,
+        customer=customer,
+        date=day,
+        status="open",
+        items=[InvoiceItem(rate=D(amount))],
+        **kwargs,
+    )
+    await invoice.save()
+    return invoice
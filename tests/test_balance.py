@@ -0,0 +1,91 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from decimal import Decimal as D
+
+import pytest
+
+from zerobooks.models.api import Customer, Invoice, InvoiceItem
+from zerobooks.models.balance import check_balances, rebuild_balances
+from zerobooks.models.payment import Payment, Refund
+
+
+@pytest.fixture
+async def invoice(company, customer):
+    invoice = Invoice(
+        owner=company,
+        customer=customer,
+        status="open",
+        items=[InvoiceItem(rate=D(100))],
+    )
+    await invoice.save()
+    return invoice
+
+
+async def stored_balances(customer: Customer) -> tuple[D, D]:
+    c = Customer.objects.table.c
+    q = Customer.objects.table.select().where(c.id == customer._id)
+    row = (await Customer.objects.fetchall(q))[0]
+    return D(str(row.open_balance)), D(str(row.total_spend))
+
+
+async def test_balances(invoice, customer):
+    assert customer.open_balance == D(100)
+    payment = Payment(invoice=invoice, customer=customer, amount=D(30))
+    await payment.save()
+    assert (customer.open_balance, customer.total_spend) == (D(70), D(30))
+    refund = Refund(payment=payment, amount=D(10))
+    await refund.save()
+    assert (customer.open_balance, customer.total_spend) == (D(80), D(20))
+    await payment.delete()
+    assert (customer.open_balance, customer.total_spend) == (D(100), D())
+    invoice.status = "void"
+    await invoice.save()
+    assert customer.open_balance == D()
+    assert await stored_balances(customer) == (D(), D())
+    assert not (await check_balances()).drifted
+
+
+async def test_loaded_customer_updated_after_commit(invoice, customer):
+    async with Payment.transaction() as conn:
+        payment = Payment(invoice=invoice, customer=customer, amount=D(30))
+        await payment.save(connection=conn)
+        # Not committed yet
+        assert customer.open_balance == D(100)
+    assert (customer.open_balance, customer.total_spend) == (D(70), D(30))
+
+
+async def test_loaded_customer_kept_on_rollback(invoice, customer):
+    with pytest.raises(RuntimeError):
+        async with Payment.transaction() as conn:
+            payment = Payment(invoice=invoice, customer=customer, amount=D(30))
+            await payment.save(connection=conn)
+            raise RuntimeError("Failed")
+    assert (customer.open_balance, customer.total_spend) == (D(100), D())
+    assert await stored_balances(customer) == (D(100), D())
+
+
+async def test_rebuild_balances(invoice, customer):
+    table = Customer.objects.table
+    async with Customer.transaction() as conn:
+        await conn.execute(
+            table.update()
+            .where(table.c.id == customer._id)
+            .values(open_balance=D(5), total_spend=D(7))
+        )
+    customer.open_balance, customer.total_spend = D(5), D(7)
+
+    check = await check_balances()
+    assert check.customers == 2
+    assert [row[0] for row in check.drifted] == [customer._id]
+    assert check.drifted[0][3:] == (D(100), D())
+
+    rebuilt = await rebuild_balances()
+    assert [row[0] for row in rebuilt.drifted] == [customer._id]
+    assert await stored_balances(customer) == (D(100), D())
+    assert (customer.open_balance, customer.total_spend) == (D(100), D())
+    assert not (await check_balances()).drifted
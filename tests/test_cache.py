@@ -0,0 +1,79 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import gc
+
+from zerobooks.db import close_database, open_database
+from zerobooks.models.api import Customer, Product
+from zerobooks.models.cache import ModelCache
+
+
+def test_lru_eviction():
+    cache = ModelCache(capacity=2)
+    products = [Product(name=f"P{i}") for i in range(3)]
+    for i, product in enumerate(products):
+        cache[i] = product
+    assert list(cache.recent) == [1, 2]
+
+    # Evicted from the LRU but still found while it is referenced
+    assert cache.get(0) is products[0]
+    assert list(cache.recent) == [2, 0]
+    assert len(cache) == 3
+
+    # Unreferenced instances out of the LRU are dropped
+    del products
+    gc.collect()
+    assert sorted(cache) == [0, 2]
+    assert cache.get(1) is None
+
+    cache.clear()
+    assert len(cache) == len(cache.recent) == 0
+
+
+def test_hit_rate():
+    cache = ModelCache()
+    product = Product(name="Shoes")
+    assert cache.hit_rate == 0.0
+    assert cache.get(1) is None
+    cache[1] = product
+    assert cache.get(1) is product
+    assert cache.get(1) is product
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_rate == 2 / 3
+
+    cache.pop(1)
+    assert 1 not in cache.recent
+    assert cache.get(1, product) is product
+    assert cache.misses == 2
+
+
+async def test_identity(customer):
+    assert isinstance(Customer.objects.cache, ModelCache)
+    assert await Customer.objects.get(id=customer._id) is customer
+    [loaded] = await Customer.objects.filter(id=customer._id)
+    assert loaded is customer
+    assert Customer.objects.cache.hits >= 2
+
+
+async def test_cleared_on_close(db_file):
+    await open_database(db_file)
+    product = Product(name="Shoes")
+    await product.save()
+    cache = Product.objects.cache
+    assert cache.get(product._id) is product
+    await close_database()
+    assert len(cache) == len(cache.recent) == 0
+
+    # Each session gets a new cache
+    await open_database(db_file)
+    try:
+        assert Product.objects.cache is not cache
+        loaded = await Product.objects.get(id=product._id)
+        assert loaded is not product
+        assert loaded.name == "Shoes"
+    finally:
+        await close_database()
@@ -0,0 +1,107 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from decimal import Decimal as D
+
+import pytest
+
+from zerobooks.datasource import ModelDataSource
+from zerobooks.models.api import Invoice, InvoiceItem, Product
+
+
+@pytest.fixture
+async def products(db):
+    products = []
+    for i in range(25):
+        product = Product(name=f"Product {i}", price=D(i))
+        await product.save()
+        products.append(product)
+    return products
+
+
+async def load_all(source: ModelDataSource) -> list:
+    """Load each page in order like scrolling down the list."""
+    rows = []
+    last = (source.count - 1) // source.page_size
+    for page in range(last + 1):
+        await source.load_page(page)
+        rows.extend(source.pages[page])
+    return rows
+
+
+async def test_refresh_counts_rows(products):
+    source = ModelDataSource(model=Product, page_size=10)
+    await source.refresh()
+    assert source.total == 25
+    assert source.count == 25
+
+
+async def test_keyset_paging(products):
+    source = ModelDataSource(model=Product, page_size=10)
+    await source.refresh()
+    rows = await load_all(source)
+    assert rows == products
+    # Each page after the first seeks past the last row of the one before
+    assert source.cursors == {
+        1: products[9]._id,
+        2: products[19]._id,
+        3: products[-1]._id,
+    }
+
+
+async def test_keyset_paging_descending(products):
+    source = ModelDataSource(model=Product, page_size=10, descending=True)
+    await source.refresh()
+    rows = await load_all(source)
+    assert rows == products[::-1]
+    assert source.cursors[1] == products[15]._id
+
+
+async def test_keyset_paging_skips_deleted_rows(products):
+    source = ModelDataSource(model=Product, page_size=10)
+    await source.refresh()
+    await source.load_page(0)
+    # Rows removed before the next page is loaded do not shift it
+    await products[10].delete()
+    await source.load_page(1)
+    assert source.pages[1] == products[11:21]
+
+
+async def test_unloaded_rows_are_placeholders(products):
+    source = ModelDataSource(model=Product, page_size=10)
+    await source.refresh()
+    source.loading = {0, 1, 2}  # Do not request the pages
+    assert source.get(5) is source.placeholder
+    assert source.get(100) is source.placeholder
+
+
+async def test_max_pages(products):
+    source = ModelDataSource(model=Product, page_size=5, max_pages=2)
+    await source.refresh()
+    await load_all(source)
+    assert list(source.pages) == [3, 4]
+
+
+async def test_search_where_clause(products):
+    source = ModelDataSource(model=Product, schema="product", page_size=10)
+    await source.search("price >= 20")
+    assert source.predicate is None
+    assert source.count == 5
+    assert source.total == 25
+    assert await load_all(source) == products[20:]
+
+    await source.search("")
+    assert source.count == 25
+
+
+async def test_prefetch_page(db, company):
+    invoice = Invoice(owner=company, items=[InvoiceItem(name="a", rate=D(1))])
+    await invoice.save()
+    source = ModelDataSource(model=Invoice, prefetch=["owner"])
+    await source.refresh()
+    await source.load_page(0)
+    assert source.get(0).owner is company
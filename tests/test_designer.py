@@ -0,0 +1,132 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import asyncio
+import marshal
+import types
+
+import enaml
+import pytest
+
+from zerobooks import designer
+from zerobooks.designer import (
+    TemplateCompiler,
+    compile_source,
+    runtime_diagnostics,
+    split_blocks,
+)
+
+FILENAME = "invoice.enaml"
+
+SOURCE = """from enaml.core.api import Declarative
+
+
+def fail():
+    return 1 / 0
+
+
+enamldef InvoiceTemplate(Declarative):
+    attr number = 1
+"""
+
+
+@pytest.fixture(autouse=True)
+def blocks():
+    """Start without any parsed blocks."""
+    designer.blocks.clear()
+    yield designer.blocks
+    designer.blocks.clear()
+
+
+def load(code: bytes) -> types.ModuleType:
+    module = types.ModuleType("__designer__")
+    module.__file__ = FILENAME
+    with enaml.imports():
+        exec(marshal.loads(code), module.__dict__)
+    return module
+
+
+def test_split_blocks():
+    source = (
+        "import os\n"
+        "# About f\n"
+        "@decorator\n"
+        "def f(\n"
+        "    a,\n"
+        "):\n"
+        "    pass\n"
+        "\n"
+        "if a:\n"
+        "    pass\n"
+        "else:\n"
+        "    pass\n"
+    )
+    blocks = split_blocks(source)
+    assert [start for start, _ in blocks] == [1, 3, 9]
+    assert "".join(text for _, text in blocks) == source
+    assert blocks[0][1] == "import os\n# About f\n"
+
+    # The parser reports what cannot be tokenized
+    assert split_blocks("x = (\n") == [(1, "x = (\n")]
+
+
+def test_blocks_reused():
+    code, errors, parsed = compile_source(SOURCE, FILENAME)
+    assert (errors, parsed) == ([], 3)
+    assert load(code).InvoiceTemplate is not None
+
+    # Only the edited block is parsed again
+    edited = SOURCE.replace("attr number = 1", "attr number = 2")
+    code, errors, parsed = compile_source(edited, FILENAME)
+    assert (errors, parsed) == ([], 1)
+    assert load(code).InvoiceTemplate().number == 2
+
+    # And moving blocks does not parse them again
+    code, errors, parsed = compile_source(f"\n\n{edited}", FILENAME)
+    assert (errors, parsed) == ([], 0)
+
+
+def test_syntax_error_lines():
+    compile_source(SOURCE, FILENAME)
+    source = "\n" + SOURCE.replace("return 1 / 0", "return 1 +* 0")
+    code, errors, parsed = compile_source(source, FILENAME)
+    assert code is None
+    assert [(line, message) for line, _, message in errors] == [(6, "invalid syntax")]
+    assert parsed == 1
+
+
+def test_runtime_error_lines():
+    # The cached blocks moved down two lines still report their own line
+    compile_source(SOURCE, FILENAME)
+    code, errors, parsed = compile_source(f"\n\n{SOURCE}", FILENAME)
+    assert parsed == 0
+    with pytest.raises(ZeroDivisionError) as e:
+        load(code).fail()
+    [diagnostic] = runtime_diagnostics(e.value, FILENAME)
+    assert diagnostic.line == 7
+    assert diagnostic.message == "ZeroDivisionError: division by zero"
+
+    # Errors outside the template are on the first line
+    try:
+        raise ValueError("Not in the template")
+    except ValueError as error:
+        [diagnostic] = runtime_diagnostics(error, FILENAME)
+    assert diagnostic.line == 1
+
+
+async def test_stale_results_dropped():
+    compiler = TemplateCompiler(filename=FILENAME)
+    try:
+        sources = [SOURCE.replace("number = 1", f"number = {i}") for i in range(3)]
+        results = await asyncio.gather(*(compiler.compile(s) for s in sources))
+        # Only the newest compile has a result
+        assert results[:2] == [None, None]
+        result = results[2]
+        assert result.diagnostics == []
+        assert compiler.load(result.code)().number == 2
+    finally:
+        compiler.stop()
@@ -0,0 +1,111 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import os
+
+import pytest
+
+from zerobooks.documents import DocumentCache, invoice_key
+from zerobooks.models.api import Invoice
+
+
+@pytest.fixture
+def cache(tmp_path) -> DocumentCache:
+    return DocumentCache(directory=str(tmp_path / "documents"), max_size=1000)
+
+
+def tmp_files(cache: DocumentCache) -> list[str]:
+    return [
+        name
+        for _, _, names in os.walk(cache.directory)
+        for name in names
+        if name.endswith(".tmp")
+    ]
+
+
+def test_hit_and_miss(cache):
+    assert cache.get("ab12", ".pdf") is None
+    cache.put("ab12", ".pdf", b"data")
+    assert cache.get("ab12", ".pdf") == b"data"
+    assert cache.get("ab12", ".html") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_overwrite_counts_size_once(cache):
+    cache.put("ab12", ".pdf", b"x" * 100)
+    cache.put("ab12", ".pdf", b"x" * 300)
+    assert cache.size == 300
+    cache.put("cd34", ".pdf", b"x" * 50)
+    assert cache.size == 350
+
+
+def test_evict_least_recently_used(cache):
+    for i, key in enumerate(("aa", "bb", "cc")):
+        cache.put(key, ".pdf", b"x" * 300)
+        # Used in order a second apart
+        os.utime(cache.path(key, ".pdf"), (1000 + i, 1000 + i))
+    os.utime(cache.path("aa", ".pdf"), (2000, 2000))
+    assert cache.size == 900
+
+    # Over the limit so files are removed until it is under 90% of it
+    cache.put("dd", ".pdf", b"x" * 300)
+    assert cache.size == 900
+    assert cache.get("bb", ".pdf") is None
+    for key in ("aa", "cc", "dd"):
+        assert cache.get(key, ".pdf") is not None
+    assert sum(size for _, size, _ in cache.files()) == cache.size
+
+
+def test_failed_write_removes_tmp(cache, tmp_path):
+    cache.put("ab12", ".pdf", b"data")
+
+    def fail(f):
+        f.write(b"partial")
+        raise ValueError("Render failed")
+
+    cache.write("ab12", ".html", fail)
+    cache.put_file("cd34", ".pdf", str(tmp_path / "missing.pdf"))
+    assert tmp_files(cache) == []
+    assert cache.size == 4
+    assert cache.get("ab12", ".html") is None
+
+    # Files being written by another process are not counted
+    with open(f"{cache.path('ab12', '.pdf')}.123.tmp", "wb") as f:
+        f.write(b"x" * 2000)
+    assert [path for _, _, path in cache.files()] == [cache.path("ab12", ".pdf")]
+
+
+def test_copy_to(cache, tmp_path):
+    dest = str(tmp_path / "invoice.pdf")
+    assert not cache.copy_to("ab12", ".pdf", dest)
+    cache.put("ab12", ".pdf", b"data")
+    assert cache.copy_to("ab12", ".pdf", dest)
+    with open(dest, "rb") as f:
+        assert f.read() == b"data"
+
+    # The copy cannot replace a directory
+    dest = str(tmp_path / "directory")
+    os.mkdir(dest)
+    assert not cache.copy_to("ab12", ".pdf", dest)
+    assert not os.path.exists(f"{dest}.tmp")
+
+
+def test_key_changes_with_template_source(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    source = tmp_path / "document_template.py"
+    source.write_text("InvoiceTemplate = None\n")
+    invoice = Invoice(number="10001", template_module="document_template")
+    key = invoice_key(invoice)
+    assert invoice_key(invoice) == key
+
+    invoice.number = "10002"
+    assert invoice_key(invoice) != key
+    invoice.number = "10001"
+    assert invoice_key(invoice) == key
+
+    source.write_text("InvoiceTemplate = None  # Changed\n")
+    assert invoice_key(invoice) != key
@@ -0,0 +1,134 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import csv
+import gzip
+import json
+import os
+from decimal import Decimal as D
+
+import pytest
+
+from zerobooks.exporter import columns, export_kind, export_ledger, plain
+from zerobooks.importer import import_file
+from zerobooks.models.api import Invoice, InvoiceItem
+from zerobooks.models.payment import Payment, Refund
+
+
+@pytest.fixture
+async def ledger(company, customer, tmp_path):
+    """Import invoices from a file and pay and refund the first one."""
+    path = tmp_path / "import.jsonl"
+    with open(path, "w") as f:
+        for n in range(5):
+            items = [
+                {"name": f"Item {n}", "quantity": "2", "rate": "10.25"},
+                {"name": "Shipping", "rate": "5", "taxable": "no"},
+            ]
+            record = {
+                "number": str(500 + n),
+                "customer": customer._id,
+                "status": "open",
+                "date": f"2023-01-0{n + 1}",
+                "items": items,
+            }
+            f.write(json.dumps(record) + "\n")
+    stats = await import_file("invoices", str(path))
+    assert stats.created == 5
+    invoice = await Invoice.objects.get(number="500")
+    payment = Payment(invoice=invoice, customer=customer, amount=D("25.50"))
+    await payment.save()
+    refund = Refund(payment=payment, amount=D("5"))
+    await refund.save()
+    return path
+
+
+def read_csv(path: str) -> list[dict]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def read_jsonl(path: str) -> list[dict]:
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def without_keys(rows: list[dict]) -> list[dict]:
+    """Drop the columns that change when the rows are imported again."""
+    keys = ("id", "uuid", "invoice_id", "created", "updated")
+    return [{k: v for k, v in row.items() if k not in keys} for row in rows]
+
+
+def test_plain():
+    assert plain(None) == ""
+    assert plain(D("10.2500000000")) == "10.25"
+    assert plain(D("5.0000000000")) == "5.00"
+    assert plain(D("0.3333333333")) == "0.3333333333"
+
+
+async def test_round_trip(ledger, customer, tmp_path):
+    directory = str(tmp_path / "export")
+    stats = await export_ledger(directory, page_size=2)
+    assert stats.counts == {"invoices": 5, "items": 10, "payments": 1, "refunds": 1}
+
+    invoices = read_csv(os.path.join(directory, "invoices.csv"))
+    assert tuple(invoices[0]) == columns("invoices")
+    assert [row["number"] for row in invoices] == ["500", "501", "502", "503", "504"]
+    assert {row["total_amount"] for row in invoices} == {"25.50"}
+    assert {row["customer_email"] for row in invoices} == {customer.email}
+    assert invoices[2]["date"] == "2023-01-03T00:00:00"
+
+    items = read_csv(os.path.join(directory, "items.csv"))
+    items = sorted(items, key=lambda row: (row["invoice_number"], row["position"]))
+    values = [(r["name"], r["quantity"], r["rate"], r["amount"]) for r in items]
+    assert values[:2] == [
+        ("Item 0", "2.00", "10.25", "20.50"),
+        ("Shipping", "1.00", "5.00", "5.00"),
+    ]
+    assert items[0]["invoice_number"] == items[1]["invoice_number"] == "500"
+
+    payments = read_csv(os.path.join(directory, "payments.csv"))
+    refunds = read_csv(os.path.join(directory, "refunds.csv"))
+    assert payments[0]["amount"] == "25.50"
+    assert refunds[0]["payment_id"] == payments[0]["id"]
+
+    # Import the exported invoices again and export them
+    for invoice in await Invoice.objects.all():
+        await invoice.delete()
+    path = str(tmp_path / "reimport.jsonl")
+    with open(path, "w") as f:
+        for row in invoices:
+            row_items = [r for r in items if r["invoice_id"] == row["id"]]
+            record = dict(row, customer=row["customer_id"], items=row_items)
+            f.write(json.dumps(record) + "\n")
+    stats = await import_file("invoices", path)
+    assert stats.created == 5
+    directory = str(tmp_path / "reexport")
+    await export_ledger(directory)
+    assert without_keys(read_csv(os.path.join(directory, "invoices.csv"))) == (
+        without_keys(invoices)
+    )
+    reexported = read_csv(os.path.join(directory, "items.csv"))
+    reexported.sort(key=lambda row: (row["invoice_number"], row["position"]))
+    assert without_keys(reexported) == without_keys(items)
+
+
+async def test_export_jsonl_gzip(ledger, tmp_path):
+    path = str(tmp_path / "items.jsonl.gz")
+    stats = await export_kind("items", path, "jsonl", compress=True)
+    assert stats.counts == {"items": 10}
+    rows = read_jsonl(path)
+    assert len(rows) == await InvoiceItem.objects.count()
+    assert set(rows[0]) == set(columns("items"))
+    assert rows[0]["rate"] == "10.25"
+
+
+async def test_export_errors(db, tmp_path):
+    with pytest.raises(ValueError):
+        await export_kind("customers", str(tmp_path / "customers.csv"))
+    with pytest.raises(ValueError):
+        await export_kind("items", str(tmp_path / "items.xml"), "xml")
@@ -0,0 +1,134 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import csv
+import json
+from decimal import Decimal as D
+
+import pytest
+
+from zerobooks.importer import import_file, to_decimal
+from zerobooks.models.api import Address, Customer, Invoice, InvoiceItem, Product
+
+
+def write_csv(path, rows: list[dict]) -> str:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def write_jsonl(path, rows: list[dict]) -> str:
+    with open(path, "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+    return str(path)
+
+
+def test_to_decimal():
+    assert to_decimal("$1,234.50") == D("1234.50")
+    assert to_decimal("", D(1)) == D(1)
+
+
+async def test_import_customers(db, tmp_path):
+    address = {"street": "1 Main St", "city": "Springfield", "state": "il"}
+    rows = [
+        {"name": "John Doe", "email": "john@doe.com", "phone": "", **address},
+        {"name": "Jane Doe", "email": "jane@doe.com", "phone": "", **address},
+        {"name": "", "email": "nobody@doe.com", "phone": "", **address},
+        {"name": "Bad Phone", "email": "", "phone": "12", **address},
+    ]
+    path = write_csv(tmp_path / "customers.csv", rows)
+    stats = await import_file("customers", path, chunk_size=2)
+    assert (stats.rows, stats.created, stats.skipped) == (4, 2, 2)
+    assert [line for line, _ in stats.errors] == [3, 4]
+
+    customers = await Customer.objects.filter(internal=False).order_by("id")
+    assert [(c.first_name, c.last_name) for c in customers] == [
+        ("John", "Doe"),
+        ("Jane", "Doe"),
+    ]
+    # Both customers share the same billing address
+    assert len({c.billing_address._id for c in customers}) == 1
+    addresses = await Address.objects.all()
+    assert [a.state for a in addresses] == ["IL"]
+
+
+async def test_import_products(db, tmp_path):
+    rows = [
+        {"name": "Shoes", "price": "$1,200.50", "taxable": "yes"},
+        {"name": "Laces", "price": "abc"},
+    ]
+    path = write_jsonl(tmp_path / "products.jsonl", rows)
+    stats = await import_file("products", path)
+    assert (stats.created, stats.skipped) == (1, 1)
+    product = await Product.objects.get(name="Shoes")
+    assert product.price == D("1200.50")
+    assert product.taxable
+
+
+async def test_import_invoices(company, customer, tmp_path):
+    rows = [
+        # The items of one invoice are consecutive records with its number
+        {
+            "number": "500",
+            "customer_email": "JOHN@doe.com",
+            "status": "open",
+            "item_name": "Shoes",
+            "item_quantity": "2",
+            "item_rate": "10",
+        },
+        {
+            "number": "500",
+            "customer_email": "",
+            "status": "",
+            "item_name": "Laces",
+            "item_quantity": "",
+            "item_rate": "1",
+        },
+        # Numbered from the sequence of the company
+        {
+            "number": "",
+            "customer_email": "john@doe.com",
+            "status": "paid",
+            "item_name": "Socks",
+            "item_quantity": "1",
+            "item_rate": "5",
+        },
+        {
+            "number": "501",
+            "customer_email": "nobody@doe.com",
+            "status": "open",
+            "item_name": "Hat",
+            "item_quantity": "1",
+            "item_rate": "5",
+        },
+    ]
+    path = write_csv(tmp_path / "invoices.csv", rows)
+    stats = await import_file("invoices", path)
+    assert (stats.rows, stats.created, stats.skipped) == (3, 2, 1)
+    assert stats.errors == [(4, "No customer with email 'nobody@doe.com'")]
+
+    invoices = await Invoice.objects.filter(owner=company._id).order_by("id")
+    assert [(i.number, i.total_amount) for i in invoices] == [
+        ("500", D(21)),
+        ("10000", D(5)),
+    ]
+    items = await InvoiceItem.objects.filter(invoice=invoices[0]._id).order_by(
+        "position"
+    )
+    assert [(i.name, i.quantity, i.amount) for i in items] == [
+        ("Shoes", D(2), D(20)),
+        ("Laces", D(1), D(1)),
+    ]
+    # Only the open invoice adds to the balance
+    assert customer.open_balance == D(21)
+
+
+async def test_import_unknown_kind(db, tmp_path):
+    with pytest.raises(ValueError):
+        await import_file("payments", str(tmp_path / "payments.csv"))
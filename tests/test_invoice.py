@@ -0,0 +1,116 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from decimal import Decimal as D
+
+from zerobooks.models.api import Invoice, InvoiceItem
+
+
+async def test_items_added_while_loading_are_kept(company):
+    invoice = Invoice(owner=company, items=[InvoiceItem(name="a", rate=D(1))])
+    await invoice.save()
+    invoice.items_loaded = False
+    invoice.items = []
+
+    # Added in the editor before the saved items were loaded
+    added = InvoiceItem(name="b", rate=D(2))
+    invoice.items.append(added)
+    await invoice.load_items()
+    assert [item.name for item in invoice.items] == ["a", "b"]
+    assert invoice.subtotal == D(3)
+
+
+async def test_save_before_items_loaded(company):
+    invoice = Invoice(owner=company, items=[InvoiceItem(name="a", rate=D(1))])
+    await invoice.save()
+    invoice.items_loaded = False
+    invoice.items = []
+
+    invoice.items.append(InvoiceItem(name="b", rate=D(2)))
+    await invoice.save()
+    items = await InvoiceItem.objects.filter(invoice=invoice._id)
+    assert sorted(item.name for item in items) == ["a", "b"]
+
+
+def check_totals(invoice: Invoice):
+    """Check the running totals match the totals summed from the items."""
+    assert invoice.subtotal == invoice._default_subtotal()
+    assert invoice.taxable_subtotal == invoice._default_taxable_subtotal()
+    assert invoice.total_tax == invoice._default_total_tax()
+    assert invoice.total_amount == invoice._default_total_amount()
+
+
+def test_totals_add_items():
+    invoice = Invoice(tax_rate=D("0.1"))
+    invoice.items.append(InvoiceItem(quantity=D(2), rate=D(10), taxable=True))
+    invoice.items.extend([InvoiceItem(rate=D(5)), InvoiceItem(rate=D(1))])
+    invoice.items.insert(0, InvoiceItem(rate=D(3), taxable=True))
+    assert invoice.subtotal == D(29)
+    assert invoice.taxable_subtotal == D(23)
+    assert invoice.total_tax == D("2.30")
+    assert invoice.total_amount == D("31.30")
+    check_totals(invoice)
+
+
+def test_totals_edit_items():
+    item = InvoiceItem(rate=D(10), taxable=True)
+    other = InvoiceItem(rate=D(5))
+    invoice = Invoice(tax_rate=D("0.0825"), items=[item, other])
+    assert invoice.total_amount == D("15.83")
+
+    item.quantity = D(3)
+    assert invoice.subtotal == D(35)
+    assert invoice.total_tax == D("2.48")
+    other.taxable = True
+    assert invoice.taxable_subtotal == D(35)
+    item.taxable = False
+    assert invoice.taxable_subtotal == D(5)
+    invoice.total_adjustments = D(-1)
+    assert invoice.total_amount == D("34.41")
+    check_totals(invoice)
+
+    # Replacing an item stops observing the old one
+    invoice.items[0] = InvoiceItem(rate=D(1))
+    item.rate = D(100)
+    assert invoice.subtotal == D(6)
+    check_totals(invoice)
+
+
+def test_totals_delete_items():
+    items = [InvoiceItem(rate=D(i), taxable=i % 2 == 0) for i in range(10)]
+    invoice = Invoice(tax_rate=D("0.5"), items=list(items))
+    assert invoice.subtotal == D(45)
+    assert invoice.taxable_subtotal == D(20)
+
+    invoice.items.pop()
+    invoice.items.remove(items[8])
+    del invoice.items[:2]
+    assert invoice.subtotal == D(27)
+    assert invoice.taxable_subtotal == D(12)
+    assert invoice.total_tax == D(6)
+    check_totals(invoice)
+
+    # Removed items no longer change the totals
+    items[0].rate = D(100)
+    items[9].taxable = True
+    check_totals(invoice)
+
+    invoice.items = []
+    assert invoice.total_amount == D()
+    items[5].rate = D(100)
+    assert invoice.total_amount == D()
+
+
+def test_tax_rounds_half_up():
+    invoice = Invoice(tax_rate=D("0.05"), items=[InvoiceItem(rate=D("0.5"))])
+    assert invoice.total_tax == D()
+    invoice.items[0].taxable = True
+    # 0.025 rounds up to a cent
+    assert invoice.total_tax == D("0.03")
+    invoice.tax_rate = D()
+    assert invoice.total_tax == D()
+    check_totals(invoice)
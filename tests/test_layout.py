@@ -0,0 +1,111 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+The items are only declared, no widgets are created, but the views import the
+app so these need the Qt packages.
+"""
+from importlib import import_module
+
+import enaml
+import pytest
+from enaml.layout.api import AreaLayout, TabLayout
+
+from zerobooks.models.api import Customer, Invoice, Product
+
+pytest.importorskip("asyncqtpy")
+
+with enaml.imports():
+    from zerobooks.core import RESTORED_ITEMS, CorePlugin
+    from zerobooks.views.dock import PendingDockItem
+    from zerobooks.widgets import LAYOUT_VERSION, DockArea
+
+
+class LayoutArea(DockArea):
+    """Keeps the layout without a widget."""
+
+    def save_layout(self):
+        return self.layout
+
+    def apply_layout(self, layout):
+        self.layout = layout
+
+
+#: A new model of each kind of restored item
+MODELS = {
+    Customer: lambda: Customer(company="Acme", display_name_format="{company}"),
+    Invoice: Invoice,
+    Product: lambda: Product(name="Shoes"),
+}
+
+
+def restored_item(kind: str):
+    """Create the item of the kind with a new model."""
+    Model, module, name, related = RESTORED_ITEMS[kind]
+    with enaml.imports():
+        Item = getattr(import_module(module), name)
+    if Model is None:
+        return Item()
+    return Item(**{Model.__name__.lower(): MODELS[Model]()})
+
+
+@pytest.mark.parametrize("kind", RESTORED_ITEMS)
+def test_pending_item_has_the_name_of_the_item(kind):
+    item = restored_item(kind)
+    saved = item.save_state()
+    assert saved["kind"] == kind
+    pending = PendingDockItem(kind=kind, uuid=saved.get("uuid", ""))
+    assert pending.name == item.name
+    # Saved again before it was shown
+    assert pending.save_state()["uuid"] == saved.get("uuid", "")
+
+
+def test_restore_area():
+    area = LayoutArea()
+    layout = AreaLayout(TabLayout("invoice-edit-abc", "company-view"))
+    state = {
+        "version": LAYOUT_VERSION,
+        "layout": layout,
+        "items": [
+            # Created with the area so not restored
+            {"kind": "company-view", "title": "Company"},
+            {"kind": "invoice-edit", "uuid": "abc", "title": "Invoice - 1"},
+            {"kind": "invoice-edit", "uuid": "abc", "title": "Invoice - 1"},
+        ],
+    }
+    CorePlugin().restore_area(area, state)
+    items = area.dock_items()
+    assert [(item.name, item.title) for item in items] == [
+        ("invoice-edit-abc", "Invoice - 1")
+    ]
+    assert area.layout.items == [layout]
+
+
+async def test_save_and_restore(company):
+    invoice = Invoice(owner=company)
+    await invoice.save()
+    area = LayoutArea()
+    item = restored_item("invoice-edit")
+    item.invoice = invoice
+    item.set_parent(area)
+    area.layout = AreaLayout(TabLayout(item.name))
+    state = area.save_state()
+
+    plugin = CorePlugin()
+    restored = plugin.area = LayoutArea()
+    plugin.restore_area(restored, state)
+    [pending] = restored.dock_items()
+    assert isinstance(pending, PendingDockItem)
+    assert pending.name == item.name
+
+    # Shown, so it is swapped for the real item
+    await plugin.load_item(pending)
+    assert pending.is_destroyed
+    [loaded] = restored.dock_items()
+    assert type(loaded) is type(item)
+    assert loaded.name == item.name
+    assert loaded.invoice._id == invoice._id
+    assert restored.layout is state["layout"]
@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from zerobooks.__main__ import COMMANDS, main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: Modules of the app the commands must not import
+UI_MODULES = ("qtpy", "enaml.widgets", "weasyprint", "zerobooks.core")
+
+#: Run the command given as json and print the exit code and the UI modules
+#: it imported on the last line
+SCRIPT = f"""
+import json, sys
+from zerobooks.__main__ import main
+sys.argv = ["zerobooks", *json.loads(sys.argv[1])]
+try:
+    main()
+except SystemExit as e:
+    code = e.code
+loaded = [name for name in {UI_MODULES!r} if name in sys.modules]
+print(json.dumps({{"code": code, "loaded": loaded}}))
+"""
+
+
+def run_command(*args: str) -> dict:
+    """Run the command in a new interpreter."""
+    path = os.pathsep.join(filter(None, (ROOT, os.environ.get("PYTHONPATH"))))
+    process = subprocess.run(
+        [sys.executable, "-c", SCRIPT, json.dumps(args)],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=path),
+    )
+    assert process.returncode == 0, process.stderr
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize("name", COMMANDS)
+def test_command_usage(name, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["zerobooks", name, "--help"])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    assert capsys.readouterr().out.startswith(f"usage: python -m zerobooks {name} ")
+
+
+def test_usage(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["zerobooks", "--help"])
+    with pytest.raises(SystemExit):
+        main()
+    out = capsys.readouterr().out
+    for name in COMMANDS:
+        assert f"  {name} " in out
+
+
+@pytest.mark.parametrize("name", COMMANDS)
+def test_command_help_is_headless(name):
+    result = run_command(name, "--help")
+    assert result == {"code": 0, "loaded": []}
+
+
+def test_commands_are_headless(db_file, tmp_path):
+    commands = [
+        ("backup", "--db", db_file, str(tmp_path / "backup.db")),
+        ("balances", "--check", "--db", db_file),
+        ("export", "--db", db_file, str(tmp_path / "export")),
+        ("export-pdf", "--no-cache", "--db", db_file, str(tmp_path / "pdfs")),
+        ("reports", "--db", db_file),
+        ("snapshot", "--path", str(tmp_path / "snapshot"), "--db", db_file),
+    ]
+    for command in commands:
+        result = run_command(*command)
+        assert result == {"code": 0, "loaded": []}, command
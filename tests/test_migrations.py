@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import json
+import sqlite3
+from datetime import datetime
+from decimal import Decimal as D
+
+import pytest
+from conftest import migrate
+
+from zerobooks.db import close_database, open_database
+from zerobooks.models.api import Invoice
+from zerobooks.search import search_ids
+
+#: Revision before the items were moved out of the invoice
+JSON_ITEMS_REVISION = "8f2838d86f9c"
+
+
+def decimal(value: str) -> dict:
+    return {"__py__": "decimal", "value": value}
+
+
+def insert_invoice(connection, id: int, number: str, items: str):
+    now = datetime(2023, 1, 1).isoformat(" ")
+    connection.execute(
+        "INSERT INTO invoice (uuid, created, updated, id, number, date, "
+        "due_date, terms, notes, project, items, subtotal, total_adjustments, "
+        "total_tax, total_amount, status, template_module) VALUES "
+        "(?, ?, ?, ?, ?, ?, ?, 'Net 30', '', '', ?, 0, 0, 0, 0, 'open', '')",
+        (f"uuid-{id}", now, now, id, number, now, now, items),
+    )
+
+
+@pytest.fixture
+def json_items_db(tmp_path) -> str:
+    """Path of a database with invoices created before the items were moved
+    out of the invoice and then upgraded.
+
+    """
+    path = str(tmp_path / "zerobooks.db")
+    migrate(path, JSON_ITEMS_REVISION)
+    items = [
+        {
+            "name": "Shoes",
+            "quantity": decimal("2"),
+            "rate": decimal("1.50"),
+            "amount": decimal("3.00"),
+            "__model__": "zerobooks.models.invoice.InvoiceItem",
+        },
+        # Plain numbers and the amount left out
+        {"name": "Laces", "description": "Red", "quantity": 3, "rate": 0.25},
+    ]
+    with sqlite3.connect(path) as connection:
+        insert_invoice(connection, 1, "10000", json.dumps(items))
+        insert_invoice(connection, 2, "10001", "[]")
+    connection.close()
+    migrate(path)
+    return path
+
+
+async def test_items_moved_to_table(json_items_db):
+    await open_database(json_items_db)
+    try:
+        invoice = await Invoice.objects.get(id=1)
+        await invoice.load_items()
+        assert [
+            (i.position, i.name, i.description, i.quantity, i.rate, i.amount)
+            for i in invoice.items
+        ] == [
+            (0, "Shoes", "", D("2"), D("1.50"), D("3.00")),
+            (1, "Laces", "Red", D("3"), D("0.25"), D("0.75")),
+        ]
+        assert invoice.subtotal == invoice.total_amount == D("3.75")
+        empty = await Invoice.objects.get(id=2)
+        assert await empty.load_items() == []
+
+        # The fts rows are built from the moved items
+        assert await search_ids("invoice", "laces") == [1]
+        assert await search_ids("invoice", "10001") == [2]
+    finally:
+        await close_database()
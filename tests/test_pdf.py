@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+The html is written as is instead of converting it with weasyprint.
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from zerobooks import pdf
+from zerobooks.documents import DocumentCache
+from zerobooks.models.api import Invoice
+from zerobooks.pdf import PdfWorker, export_pdfs, find_invoices
+
+
+def write_html(html: str, path: str) -> str:
+    """Runs in the worker processes in place of `write_pdf`."""
+    if "write error" in html:
+        raise ValueError("Cannot write")
+    with open(path, "w") as f:
+        f.write(html)
+    return path
+
+
+def write_or_crash(html: str, path: str) -> str:
+    """Runs in the pdf worker, the worker exits as if it crashed if the html
+    is crash.
+
+    """
+    if html == "crash":
+        os._exit(1)
+    write_html(html, path)
+    return f"{os.getpid()}:{path}"
+
+
+def render(invoice) -> str:
+    if invoice.project == "render error":
+        raise ValueError("Cannot render")
+    return f"<p>{invoice.number} {invoice.project}</p>"
+
+
+@pytest.fixture
+async def invoices(company, customer):
+    invoices = []
+    for i, (day, status, project) in enumerate(
+        [
+            (datetime(2023, 3, 1), "open", ""),
+            (datetime(2023, 1, 1), "open", "render error"),
+            (datetime(2023, 2, 1), "paid", ""),
+            (datetime(2023, 4, 1), "open", "write error"),
+            (datetime(2023, 5, 1), "open", ""),
+        ]
+    ):
+        invoice = Invoice(
+            owner=company, customer=customer, date=day, status=status, project=project
+        )
+        await invoice.save()
+        invoices.append(invoice)
+    return invoices
+
+
+async def test_find_invoices(invoices):
+    ids = [invoice._id for invoice in invoices]
+    assert await find_invoices() == [ids[1], ids[2], ids[0], ids[3], ids[4]]
+    assert await find_invoices("paid") == [ids[2]]
+    assert await find_invoices(
+        "open", since=datetime(2023, 3, 1), until=datetime(2023, 5, 1)
+    ) == [ids[0], ids[3]]
+
+
+async def test_export_pdfs(invoices, tmp_path, monkeypatch):
+    monkeypatch.setattr("zerobooks.templates.registry.render_invoice", render)
+    # The invoices are loaded a batch at a time
+    monkeypatch.setattr(pdf, "BATCH_SIZE", 2)
+    directory = str(tmp_path / "pdfs")
+    progress = []
+    ids = await find_invoices()
+    stats = await export_pdfs(
+        ids,
+        directory,
+        workers=2,
+        progress=lambda s: progress.append(s.done),
+        write=write_html,
+    )
+    assert (stats.total, stats.done) == (5, 3)
+    assert progress == [1, 2, 3]
+
+    # Errors rendering and writing are collected
+    numbers = {invoice.project: invoice.number for invoice in invoices}
+    assert sorted(stats.failed) == sorted(
+        [
+            (numbers["render error"], "Cannot render"),
+            (numbers["write error"], "Cannot write"),
+        ]
+    )
+    assert sorted(os.listdir(directory)) == sorted(
+        os.path.basename(path) for path in stats.files
+    )
+    for path in stats.files:
+        with open(path) as f:
+            assert f.read().startswith("<p>")
+
+
+async def test_export_pdfs_cached(invoices, tmp_path, monkeypatch):
+    monkeypatch.setattr("zerobooks.templates.registry.render_invoice", render)
+    cache = DocumentCache(directory=str(tmp_path / "cache"))
+    ids = await find_invoices(since=datetime(2023, 5, 1))
+    directory = str(tmp_path / "pdfs")
+    stats = await export_pdfs(ids, directory, 1, cache=cache, write=write_html)
+    assert (stats.done, stats.cached) == (1, 0)
+    os.remove(stats.files[0])
+
+    # Unchanged invoices are copied from the cache
+    stats = await export_pdfs(ids, directory, 1, cache=cache, write=write_html)
+    assert (stats.done, stats.cached) == (1, 1)
+    assert os.path.exists(stats.files[0])
+
+
+@pytest.fixture
+def worker():
+    worker = PdfWorker(write=write_or_crash, initializer=None)
+    yield worker
+    worker.stop()
+
+
+async def test_worker_reused(worker, tmp_path):
+    results = []
+    for i in range(3):
+        path = str(tmp_path / f"{i}.pdf")
+        results.append(await worker.write_pdf(f"<p>{i}</p>", path))
+    # Every job was done by the same process
+    pids = {result.split(":")[0] for result in results}
+    assert pids == {str(worker.process.pid)}
+    assert (worker.starts, worker.jobs) == (1, 3)
+    assert worker.baseline > 0
+
+    # Errors are raised and the worker keeps running
+    with pytest.raises(RuntimeError, match="Cannot write"):
+        await worker.write_pdf("write error", str(tmp_path / "error.pdf"))
+    assert worker.starts == 1
+
+
+async def test_worker_restarted(worker, tmp_path):
+    worker.max_jobs = 2
+    for i in range(3):
+        await worker.write_pdf(f"<p>{i}</p>", str(tmp_path / f"{i}.pdf"))
+    assert (worker.starts, worker.jobs) == (2, 1)
+
+    # A new process is started for the job after the worker crashed
+    pid = worker.process.pid
+    with pytest.raises(RuntimeError, match="stopped unexpectedly"):
+        await worker.write_pdf("crash", str(tmp_path / "crash.pdf"))
+    assert worker.process is None
+    path = str(tmp_path / "after.pdf")
+    result = await worker.write_pdf("<p>after</p>", path)
+    assert result == f"{worker.process.pid}:{path}"
+    assert worker.process.pid != pid
+    assert worker.starts == 3
+    with open(path) as f:
+        assert f.read() == "<p>after</p>"
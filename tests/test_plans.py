@@ -0,0 +1,224 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Check the SQLite query plans of the queries the models and views issue.
+
+Each query is run with `EXPLAIN QUERY PLAN` on a migrated database and the
+tables it scans instead of searching with an index must be exactly the ones
+the case expects.
+"""
+import re
+import sqlite3
+from datetime import date, datetime
+
+import pytest
+import sqlalchemy as sa
+from atomdb.sql import SQLModelManager
+from sqlalchemy.dialects import sqlite
+
+from zerobooks.datasource import ModelDataSource
+from zerobooks.models.api import Address, Customer, Invoice, InvoiceItem, Product
+from zerobooks.models.balance import balances_query
+from zerobooks.models.payment import Payment, Refund
+from zerobooks.models.sequence import InvoiceSequence, numbered_invoices
+from zerobooks.reports import (
+    aging_query,
+    revenue_by_customer_query,
+    revenue_by_month_query,
+    revenue_by_product_query,
+)
+from zerobooks.search import CUSTOMER_CHOICES, match_ids, match_query
+
+SCAN = re.compile(r"SCAN (?:TABLE )?(\w+)")
+
+
+def page(source: ModelDataSource, cursor=None) -> sa.sql.Select:
+    qs = source.queryset()
+    if cursor is not None:
+        pk_column = source.model.objects.table.c[source.model.__pk__]
+        qs = qs.filter(pk_column > cursor)
+    return qs.limit(source.page_size).query()
+
+
+def count(source: ModelDataSource) -> sa.sql.Select:
+    subq = source.queryset().query().alias("subquery")
+    return sa.func.count().select().select_from(subq)
+
+
+def invoice_word_search() -> sa.sql.Select:
+    table = Invoice.objects.table
+    clause = sa.or_(
+        table.c.id.in_(match_ids("invoice", "john")),
+        table.c.customer.in_(match_ids("customer", "john")),
+    )
+    return invoices.queryset().filter(clause).limit(100).query()
+
+
+customers = ModelDataSource(model=Customer, filters={"internal": False})
+invoices = ModelDataSource(model=Invoice)
+products = ModelDataSource(model=Product)
+
+# Each case is the query and the tables its plan is expected to scan
+QUERIES = {
+    "customer list first page": (lambda: page(customers), set()),
+    "customer list next page": (lambda: page(customers, 1), set()),
+    "customer list count": (lambda: count(customers), set()),
+    # Unfiltered lists read the table in rowid order and stop at the limit
+    "invoice list first page": (lambda: page(invoices), {"invoice"}),
+    "invoice list next page": (lambda: page(invoices, 1), set()),
+    # Counting every row has to visit every row
+    "invoice list count": (lambda: count(invoices), {"invoice"}),
+    "product list first page": (lambda: page(products), {"product"}),
+    "product list next page": (lambda: page(products, 1), set()),
+    "product list count": (lambda: count(products), {"product"}),
+    "invoice list page of search results": (
+        lambda: invoices.queryset()
+        .filter(Invoice.objects.table.c.id.in_([1, 2, 3]))
+        .query(),
+        set(),
+    ),
+    "invoice list search by word": (invoice_word_search, set()),
+    "global search of customers": (lambda: match_query("customer", "j", 20), set()),
+    "global search of invoices": (lambda: match_query("invoice", "j", 20), set()),
+    "global search of products": (lambda: match_query("product", "j", 20), set()),
+    "company lookup": (lambda: Customer.objects.filter(internal=True).query(), set()),
+    "invoice customer choices": (
+        lambda: Customer.objects.filter(internal=False)
+        .order_by("-id")
+        .limit(CUSTOMER_CHOICES)
+        .query(),
+        set(),
+    ),
+    "invoice customer choices matching a search": (
+        lambda: Customer.objects.filter(
+            Customer.objects.table.c.id.in_([1, 2, 3]), internal=False
+        ).query(),
+        set(),
+    ),
+    "customer by id": (lambda: Customer.objects.filter(id=1).query(), set()),
+    "address by id": (lambda: Address.objects.filter(id=1).query(), set()),
+    "invoice payments": (lambda: Payment.objects.filter(invoice=1).query(), set()),
+    "invoice items": (
+        lambda: InvoiceItem.objects.filter(invoice=1).order_by("position").query(),
+        set(),
+    ),
+    "items of a page of invoices": (
+        lambda: InvoiceItem.objects.filter(
+            InvoiceItem.objects.table.c.invoice.in_([1, 2, 3])
+        )
+        .order_by("invoice", "position")
+        .query(),
+        set(),
+    ),
+    "revenue by product": (revenue_by_product_query, set()),
+    # The balance of every customer is computed so each one is visited
+    "customer balances": (balances_query, {"customer"}),
+    "aging of open invoices": (lambda: aging_query(date(2023, 6, 1)), set()),
+    "aging of changed customers": (
+        lambda: aging_query(date(2023, 6, 1), [1, 2, 3]),
+        set(),
+    ),
+    "revenue of changed months": (
+        lambda: revenue_by_month_query(datetime(2023, 1, 1), datetime(2023, 3, 1)),
+        set(),
+    ),
+    "revenue by month": (revenue_by_month_query, set()),
+    "revenue by customer": (revenue_by_customer_query, set()),
+    "revenue of changed customers": (
+        lambda: revenue_by_customer_query([1, 2]),
+        set(),
+    ),
+    "payment refunds": (lambda: Refund.objects.filter(payment=1).query(), set()),
+    "customer payments": (lambda: Payment.objects.filter(customer=1).query(), set()),
+    "customer invoices by date": (
+        lambda: Invoice.objects.filter(customer=1).order_by("-date").query(),
+        set(),
+    ),
+    "invoices issued by the company": (
+        lambda: Invoice.objects.filter(owner=1).query(),
+        set(),
+    ),
+    "invoice number sequence of the company": (
+        lambda: InvoiceSequence.objects.filter(owner=1).query(),
+        set(),
+    ),
+    "numbered invoices of the company": (lambda: numbered_invoices(1), set()),
+    "invoices with a status": (
+        lambda: Invoice.objects.filter(status="open").query(),
+        set(),
+    ),
+    "overdue invoices": (
+        lambda: Invoice.objects.filter(
+            status="open", due_date__lt=datetime.now()
+        ).query(),
+        set(),
+    ),
+    "invoices in a date range": (
+        lambda: Invoice.objects.filter(
+            date__gte=datetime(2023, 1, 1), date__lt=datetime(2023, 2, 1)
+        ).query(),
+        set(),
+    ),
+    "snapshot invoices updated since": (
+        lambda: Invoice.objects.filter(updated__gte=datetime(2023, 1, 1)).query(),
+        set(),
+    ),
+    "snapshot payments updated since": (
+        lambda: Payment.objects.filter(updated__gte=datetime(2023, 1, 1)).query(),
+        set(),
+    ),
+    "snapshot refunds updated since": (
+        lambda: Refund.objects.filter(updated__gte=datetime(2023, 1, 1)).query(),
+        set(),
+    ),
+}
+
+
+@pytest.fixture(scope="module")
+def connection(migrated_db):
+    # Also fills in the metadata of the model tables
+    SQLModelManager.instance().create_tables()
+    connection = sqlite3.connect(migrated_db)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def explain(connection: sqlite3.Connection, query) -> list[str]:
+    """Return the lines of the query plan."""
+    compiled = query.compile(
+        dialect=sqlite.dialect(), compile_kwargs={"render_postcompile": True}
+    )
+    # The parameter values do not change the plan
+    params = [None] * len(compiled.positiontup)
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return [row[-1] for row in rows]
+
+
+def scanned_tables(plan: list[str]) -> set[str]:
+    """Return the model tables the plan scans. Scans of subqueries and fts
+    tables are not included.
+
+    """
+    tables = SQLModelManager.instance().metadata.tables
+    matches = (SCAN.match(line) for line in plan)
+    return {m.group(1) for m in matches if m and m.group(1) in tables}
+
+
+def test_scan_pattern(connection):
+    # Older versions of SQLite print "SCAN TABLE"
+    assert scanned_tables(["SCAN TABLE invoice"]) == {"invoice"}
+    assert scanned_tables(["SCAN invoice"]) == {"invoice"}
+    assert scanned_tables(["SCAN subquery"]) == set()
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_query_plan(connection, name):
+    query, scans = QUERIES[name]
+    plan = explain(connection, query())
+    assert scanned_tables(plan) == scans, "\n".join(plan)
@@ -0,0 +1,169 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import json
+
+import pytest
+
+from zerobooks.preview import PATCH_SCRIPT, PreviewChannel, attribute, with_script
+
+
+@pytest.fixture
+def view(app):
+    from web.components.api import Body, Div, Html, Span
+
+    view = Html()
+    body = Body(parent=view)
+    div = Div(parent=body, text="a", id="total")
+    Span(parent=div, text="b", id="note")
+    view.initialize()
+    view.activate_proxy()
+    return view
+
+
+class Page:
+    """Stands in for the web view showing the preview."""
+
+    def __init__(self):
+        self.loads = []
+        self.scripts = []
+        self.scheduled = []
+        self.result = True
+
+    def load(self, html: str):
+        self.loads.append(html)
+
+    def run_script(self, script: str, callback):
+        self.scripts.append(script)
+        callback(self.result)
+
+    def schedule(self, ms: int, callback):
+        self.scheduled.append(callback)
+
+    def run(self):
+        """Run the scheduled flush"""
+        callbacks, self.scheduled = self.scheduled, []
+        for callback in callbacks:
+            callback()
+
+    def patches(self) -> list[dict]:
+        prefix = "window.zerobooks && zerobooks.patch("
+        script = self.scripts[-1]
+        assert script.startswith(prefix) and script.endswith(")")
+        return json.loads(script.removeprefix(prefix)[:-1])
+
+
+@pytest.fixture
+def page(view):
+    page = Page()
+    channel = PreviewChannel(
+        load=page.load, run_script=page.run_script, schedule=page.schedule
+    )
+    channel.connect(view)
+    page.run()
+    page.channel = channel
+    return page
+
+
+@pytest.mark.parametrize(
+    "name, value, expected",
+    [
+        ("cls", ["a", "b"], ("class", "a b")),
+        ("cls", "a", ("class", "a")),
+        ("style", {"color": "red", "top": "0"}, ("style", "color:red;top:0")),
+        ("clickable", True, ("clickable", "true")),
+        ("hidden", True, ("hidden", "hidden")),
+        ("hidden", False, ("hidden", None)),
+        ("title", None, ("title", None)),
+        ("colspan", 2, ("colspan", "2")),
+    ],
+)
+def test_attribute(name, value, expected):
+    assert attribute(name, value) == expected
+
+
+def test_with_script():
+    html = with_script("<html><body></body></html>")
+    assert html.endswith(f"<script>{PATCH_SCRIPT}</script></body></html>")
+    assert with_script("<p></p>").startswith("<p></p><script>")
+
+
+def test_connect_loads_page(page, view):
+    assert len(page.loads) == 1
+    assert 'id="total"' in page.loads[0]
+    assert PATCH_SCRIPT in page.loads[0]
+    assert page.channel.synced
+
+
+def test_updates_are_merged(page, view):
+    div = view.find_by_id("total")
+    div.text = "c"
+    div.text = "d"
+    div.cls = ["x", "y"]
+    div.attrs = {"data-a": "1", "data-b": "2"}
+    div.attrs = {"data-b": "3"}
+    assert len(page.scheduled) == 1
+    page.run()
+    assert page.patches() == [
+        {"op": "text", "id": "total", "value": "d"},
+        {"op": "attr", "id": "total", "name": "class", "value": "x y"},
+        {"op": "attr", "id": "total", "name": "data-a", "value": None},
+        {"op": "attr", "id": "total", "name": "data-b", "value": "3"},
+    ]
+    assert page.channel.patches_sent == 4
+    assert len(page.loads) == 1
+
+
+def test_children_added_and_removed(page, view):
+    from web.components.api import P
+
+    div = view.find_by_id("total")
+    p = P(parent=div, text="new", id="added")
+    p.initialize()
+    view.find_by_id("note").destroy()
+    page.run()
+    assert page.patches() == [
+        {"op": "add", "id": "total", "value": '<p id="added">new</p>', "index": 1},
+        {"op": "remove", "id": "total", "value": "note"},
+    ]
+
+
+def test_reload_when_out_of_sync(page, view):
+    div = view.find_by_id("total")
+    # The page could not apply the patches
+    page.result = None
+    div.text = "c"
+    page.run()
+    assert not page.channel.synced
+    page.run()
+    assert len(page.loads) == 2
+    assert page.channel.synced
+
+    # A node that cannot be found by the page
+    div.tag = "section"
+    page.run()
+    assert len(page.loads) == 3
+    assert "<section" in page.loads[-1]
+
+
+def test_reload_when_too_many_patches(page, view):
+    page.channel.max_patches = 2
+    div = view.find_by_id("total")
+    div.text = "c"
+    div.cls = "x"
+    div.style = {"color": "red"}
+    page.run()
+    assert len(page.loads) == 2
+    assert len(page.scripts) == 0
+
+
+def test_disconnect(page, view):
+    page.channel.disconnect()
+    page.run()
+    view.find_by_id("total").text = "c"
+    assert not page.scheduled
+    assert len(page.loads) == 1
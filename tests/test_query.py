@@ -0,0 +1,235 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from datetime import datetime
+from decimal import Decimal as D
+
+import pytest
+from sqlalchemy.dialects import sqlite
+
+from zerobooks.datasource import ModelDataSource
+from zerobooks.models.api import Customer, Invoice, InvoiceItem
+from zerobooks.query import (
+    BoolOp,
+    Compare,
+    Literal,
+    Name,
+    SearchError,
+    compile_query,
+    parse,
+    tokenize,
+)
+from zerobooks.utils import safe_search
+
+
+def sql(clause) -> str:
+    compiled = clause.compile(
+        dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    return " ".join(str(compiled).split())
+
+
+# -----------------------------------------------------------------------------
+# Parser
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize(
+    "text",
+    [
+        # The examples shown in the search fields
+        '"John" in customer and amount > 500, status = open',
+        '"John" in name or balance > 100',
+        '"Shoes" in name, id = 10000',
+    ],
+)
+def test_parse_search_hints(text):
+    parse(text)
+
+
+def test_tokenize():
+    assert tokenize("amount >= 10.5, status = 'open'") == [
+        ("name", "amount"),
+        ("op", ">="),
+        ("number", D("10.5")),
+        ("op", ","),
+        ("name", "status"),
+        ("op", "=="),
+        ("string", "open"),
+    ]
+
+
+def test_comma_is_and():
+    node = parse("a = 1, b = 2 and c = 3")
+    assert isinstance(node, BoolOp)
+    assert node.op == "and"
+    assert [v.left.id for v in node.values] == ["a", "b", "c"]
+
+
+def test_and_binds_tighter_than_or():
+    node = parse("a = 1 or b = 2, c = 3")
+    assert node.op == "or"
+    assert isinstance(node.values[0], Compare)
+    assert node.values[1].op == "and"
+
+
+@pytest.mark.parametrize(
+    "text, value",
+    [
+        ("date = 2023-01-05", "2023-01-05"),
+        ('date = "2023-01-05"', "2023-01-05"),
+        ("date < 2023-01-05T10:30", "2023-01-05T10:30"),
+    ],
+)
+def test_parse_dates(text, value):
+    node = parse(text)
+    assert isinstance(node.left, Name)
+    assert isinstance(node.right, Literal)
+    assert node.right.value == value
+
+
+def test_parse_not_in():
+    node = parse('"john" not in customer')
+    assert node.op == "not in"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "amount >",
+        "(amount > 1",
+        "amount > 1)",
+        "amount > 1,",
+        ", amount > 1",
+        "amount = = 1",
+    ],
+)
+def test_parse_errors(text):
+    with pytest.raises(SearchError):
+        parse(text)
+
+
+# -----------------------------------------------------------------------------
+# Compiler
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize(
+    "text",
+    [
+        "amount > 1",
+        "amount = 500",
+        "date = 2023-01-05",
+        "status = void",
+        '"john" in customer',
+    ],
+)
+def test_compile_errors_for_other_schemas(text):
+    with pytest.raises(SearchError):
+        compile_query("product", text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "status > open",
+        "status = late",
+        "amount = abc",
+        "date = 2023-13-45",
+        '"john" in amount',
+        "nope = 1",
+    ],
+)
+def test_check_errors(text):
+    with pytest.raises(SearchError):
+        compile_query("invoice", text)
+
+
+def test_compile_to_sql():
+    text = '"John" in customer and amount > 500, status = open'
+    query = compile_query("invoice", text)
+    assert query.remainder is None
+    assert sql(query.clause) == (
+        "invoice.customer IN (SELECT customer.id FROM customer WHERE "
+        "(lower(customer.first_name || ' ' || customer.last_name) "
+        "LIKE '%' || 'john' || '%' ESCAPE '/')) "
+        "AND invoice.total_amount > 500 AND invoice.status = 'open'"
+    )
+
+
+def test_compile_date_matches_whole_day():
+    query = compile_query("invoice", "date = 2023-01-05")
+    assert sql(query.clause) == (
+        "invoice.date >= '2023-01-05 00:00:00.000000' "
+        "AND invoice.date < '2023-01-06 00:00:00.000000'"
+    )
+
+
+def test_compile_bare_words_use_fts():
+    query = compile_query("product", "shoes")
+    assert "product_fts MATCH" in sql(query.clause)
+
+
+def test_split_fields_without_a_column():
+    query = compile_query("invoice", '"acme" in display and amount > 500')
+    # Only the display term is matched in python
+    assert sql(query.clause) == "invoice.total_amount > 500"
+    acme = Invoice(customer=Customer(company="Acme", display_name="Acme"))
+    other = Invoice(customer=Customer(company="Other", display_name="Other"))
+    assert query.remainder(acme)
+    assert not query.remainder(other)
+
+
+def test_split_nested_and():
+    text = '(amount > 1 and "a" in display), status = open'
+    query = compile_query("invoice", text)
+    assert sql(query.clause) == "invoice.total_amount > 1 AND invoice.status = 'open'"
+    assert query.remainder is not None
+
+
+def test_no_split_under_or():
+    query = compile_query("invoice", '"acme" in display or amount > 500')
+    assert query.clause is None
+    assert query.remainder is not None
+
+
+def test_predicate_matches_clause():
+    query = compile_query("invoice", "amount >= 10, status != void")
+    assert query.predicate(Invoice(total_amount=D(10), status="open"))
+    assert not query.predicate(Invoice(total_amount=D(10), status="void"))
+    assert not query.predicate(Invoice(total_amount=D(9), status="open"))
+
+
+def test_safe_search():
+    scope = {"name": "John", "amount": D(600), "date": datetime(2023, 1, 5)}
+    assert safe_search(scope, '"john" in name, amount > 500')
+    assert safe_search(scope, "date = 2023-01-05")
+    assert not safe_search(scope, "amount < 500")
+    with pytest.raises(SearchError):
+        safe_search(scope, '"john" in amount')
+
+
+async def test_search_scans_only_matching_rows(company):
+    for amount, name in ((100, "Acme"), (600, "Acme"), (700, "Other")):
+        customer = Customer(company=name, display_name_format="{company}")
+        await customer.save()
+        item = InvoiceItem(rate=D(amount))
+        invoice = Invoice(owner=company, customer=customer, items=[item])
+        await invoice.save()
+
+    source = ModelDataSource(model=Invoice, schema="invoice", prefetch=["customer"])
+    scanned = []
+
+    def record(predicate):
+        def test(row):
+            scanned.append(row)
+            return predicate(row)
+
+        return test
+
+    await source.search('"acme" in display and amount > 500')
+    source.predicate = record(source.predicate)
+    await source.refresh()
+    # Only the rows the where clause matched were scanned
+    assert [row.total_amount for row in scanned] == [D(600), D(700)]
+    assert source.count == 1
@@ -0,0 +1,143 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from datetime import date, datetime
+from decimal import Decimal as D
+
+from conftest import new_invoice
+
+from zerobooks.models.api import Customer, InvoiceItem
+from zerobooks.models.payment import Payment
+from zerobooks.reports import ReportCache, month_range
+
+
+class Loader:
+    """Records the keys each load is called with."""
+
+    def __init__(self, values: dict):
+        self.values = values
+        self.calls = []
+
+    async def __call__(self, keys):
+        self.calls.append(keys)
+        if keys is None:
+            return dict(self.values)
+        return {k: self.values[k] for k in keys if k in self.values}
+
+
+async def test_report_cache():
+    cache = ReportCache()
+    load = Loader({1: "a", 2: "b"})
+    assert await cache.get(load) == {1: "a", 2: "b"}
+    assert await cache.get(load) == {1: "a", 2: "b"}
+    assert load.calls == [None]
+
+    # Only the changed keys are loaded again
+    load.values = {1: "c", 3: "d"}
+    cache.invalidate({2, 3})
+    assert await cache.get(load) == {1: "a", 3: "d"}
+    assert load.calls[-1] == {2, 3}
+
+    cache.invalidate()
+    assert await cache.get(load) == {1: "c", 3: "d"}
+    assert load.calls[-1] is None
+
+
+async def test_report_cache_invalidated_while_loading():
+    cache = ReportCache()
+    load = Loader({1: "a"})
+
+    async def invalidate_once(keys):
+        if len(load.calls) == 0:
+            cache.invalidate()
+        return await load(keys)
+
+    assert await cache.get(invalidate_once) == {1: "a"}
+    assert load.calls == [None, None]
+
+
+def test_month_range():
+    assert month_range({"2023-12", "2023-02"}) == (
+        datetime(2023, 2, 1),
+        datetime(2024, 1, 1),
+    )
+
+
+async def test_revenue_by_month(reports, company, customer):
+    await new_invoice(company, customer, datetime(2023, 1, 5), 100)
+    invoice = await new_invoice(company, customer, datetime(2023, 2, 5), 50)
+    results = await reports.revenue_by_month()
+    assert [(r.month, r.invoices, r.revenue) for r in results] == [
+        ("2023-01", 1, D(100)),
+        ("2023-02", 1, D(50)),
+    ]
+
+    # Moving an invoice to another month changes both
+    version = reports.version
+    invoice.date = datetime(2023, 3, 1)
+    await invoice.save()
+    assert reports.version > version
+    assert reports.month_cache.stale == {"2023-02", "2023-03"}
+    results = await reports.revenue_by_month(start="2023-02")
+    assert [(r.month, r.invoices, r.revenue) for r in results] == [
+        ("2023-03", 1, D(50)),
+    ]
+
+    invoice.status = "void"
+    await invoice.save()
+    results = await reports.revenue_by_month()
+    assert [r.month for r in results] == ["2023-01"]
+
+
+async def test_top_customers(reports, company, customer):
+    other = Customer(company="Other", display_name_format="{company}")
+    await other.save()
+    await new_invoice(company, customer, datetime(2023, 1, 5), 100)
+    invoice = await new_invoice(company, other, datetime(2023, 1, 5), 50)
+    results = await reports.top_customers()
+    assert [(r.customer, r.revenue) for r in results] == [
+        (customer, D(100)),
+        (other, D(50)),
+    ]
+
+    # Only the customers of the invoice are invalidated
+    invoice.items.append(InvoiceItem(rate=D(100)))
+    await invoice.save()
+    assert reports.customer_cache.stale == {other._id}
+    results = await reports.top_customers(limit=1)
+    assert [(r.customer, r.revenue) for r in results] == [(other, D(150))]
+
+    invoice.customer = customer
+    await invoice.save()
+    assert reports.customer_cache.stale == {customer._id, other._id}
+    results = await reports.top_customers()
+    assert [(r.customer, r.invoices, r.revenue) for r in results] == [
+        (customer, 2, D(250)),
+    ]
+
+
+async def test_aging(reports, company, customer):
+    as_of = date(2023, 6, 1)
+    await new_invoice(
+        company, customer, datetime(2023, 5, 1), 100, due_date=datetime(2023, 6, 1)
+    )
+    old = await new_invoice(
+        company, customer, datetime(2023, 1, 1), 40, due_date=datetime(2023, 2, 1)
+    )
+    report = await reports.aging(as_of)
+    assert report.totals == (D(100), D(), D(), D(), D(40))
+    assert [a.customer for a in report.customers] == [customer]
+
+    payment = Payment(invoice=old, customer=customer, amount=D(40))
+    await payment.save()
+    assert reports.aging_cache.stale == {customer._id}
+    report = await reports.aging(as_of)
+    assert report.total == D(100)
+
+    # A different date recomputes every customer
+    report = await reports.aging(date(2023, 7, 15))
+    assert report.totals == (D(), D(), D(100), D(), D())
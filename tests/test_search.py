@@ -0,0 +1,94 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from decimal import Decimal as D
+
+from zerobooks.models.api import Customer, Invoice, InvoiceItem, Product
+from zerobooks.search import customer_choices, global_search, search_ids
+
+
+async def test_customer_choices(company):
+    customers = []
+    for first, last in (("John", "Doe"), ("Jane", "Doe"), ("Bob", "Smith")):
+        customer = Customer(first_name=first, last_name=last)
+        await customer.save()
+        customers.append(customer)
+
+    # The company is never a choice and the newest are listed first
+    assert await customer_choices() == customers[::-1]
+    assert await customer_choices(limit=2) == customers[:0:-1]
+    assert await customer_choices("smith") == [customers[2]]
+    assert set(await customer_choices("doe")) == set(customers[:2])
+    assert await customer_choices("acme") == []
+
+
+async def test_fts_customer_triggers(db):
+    customer = Customer(first_name="John", last_name="Doe", company="Acme")
+    await customer.save()
+    assert await search_ids("customer", "doe") == [customer._id]
+    assert await search_ids("customer", "acm") == [customer._id]
+
+    customer.last_name = "Smith"
+    await customer.save()
+    assert await search_ids("customer", "doe") == []
+    assert await search_ids("customer", "smith") == [customer._id]
+
+    await customer.delete()
+    assert await search_ids("customer", "smith") == []
+
+
+async def test_fts_product_triggers(db):
+    product = Product(name="Running shoes", description="Blue")
+    await product.save()
+    assert await search_ids("product", "shoe blue") == [product._id]
+
+    product.description = "Red"
+    await product.save()
+    assert await search_ids("product", "blue") == []
+    assert await search_ids("product", "red") == [product._id]
+
+    await product.delete()
+    assert await search_ids("product", "shoes") == []
+
+
+async def test_fts_invoice_item_triggers(company):
+    item = InvoiceItem(name="Widget", rate=D(1))
+    invoice = Invoice(owner=company, project="Roof", items=[item])
+    await invoice.save()
+    assert await search_ids("invoice", "roof") == [invoice._id]
+    assert await search_ids("invoice", "widget") == [invoice._id]
+
+    # Item names are indexed with the invoice they are on
+    item.name = "Gadget"
+    invoice.items.append(InvoiceItem(name="Sprocket", rate=D(2)))
+    await invoice.save()
+    assert await search_ids("invoice", "widget") == []
+    assert await search_ids("invoice", "gadget sprocket") == [invoice._id]
+
+    invoice.items.remove(item)
+    await invoice.save()
+    assert await search_ids("invoice", "gadget") == []
+
+    await invoice.delete()
+    assert await search_ids("invoice", "sprocket") == []
+
+
+async def test_global_search(company):
+    customer = Customer(first_name="Ann", last_name="Widget")
+    await customer.save()
+    product = Product(name="Widget")
+    await product.save()
+    invoice = Invoice(owner=company, items=[InvoiceItem(name="Widget")])
+    await invoice.save()
+
+    hits = await global_search("widget")
+    assert {(hit.kind, hit.id) for hit in hits} == {
+        ("customer", customer._id),
+        ("invoice", invoice._id),
+        ("product", product._id),
+    }
+    assert await global_search("!!") == []
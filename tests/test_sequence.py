@@ -0,0 +1,118 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from datetime import datetime
+
+import pytest
+
+from zerobooks.models.api import Invoice, InvoiceSequence, configure_sequence
+from zerobooks.models.sequence import (
+    FIRST_NUMBER,
+    advance_sequence,
+    format_number,
+    reserve_numbers,
+    validate_format,
+)
+
+
+def test_format_number():
+    date = datetime(2023, 4, 1)
+    assert format_number("{n}", 10000) == "10000"
+    assert format_number("INV-{date:%Y}-{n:06d}", 12, date) == "INV-2023-000012"
+
+
+@pytest.mark.parametrize("format", ["INV", "{x}", "{n", "{date:%Y}"])
+def test_validate_format(format):
+    with pytest.raises(ValueError):
+        validate_format(format)
+
+
+async def test_numbers_are_sequential(company):
+    numbers = []
+    for i in range(3):
+        invoice = Invoice(owner=company)
+        await invoice.save()
+        numbers.append(invoice.number)
+    assert numbers == [str(FIRST_NUMBER + i) for i in range(3)]
+
+    # Invoices with a number keep it
+    invoice = Invoice(owner=company, number="A-1")
+    await invoice.save()
+    assert invoice.number == "A-1"
+    sequence = await InvoiceSequence.objects.get(owner=company._id)
+    assert sequence.next_number == FIRST_NUMBER + 3
+
+
+async def test_sequence_per_company(company):
+    invoice = Invoice(owner=company)
+    await invoice.save()
+    # Invoices without a company have a sequence of their own
+    other = Invoice()
+    await other.save()
+    assert invoice.number == other.number == str(FIRST_NUMBER)
+
+
+async def test_sequence_starts_after_existing_numbers(company):
+    invoice = Invoice(owner=company, number="20000")
+    await invoice.save()
+    await Invoice(owner=company, number="INV-30000").save()
+    invoice = Invoice(owner=company)
+    await invoice.save()
+    assert invoice.number == "20001"
+
+
+async def test_sequence_ignores_numbers_with_other_characters(company):
+    # Cast to an integer these would be larger than the all digit number
+    for number in ("2023-0001-x", "99999-1", "1e9", "INV7", "42000"):
+        await Invoice(owner=company, number=number).save()
+    invoice = Invoice(owner=company)
+    await invoice.save()
+    assert invoice.number == "42001"
+
+
+async def test_reserve_block(company):
+    async with Invoice.transaction() as conn:
+        numbers, format = await reserve_numbers(conn, company._id, 5)
+        assert numbers == range(FIRST_NUMBER, FIRST_NUMBER + 5)
+        assert format == "{n}"
+        numbers, format = await reserve_numbers(conn, company._id, 2)
+        assert numbers == range(FIRST_NUMBER + 5, FIRST_NUMBER + 7)
+
+
+async def test_rollback_releases_numbers(company):
+    with pytest.raises(RuntimeError):
+        async with Invoice.transaction() as conn:
+            await reserve_numbers(conn, company._id, 5)
+            raise RuntimeError("Insert failed")
+    invoice = Invoice(owner=company)
+    await invoice.save()
+    assert invoice.number == str(FIRST_NUMBER)
+
+
+async def test_advance_sequence(company):
+    async with Invoice.transaction() as conn:
+        await advance_sequence(conn, company._id, 50000)
+        # Never moves back
+        await advance_sequence(conn, company._id, 100)
+        numbers, _ = await reserve_numbers(conn, company._id, 1)
+    assert numbers == range(50001, 50002)
+
+
+async def test_configure_sequence(company):
+    await configure_sequence(company._id, "INV-{date:%Y}-{n:06d}", 20000)
+    invoice = Invoice(owner=company, date=datetime(2023, 4, 1))
+    await invoice.save()
+    assert invoice.number == "INV-2023-020000"
+
+    with pytest.raises(ValueError):
+        await configure_sequence(company._id, "INV")
+    with pytest.raises(ValueError):
+        # Lower than a number already used
+        await configure_sequence(company._id, next_number=20000)
+    await configure_sequence(company._id, next_number=30000)
+    sequence = await InvoiceSequence.objects.get(owner=company._id)
+    assert (sequence.format, sequence.next_number) == ("INV-{date:%Y}-{n:06d}", 30000)
@@ -0,0 +1,201 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+The aggregates of the snapshot are compared with the SQL reports of the same
+rows.
+"""
+from datetime import datetime
+from decimal import Decimal as D
+
+import pytest
+from conftest import new_invoice
+
+from zerobooks.models.api import Customer
+from zerobooks.models.payment import Payment, Refund
+
+np = pytest.importorskip("numpy")
+
+from zerobooks.snapshot import (  # noqa: E402
+    FactTable,
+    LedgerSnapshot,
+    bucket,
+    bucket_end,
+    group_sum,
+    load_snapshot,
+)
+
+
+def days(*dates: str) -> np.ndarray:
+    return np.array(dates, "datetime64[D]")
+
+
+def amounts(values: np.ndarray) -> list[D]:
+    return [D(int(v)) / 100 for v in values.tolist()]
+
+
+@pytest.mark.parametrize(
+    "unit, start, end",
+    [
+        ("D", "2023-02-15", "2023-02-16"),
+        # A wednesday is in the week starting on the monday before
+        ("W", "2023-02-13", "2023-02-20"),
+        ("M", "2023-02-01", "2023-03-01"),
+        ("Q", "2023-01-01", "2023-04-01"),
+        ("Y", "2023-01-01", "2024-01-01"),
+    ],
+)
+def test_bucket(unit, start, end):
+    dates = np.array(["2023-02-15T13:30"], "datetime64[s]")
+    starts = bucket(dates, unit)
+    assert starts.tolist() == days(start).tolist()
+    assert bucket_end(starts, unit).tolist() == days(end).tolist()
+
+
+def test_bucket_invalid_unit():
+    with pytest.raises(ValueError):
+        bucket(days("2023-01-01"), "H")
+
+
+def test_group_sum():
+    keys, sums = group_sum(np.array([3, 1, 3]), np.array([5, 2, 7]))
+    assert (keys.tolist(), sums.tolist()) == ([1, 3], [2, 12])
+    # Every code is included when the size is given
+    keys, sums = group_sum(np.array([2, 0, 2]), np.array([5, 2, 7]), 4)
+    assert (keys.tolist(), sums.tolist()) == ([0, 1, 2, 3], [2, 0, 12, 0])
+
+
+def test_upsert():
+    table = FactTable(
+        columns={"id": np.array([1, 3, 5]), "total": np.array([10, 30, 50])}
+    )
+    rows = FactTable(columns={"id": np.array([2, 3]), "total": np.array([20, 31])})
+    table = table.upsert(rows)
+    assert table["id"].tolist() == [1, 2, 3, 5]
+    assert table["total"].tolist() == [10, 20, 31, 50]
+    assert table.rows_of(np.array([5, 4, 9])).tolist() == [3, -1, -1]
+
+
+@pytest.fixture
+async def other(db):
+    other = Customer(company="Other", display_name_format="{company}")
+    await other.save()
+    return other
+
+
+@pytest.fixture
+async def ledger(reports, company, customer, other):
+    """Invoices, payments and refunds of two customers over four months."""
+    invoices = {
+        "a": await new_invoice(company, customer, datetime(2023, 1, 5), 100),
+        "b": await new_invoice(company, customer, datetime(2023, 2, 10), 50),
+        "c": await new_invoice(company, other, datetime(2023, 2, 20), 30),
+        "d": await new_invoice(company, other, datetime(2023, 3, 1), 20),
+        "e": await new_invoice(company, other, datetime(2023, 3, 15), "12.34"),
+    }
+    invoices["d"].status = "void"
+    await invoices["d"].save()
+    payments = {}
+    for key, invoice, amount, created in (
+        ("a", invoices["a"], 60, datetime(2023, 1, 20)),
+        ("c", invoices["c"], 30, datetime(2023, 3, 5)),
+        ("e", invoices["e"], "12.34", datetime(2023, 4, 2)),
+    ):
+        payment = Payment(
+            invoice=invoice,
+            customer=invoice.customer,
+            amount=D(amount),
+            created=created,
+        )
+        await payment.save()
+        payments[key] = payment
+    refund = Refund(payment=payments["a"], amount=D(10), created=datetime(2023, 2, 1))
+    await refund.save()
+    return invoices, payments
+
+
+async def assert_matches_reports(snapshot: LedgerSnapshot, reports):
+    reports.clear()
+    months, revenue = snapshot.revenue_by("M")
+    assert [
+        (str(m)[:7], total) for m, total in zip(months.tolist(), amounts(revenue))
+    ] == [(r.month, r.revenue) for r in await reports.revenue_by_month()]
+
+    ids, totals = snapshot.revenue_by_customer()
+    assert {
+        pk: total for pk, total in zip(ids.tolist(), amounts(totals)) if pk and total
+    } == {r.customer._id: r.revenue for r in await reports.top_customers()}
+
+
+async def test_aggregates(ledger, reports):
+    snapshot = await load_snapshot(None)
+    assert (len(snapshot.invoices), len(snapshot.payments)) == (5, 3)
+    await assert_matches_reports(snapshot, reports)
+
+    quarters, revenue = snapshot.revenue_by("Q")
+    assert quarters.tolist() == days("2023-01-01").tolist()
+    assert amounts(revenue) == [D("192.34")]
+
+    months, received = snapshot.received_by("M")
+    assert amounts(received) == [D(60), D(-10), D(30), D("12.34")]
+
+    # Receivables at the end of each month over the revenue of the month
+    starts, dso = snapshot.dso_by("M")
+    assert (
+        starts.tolist()
+        == days("2023-01-01", "2023-02-01", "2023-03-01", "2023-04-01").tolist()
+    )
+    expected = [4000 / 10000 * 31, 13000 / 8000 * 28, 11234 / 1234 * 31]
+    assert dso[:3].tolist() == pytest.approx(expected)
+    assert np.isnan(dso[3])
+
+    # The customer first invoiced in january and the other in february
+    starts, cohorts = snapshot.cohort_revenue("M")
+    assert starts.tolist() == days("2023-01-01", "2023-02-01", "2023-03-01").tolist()
+    assert cohorts.tolist() == [
+        [10000, 5000, 0],
+        [0, 3000, 1234],
+        [0, 0, 0],
+    ]
+
+
+async def test_refresh(ledger, reports, tmp_path):
+    invoices, payments = ledger
+    path = str(tmp_path / "snapshot")
+    snapshot = await load_snapshot(path)
+    assert snapshot.path == path
+
+    # Saved and memory mapped again
+    loaded = LedgerSnapshot.load(path)
+    for name in ("invoices", "payments", "refunds"):
+        table, saved = getattr(snapshot, name), getattr(loaded, name)
+        assert saved.columns.keys() == table.columns.keys()
+        for column, values in table.columns.items():
+            assert saved[column].tolist() == values.tolist()
+    assert loaded.customers.values.tolist() == snapshot.customers.values.tolist()
+
+    # Changed rows are replaced
+    invoice = invoices["a"]
+    await invoice.load_items()
+    invoice.items[0].rate = D(80)
+    await invoice.save()
+    stats = await loaded.refresh()
+    assert stats.deleted == {"invoices": 0, "payments": 0, "refunds": 0}
+    assert len(loaded.invoices) == 5
+    await assert_matches_reports(loaded, reports)
+
+    # Rows deleted after the first refresh are removed
+    await payments["e"].delete()
+    await invoices["e"].delete()
+    stats = await loaded.refresh()
+    assert stats.deleted == {"invoices": 1, "payments": 1, "refunds": 0}
+    assert invoices["e"]._id not in loaded.invoices["id"].tolist()
+    await assert_matches_reports(loaded, reports)
+
+    # And a rebuild has the same rows
+    rebuilt = await load_snapshot(None)
+    assert rebuilt.invoices["id"].tolist() == loaded.invoices["id"].tolist()
+    assert rebuilt.invoices["total"].tolist() == loaded.invoices["total"].tolist()
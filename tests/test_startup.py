@@ -0,0 +1,32 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_startup_budget():
+    """Start the app in new interpreters and fail if the imports take longer
+    than the budget or import a module that should be deferred.
+
+    """
+    pytest.importorskip("qtpy")
+    path = os.pathsep.join(filter(None, (ROOT, os.environ.get("PYTHONPATH"))))
+    process = subprocess.run(
+        [sys.executable, os.path.join("benchmarks", "bench.py"), "startup"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=path),
+    )
+    if process.returncode != 0:
+        pytest.fail(f"{process.stdout}{process.stderr}".strip(), pytrace=False)
@@ -0,0 +1,174 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import asyncio
+
+import pytest
+
+from zerobooks.tasks import Priority, TaskDispatcher
+
+
+@pytest.fixture
+async def dispatcher():
+    dispatcher = TaskDispatcher()
+    runner = asyncio.create_task(dispatcher.run())
+    await asyncio.sleep(0)
+    yield dispatcher
+    dispatcher.stop()
+    await runner
+
+
+async def wait(*handles, timeout: float = 1.0):
+    async def done():
+        while not all(h.done for h in handles):
+            await asyncio.sleep(0.001)
+
+    await asyncio.wait_for(done(), timeout)
+
+
+async def test_submit_runs_coroutine(dispatcher):
+    async def job():
+        return 42
+
+    handle = dispatcher.submit(job())
+    await wait(handle)
+    assert handle.state == "done"
+    assert handle.result == 42
+
+
+async def test_priority_order():
+    dispatcher = TaskDispatcher(max_concurrent=1)
+    started = []
+
+    async def job(name):
+        started.append(name)
+
+    # Queued before the dispatcher runs so all are waiting for the slot
+    handles = [
+        dispatcher.submit(job("background"), Priority.BACKGROUND),
+        dispatcher.submit(job("normal 1")),
+        dispatcher.submit(job("interactive"), Priority.INTERACTIVE),
+        dispatcher.submit(job("normal 2")),
+    ]
+    runner = asyncio.create_task(dispatcher.run())
+    await wait(*handles)
+    dispatcher.stop()
+    await runner
+    assert started == ["interactive", "normal 1", "normal 2", "background"]
+
+
+async def test_background_slots(dispatcher):
+    dispatcher.max_concurrent = 3
+    dispatcher.max_background = 1
+    release = asyncio.Event()
+    running = []
+
+    async def job(name):
+        running.append(name)
+        await release.wait()
+
+    handles = [
+        dispatcher.submit(job("bg 1"), Priority.BACKGROUND),
+        dispatcher.submit(job("bg 2"), Priority.BACKGROUND),
+        dispatcher.submit(job("ui"), Priority.INTERACTIVE),
+    ]
+    await asyncio.sleep(0.01)
+    # Only one background job may run, the interactive one still starts
+    assert sorted(running) == ["bg 1", "ui"]
+    release.set()
+    await wait(*handles)
+    assert sorted(running) == ["bg 1", "bg 2", "ui"]
+
+
+async def test_dedup_replaces_pending():
+    dispatcher = TaskDispatcher()
+    calls = []
+
+    async def job(n):
+        calls.append(n)
+        return n
+
+    first = dispatcher.submit(job(1), key="search")
+    second = dispatcher.submit(job(2), key="search")
+    assert first is second
+    runner = asyncio.create_task(dispatcher.run())
+    await wait(first)
+    dispatcher.stop()
+    await runner
+    assert calls == [2]
+    assert first.result == 2
+
+
+async def test_dedup_after_start(dispatcher):
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    first = dispatcher.submit(job(), key="save")
+    await asyncio.sleep(0.01)
+    assert first.state == "running"
+    # The key is free once the task started
+    second = dispatcher.submit(job(), key="save")
+    assert second is not first
+    release.set()
+    await wait(first, second)
+
+
+async def test_error_is_stored(dispatcher):
+    async def fail():
+        raise ValueError("boom")
+
+    async def ok():
+        return "ok"
+
+    failed = dispatcher.submit(fail())
+    await wait(failed)
+    assert failed.state == "failed"
+    assert isinstance(failed.error, ValueError)
+
+    # The dispatcher keeps running
+    handle = dispatcher.submit(ok())
+    await wait(handle)
+    assert handle.result == "ok"
+
+
+async def test_cancel_pending_and_running(dispatcher):
+    dispatcher.max_concurrent = 1
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    running = dispatcher.submit(job())
+    pending = dispatcher.submit(job())
+    await asyncio.sleep(0.01)
+    assert running.state == "running"
+    assert pending.state == "pending"
+
+    pending.cancel()
+    assert pending.state == "cancelled"
+    running.cancel()
+    await wait(running)
+    assert running.state == "cancelled"
+    assert not dispatcher.active
+
+
+async def test_stop_cancels_tasks():
+    dispatcher = TaskDispatcher(max_concurrent=1)
+
+    async def job():
+        await asyncio.sleep(10)
+
+    runner = asyncio.create_task(dispatcher.run())
+    running = dispatcher.submit(job())
+    pending = dispatcher.submit(job())
+    await asyncio.sleep(0.01)
+    dispatcher.stop()
+    await runner
+    assert running.state == "cancelled"
+    assert pending.state == "cancelled"
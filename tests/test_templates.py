@@ -0,0 +1,101 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from datetime import datetime
+from decimal import Decimal as D
+
+import enaml
+import lxml.html
+import pytest
+
+from zerobooks.models.api import Address, Customer, Invoice, InvoiceItem
+from zerobooks.templates.registry import (
+    DEFAULT_TEMPLATE,
+    registry,
+    render_invoice,
+    snapshot_invoice,
+)
+
+
+def normalize(html: str) -> str:
+    """Parse the html and drop the ids the components are given."""
+    root = lxml.html.fromstring(html)
+    for element in root.iter():
+        element.attrib.pop("id", None)
+    return lxml.html.tostring(root, encoding="unicode")
+
+
+def new_invoice(**kwargs) -> Invoice:
+    owner = Customer(
+        internal=True,
+        company="Acme & Sons",
+        first_name="Jane",
+        email="info@acme.com",
+        phone="555-0100",
+        billing_address=Address(
+            street="1 Main St", city="Town", state="CA", zipcode="90000"
+        ),
+    )
+    customer = Customer(
+        first_name="John",
+        last_name="Doe",
+        company="Doe <Inc>",
+        billing_address=Address(
+            street="2 Side St", city="City", state="NY", zipcode="10000"
+        ),
+    )
+    return Invoice(
+        owner=owner,
+        customer=customer,
+        number="10001",
+        date=datetime(2023, 4, 1),
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(
+            project="Roof",
+            notes="Pay within 30 days\nThanks",
+            tax_rate=D("0.0825"),
+            total_adjustments=D("-5"),
+            items=[
+                InvoiceItem(
+                    name="Shingles", quantity=D(20), rate=D("12.5"), taxable=True
+                ),
+                InvoiceItem(name="Labor", quantity=D("3.5"), rate=D(80)),
+                InvoiceItem(name="Nails & <glue>", rate=D("1234.567")),
+            ],
+        ),
+        # Without a project, company or items
+        dict(),
+    ],
+)
+def test_render_html_matches_template(app, kwargs):
+    invoice = new_invoice(**kwargs)
+    if not kwargs:
+        invoice.customer.company = ""
+    compiled = registry.get(DEFAULT_TEMPLATE)
+    assert compiled.render_html is not None
+    view = compiled.template(invoice=invoice)
+    try:
+        expected = view.render()
+    finally:
+        view.destroy()
+    html = compiled.render_html(snapshot_invoice(invoice))
+    assert normalize(html) == normalize(expected)
+    assert render_invoice(invoice) == html
+
+
+def test_missing_template_uses_default(app):
+    with enaml.imports():
+        from zerobooks.templates import simple
+    compiled = registry.get(None)
+    assert compiled.module is simple
+    assert registry.get("zerobooks.templates.missing") is compiled
@@ -4,8 +4,62 @@ Copyright (c) 2018, Jairus Martin.
 Distributed under the terms of the GPL v3 License.
 
 The full license is in the file LICENSE, distributed with this software.
+
+Run the app or, with the name of a command, the command without the app eg
+`python -m zerobooks export-pdf --help`.
+
+Commands only use the models and a plain asyncio loop so they can run on a
+server without a display. They must not import the views, `zerobooks.core`
+or anything else that imports the enaml widgets or Qt.
 """
-from zerobooks.app import main
+import sys
+from importlib import import_module
+
+#: Module with the main function and a description of each command
+COMMANDS = {
+    "backup": ("zerobooks.backup", "Copy the database to a backup file"),
+    "balances": ("zerobooks.balances", "Check or rebuild the customer balances"),
+    "export": ("zerobooks.exporter", "Export invoices, payments and refunds"),
+    "export-pdf": ("zerobooks.pdf", "Export invoices to pdf files"),
+    "import": ("zerobooks.importer", "Import customers, products or invoices"),
+    "reports": ("zerobooks.reports", "Print the aging, revenue and top customers"),
+    "snapshot": ("zerobooks.snapshot", "Refresh the ledger snapshot"),
+}
+
+
+def usage() -> str:
+    lines = [
+        "usage: python -m zerobooks [command] [args]",
+        "",
+        "Run the app or one of the commands:",
+    ]
+    width = max(len(name) for name in COMMANDS)
+    for name, (module, description) in COMMANDS.items():
+        lines.append(f"  {name:<{width}}  {description}")
+    lines.append("")
+    lines.append("Use python -m zerobooks <command> --help for its options.")
+    return "\n".join(lines)
+
+
+def main():
+    if len(sys.argv) > 1:
+        command = sys.argv[1]
+        if command in COMMANDS:
+            module = import_module(COMMANDS[command][0])
+            sys.exit(module.main(sys.argv[2:]))
+        if command in ("-h", "--help"):
+            print(usage())
+            sys.exit(0)
+
+    from zerobooks.startup import PROFILE_STARTUP, profile
+
+    if PROFILE_STARTUP:
+        profile.start()
+
+    from zerobooks.app import main
+
+    main()
+
 
 if __name__ == "__main__":
     main()
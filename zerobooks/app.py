@@ -6,43 +6,47 @@ Distributed under the terms of the GPL v3 License.
 The full license is in the file LICENSE, distributed with this software.
 """
 import asyncio
+import importlib.util
 import logging
 import os
 import warnings
 from inspect import iscoroutine
-from queue import Empty, Queue
 from typing import Optional
 
 import enaml
-import enamlx
-from aiosqlite.sa import create_engine
 from asyncqtpy import QEventLoopPolicy
 from atom.api import Bool, ForwardTyped, Typed
-from atomdb.sql import SQLModelManager
+from enaml.qt.QtCore import QCoreApplication, Qt
 from enaml.qt.qt_application import ProxyResolver, QtApplication
+from qtpy import API_NAME
 from web.components.html import Tag
-from web.impl import lxml_components
 
-from .utils import CONFIG_DIR, DB_FILE, log
+from .db import close_database, open_database
+from .startup import PROFILE_STARTUP, profile
+from .tasks import TaskDispatcher
+from .utils import CONFIG_DIR, log
 
-try:
-    # Must be imported be fore app is inited or it fails to import later
-    from enaml.qt import QtWebEngineWidgets  # noqa: F401
 
-    QT_WEBENGINE = True
-except ImportError as e:
-    warnings.warn(
-        f"QtWebEngine is not available: {e}. " "Will fall back to basic html view"
-    )
-    QT_WEBENGINE = False
+def qt_module_exists(name: str) -> bool:
+    """Check if the Qt binding has the module without importing it. The
+    module is imported when the first widget that uses it is created.
+
+    """
+    try:
+        return importlib.util.find_spec(f"{API_NAME}.{name}") is not None
+    except ImportError:
+        return False
 
-try:
-    from enaml.qt import Qsci  # noqa: F401
 
-    QT_QSCI = True
-except ImportError as e:
-    warnings.warn(f"QSci is not available: {e}. " "Theme editor will be disabled")
-    QT_QSCI = False
+# The html preview and designer are not opened in most sessions so their Qt
+# modules are not imported until they are
+QT_WEBENGINE = qt_module_exists("QtWebEngineWidgets")
+if not QT_WEBENGINE:
+    warnings.warn("QtWebEngine is not available. Will fall back to basic html view")
+
+QT_QSCI = qt_module_exists("Qsci")
+if not QT_QSCI:
+    warnings.warn("QSci is not available. Theme editor will be disabled")
 
 
 def get_sys_config():
@@ -54,14 +58,19 @@ def get_sys_config():
 class ZeroApplication(QtApplication):
     #: Web component resolver
     web_resolver = Typed(ProxyResolver)
-    queue = Typed(Queue, ())
+    dispatcher = Typed(TaskDispatcher, ())
     running = Bool()
     sys_config = ForwardTyped(get_sys_config, ())
 
     def __init__(self, appname=None):
+        if QT_WEBENGINE:
+            # Lets QtWebEngine be imported after the app is created
+            QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
         super().__init__(appname=appname or "zerobooks")
 
     def _default_web_resolver(self):
+        from web.impl import lxml_components
+
         return ProxyResolver(factories=lxml_components.FACTORIES)
 
     def resolve_proxy_class(self, declaration_class):
@@ -80,6 +89,7 @@ class ZeroApplication(QtApplication):
 
     def start(self):
         log.debug("ZeroApplication.start")
+        profile.phase("show window")
         try:
             self.running = True
             loop = asyncio.new_event_loop()
@@ -93,30 +103,11 @@ class ZeroApplication(QtApplication):
 
     @classmethod
     async def open_database(cls, url: Optional[str] = None):
-        mgr = SQLModelManager.instance()
-        if url is None:
-            url = DB_FILE
-        # If using mysql/postgres...
-        # m = re.match(r"(.+)://(.+):(.*)@(.+):(\d+)/(.+)", url)
-        # if not m:
-        #    raise ValueError("Database url is invalid")
-        # schema, user, pwd, host, port, db = m.groups()
-        # engine = mgr.database = await create_engine(
-        #     host=host,
-        #     port=int(port),
-        #     user=user,
-        #     password=pwd,
-        #     database=db,
-        # )
-        engine = mgr.database = await create_engine(url, isolation_level=None)
-        return engine
+        return await open_database(url)
 
     @classmethod
     async def close_database(cls):
-        mgr = SQLModelManager.instance()
-        if db := mgr.database:
-            await db.terminate()
-            await db.wait_closed()
+        await close_database()
 
     async def init_database(self):
         from zerobooks.models.system import System
@@ -128,23 +119,17 @@ class ZeroApplication(QtApplication):
         await self.open_database()
         try:
             await self.init_database()
-            while self.running:
-                try:
-                    task = self.queue.get(block=False)
-                    if task is None:
-                        break
-                    await task
-                except Empty:
-                    await asyncio.sleep(0.1)
-                except Exception as e:
-                    # Handle errors here
-                    raise e
+            profile.phase("open database")
+            self.deferred_call(profile.finish)
+            if self.running:
+                await self.dispatcher.run()
         finally:
             await self.close_database()
 
     def stop(self):
         log.debug("ZeroApplication.stop")
         self.running = False
+        self.dispatcher.stop()
 
         #: HACK Improper shutdown
         import threading
@@ -152,13 +137,22 @@ class ZeroApplication(QtApplication):
         threading._shutdown_locks.clear()
 
     def deferred_call(self, callback, *args, **kwargs):
+        """Invoke a callable on the next cycle of the main event loop.
+
+        If the callback is a coroutine it is submitted to the dispatcher and
+        the `priority` and `key` keyword arguments are passed along. The
+        TaskHandle is returned so the task can be cancelled.
+
+        """
         if iscoroutine(callback):
-            return self.queue.put(callback)
+            return self.dispatcher.submit(callback, *args, **kwargs)
         return super().deferred_call(callback, *args, **kwargs)
 
     def timed_call(self, ms, callback, *args, **kwargs):
         if iscoroutine(callback):
-            return super().timed_call(ms, self.queue.put, callback)
+            return super().timed_call(
+                ms, self.dispatcher.submit, callback, *args, **kwargs
+            )
         return super().timed_call(ms, callback, *args, **kwargs)
 
 
@@ -182,19 +176,42 @@ def init_logging():
         warnings.warn(f"Failed to init logging: {e}")
 
 
+def model_table_view_factory():
+    from .qt_widgets import QtModelTableView
+
+    return QtModelTableView
+
+
+def install_widgets():
+    """Add the Qt factories of the widgets in zerobooks.widgets."""
+    from enaml.qt.qt_factories import QT_FACTORIES
+
+    QT_FACTORIES["ModelTableView"] = model_table_view_factory
+
+
 def main():
+    if PROFILE_STARTUP:
+        # Already started before the imports when run with python -m zerobooks
+        profile.start()
+    profile.phase("import zerobooks.app")
     init_logging()
     asyncio.set_event_loop_policy(QEventLoopPolicy())
 
+    import enamlx
+
     enamlx.install()
+    install_widgets()
+    profile.phase("install enamlx")
 
     with enaml.imports():
         from .manifest import AppManifest
 
     from .workbench import ZeroWorkbench
 
+    profile.phase("import manifest")
     workbench = ZeroWorkbench()
     workbench.register(AppManifest())
+    profile.phase("create workbench")
     log.debug("App starting")
     workbench.run()
 
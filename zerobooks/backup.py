@@ -0,0 +1,100 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copy the database to a backup file.
+
+The copy is made with the sqlite backup api so it is consistent even while
+the app is writing to the database. Run it with `python -m zerobooks backup`,
+by default the backups are written to the backups directory in CONFIG_DIR and
+all but the most recent `--keep` of them are removed.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+from .utils import CONFIG_DIR, DB_FILE, log
+
+#: Directory of the backups
+BACKUP_DIR = os.path.join(CONFIG_DIR, "backups")
+
+#: Pages copied at a time so the app is not blocked for long
+PAGES = 1024
+
+
+def backup_database(source: str, dest: str):
+    """Copy the database at source to dest."""
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    # Readers see the whole backup or none of it
+    tmp = f"{dest}.tmp"
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    try:
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst, pages=PAGES)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.replace(tmp, dest)
+
+
+def remove_old_backups(directory: str, keep: int) -> list[str]:
+    """Remove all but the most recent backups in the directory."""
+    backups = sorted(glob.glob(os.path.join(directory, "zerobooks-*.db")))
+    removed = []
+    for path in backups[: max(len(backups) - keep, 0)]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.warning(f"Could not remove backup {path}: {e}")
+            continue
+        removed.append(path)
+    return removed
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks backup",
+        description="Copy the database to a backup file",
+    )
+    parser.add_argument(
+        "dest", nargs="?", help="File to write, defaults to the backups directory"
+    )
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=30,
+        help="Number of backups kept in the backups directory",
+    )
+    args = parser.parse_args(argv)
+    source = args.db or DB_FILE
+    if not os.path.exists(source):
+        print(f"Database {source} does not exist", file=sys.stderr)
+        return 1
+    dest = args.dest
+    if dest is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        dest = os.path.join(BACKUP_DIR, f"zerobooks-{stamp}.db")
+    start = time.perf_counter()
+    backup_database(source, dest)
+    size = os.path.getsize(dest) / 1024 / 1024
+    elapsed = time.perf_counter() - start
+    print(f"Backed up {source} to {dest} ({size:.1f} MB) in {elapsed:.2f}s")
+    if args.dest is None:
+        for path in remove_old_backups(BACKUP_DIR, args.keep):
+            print(f"Removed {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
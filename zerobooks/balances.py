@@ -0,0 +1,57 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Check or rebuild the open balance and total spend of every customer.
+
+The balances are kept up to date as invoices, payments and refunds are saved
+so this is only needed if they were changed outside of the app. Run it with
+`python -m zerobooks balances`, use `--check` to only report customers with
+wrong balances.
+"""
+import argparse
+import asyncio
+import sys
+from typing import Optional
+
+from .models.balance import BalanceCheck, check_balances, rebuild_balances
+
+
+async def run(args: argparse.Namespace) -> BalanceCheck:
+    from .db import close_database, open_database
+
+    await open_database(args.db)
+    try:
+        if args.check:
+            return await check_balances()
+        return await rebuild_balances()
+    finally:
+        await close_database()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks balances",
+        description="Recompute the open balance and total spend of customers",
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="Only report wrong balances"
+    )
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    args = parser.parse_args(argv)
+    check = asyncio.run(run(args))
+    for pk, balance, spend, expected_balance, expected_spend in check.drifted:
+        print(
+            f"Customer {pk}: open balance {balance:.2f} should be "
+            f"{expected_balance:.2f}, total spend {spend:.2f} should be "
+            f"{expected_spend:.2f}"
+        )
+    print(check if args.check else f"Rebuilt balances, {check}")
+    return 1 if args.check and check.drifted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,10 +7,11 @@ The full license is in the file LICENSE, distributed with this software.
 """
 import os
 import pickle
+from importlib import import_module
 from typing import Optional
 
 import enaml
-from atom.api import Bytes, ContainerList, Instance, Str, Subclass
+from atom.api import Bytes, ContainerList, Instance, Str, Subclass, Typed
 from enaml.application import deferred_call
 from enaml.layout.api import (
     AreaLayout,
@@ -20,7 +21,8 @@ from enaml.layout.api import (
     TabLayout,
     VSplitLayout,
 )
-from enaml.widgets.api import Container, DockArea, DockItem
+from enaml.widgets.api import Container, DockArea, DockItem, FileDialogEx
+from enaml.widgets.dock_events import DockItemEvent
 from enaml.workbench.api import Plugin, PluginManifest
 from enaml.workbench.ui.api import Workspace
 
@@ -30,34 +32,95 @@ with enaml.imports():
         CompanyDockItem,
         CustomersDockItem,
         InvoicesDockItem,
+        PendingDockItem,
         ProductsDockItem,
+        ReportsDockItem,
     )
+    from .views.search import GlobalSearchDockItem
     from enaml.stdlib.dock_area_styles import available_styles
 
-from zerobooks.models.api import Address, Customer, Invoice, Product
+from zerobooks.datasource import ModelDataSource
+from zerobooks.models.api import Customer, Invoice, Product, prefetch_related
+from zerobooks.pdf import PdfWorker
+from zerobooks.reports import Reports
+from zerobooks.tasks import Priority
 from zerobooks.utils import CONFIG_DIR, log
+from zerobooks.widgets import LAYOUT_VERSION
 
 # Workbench layout is saved here
 STATE_FILE = os.path.join(CONFIG_DIR, "core.pk")
 
+#: Relations loaded with an invoice before it is shown
+INVOICE_RELATED = (
+    "owner.billing_address",
+    "customer.billing_address",
+    "payments.refunds",
+)
+
+#: Model, module, dock item and the relations loaded with the model of each
+#: kind of item that is restored from the saved layout. Items without a model
+#: are created without one. Every open DockItem is saved, by default with its
+#: name as the kind, but only these kinds are restored. The items that are
+#: always open (the company and the lists) are created by `create_area`.
+RESTORED_ITEMS = {
+    "customer-edit": (
+        Customer,
+        "zerobooks.views.customer",
+        "CustomerViewDockItem",
+        ("billing_address", "shipping_address"),
+    ),
+    "product-edit": (Product, "zerobooks.views.product", "ProductViewDockItem", ()),
+    "invoice-edit": (
+        Invoice,
+        "zerobooks.views.invoice",
+        "InvoiceViewDockItem",
+        INVOICE_RELATED,
+    ),
+    "invoice-preview": (
+        Invoice,
+        "zerobooks.views.preview",
+        "InvoicePreviewDockItem",
+        INVOICE_RELATED,
+    ),
+    "invoice-designer": (
+        Invoice,
+        "zerobooks.views.designer",
+        "InvoiceDesignerDockItem",
+        INVOICE_RELATED,
+    ),
+    "reports": (None, "zerobooks.views.dock", "ReportsDockItem", ()),
+    "global-search": (None, "zerobooks.views.search", "GlobalSearchDockItem", ()),
+}
+
+#: Dock item events after which a restored item is visible
+SHOWN_EVENTS = (
+    DockItemEvent.Shown,
+    DockItemEvent.TabSelected,
+    DockItemEvent.Extended,
+)
+
 
 class CorePlugin(Plugin):
-    #: Pickled dock state
+    #: Pickled layout state
     state = Bytes()
 
     #: Company info
     company = Instance(Customer, ())
 
-    addresses = ContainerList(Address)
-
     #: Customers
-    customers = ContainerList(Customer)
+    customers = Typed(ModelDataSource)
 
     #: Invoices
-    invoices = ContainerList(Invoice)
+    invoices = Typed(ModelDataSource)
 
     #: Products
-    products = ContainerList(Product)
+    products = Typed(ModelDataSource)
+
+    #: Writes the PDFs of the previews
+    pdf_worker = Typed(PdfWorker, ())
+
+    #: Aging and revenue reports
+    reports = Typed(Reports, ())
 
     #: Dock items added
     items = ContainerList(DockItem)
@@ -74,12 +137,112 @@ class CorePlugin(Plugin):
         ui.select_workspace("zerobooks.core.default_view")
         deferred_call(self.load_data())
 
+    def stop(self):
+        self.pdf_worker.stop()
+
     def insert_item(self, item, **kwargs):
         if not isinstance(item, DockItem):
             raise TypeError("Invalid item: {}".format(item))
         op = InsertTab(item=item.name, **kwargs)
         self.area.update_layout(op)
 
+    def open_search(self):
+        """Show the global search dock item and focus the search field."""
+        if not (item := self.area.find("global-search")):
+            item = GlobalSearchDockItem(self.area)
+            self.insert_item(item, target="invoice-list")
+        item.search_field.set_focus()
+        return item
+
+    def open_reports(self):
+        """Show the reports dock item."""
+        if not (item := self.area.find("reports")):
+            item = ReportsDockItem(self.area)
+            self.insert_item(item, target="invoice-list")
+        return item
+
+    def import_file(self, kind: str):
+        """Ask for a file and import the records of the given kind from it."""
+        path = FileDialogEx.get_open_file_name(
+            current_path=self.last_save_dir,
+            name_filters=["Data files (*.csv *.json *.jsonl)"],
+        )
+        if path:
+            self.last_save_dir = os.path.dirname(path)
+            deferred_call(self.run_import(kind, path), priority=Priority.BACKGROUND)
+
+    async def run_import(self, kind: str, path: str):
+        from zerobooks.importer import import_file
+
+        name = os.path.basename(path)
+        try:
+            stats = await import_file(kind, path)
+        except Exception as e:
+            log.exception(e)
+            self.area.notification(f"Failed to import {name}: {e}")
+            return
+        message = str(stats)
+        if stats.errors:
+            line, error = stats.errors[0]
+            message += f". Record {line}: {error}"
+        self.area.notification(message)
+        await self.customers.refresh()
+        await self.invoices.refresh()
+        await self.products.refresh()
+
+    def export_ledger(self):
+        """Ask for a directory and export the ledger to it."""
+        path = FileDialogEx.get_existing_directory(current_path=self.last_save_dir)
+        if path:
+            self.last_save_dir = path
+            deferred_call(self.run_export(path), priority=Priority.BACKGROUND)
+
+    async def run_export(self, path: str):
+        from zerobooks.exporter import export_ledger
+
+        try:
+            stats = await export_ledger(path)
+        except Exception as e:
+            log.exception(e)
+            self.area.notification(f"Failed to export the ledger: {e}")
+            return
+        self.area.notification(f"{stats} to {path}")
+
+    def export_pdfs(self, status: str):
+        """Ask for a directory and export the invoices with the status to it
+        as PDF files.
+
+        """
+        path = FileDialogEx.get_existing_directory(current_path=self.last_save_dir)
+        if path:
+            self.last_save_dir = path
+            deferred_call(
+                self.run_export_pdfs(status, path), priority=Priority.BACKGROUND
+            )
+
+    async def run_export_pdfs(self, status: str, path: str):
+        from zerobooks.documents import document_cache
+        from zerobooks.pdf import export_pdfs, find_invoices
+
+        def progress(stats):
+            log.debug(f"Exported {stats.done} of {stats.total} invoices to pdf")
+
+        try:
+            ids = await find_invoices(status)
+            self.area.notification(f"Exporting {len(ids)} invoices to pdf...")
+            stats = await export_pdfs(
+                ids, path, progress=progress, cache=document_cache
+            )
+        except Exception as e:
+            log.exception(e)
+            self.area.notification(f"Failed to export invoices to pdf: {e}")
+            return
+        message = f"{stats} to {path}"
+        if stats.failed:
+            number, error = stats.failed[0]
+            message += f". Invoice {number}: {error}"
+        self.area.notification(message)
+
     def _default_state(self):
         try:
             if os.path.exists(STATE_FILE):
@@ -103,13 +266,28 @@ class CorePlugin(Plugin):
             except Exception as e:
                 log.exception(e)
 
+    def _default_customers(self):
+        return ModelDataSource(
+            model=Customer,
+            filters={"internal": False},
+            prefetch=["billing_address", "shipping_address"],
+            schema="customer",
+        )
+
+    def _default_invoices(self):
+        return ModelDataSource(model=Invoice, prefetch=["customer"], schema="invoice")
+
+    def _default_products(self):
+        return ModelDataSource(model=Product, schema="product")
+
     async def load_data(self):
         # self._load_test_data()
-        self.addresses = await Address.objects.all()
-        self.products = await Product.objects.all()
         self.company, _ = await Customer.objects.get_or_create(internal=True)
-        self.customers = await Customer.objects.filter(internal=False)
-        self.invoices = await Invoice.objects.all()
+        await prefetch_related([self.company], "billing_address", "shipping_address")
+        # Only the counts are loaded, rows are loaded as the lists need them
+        await self.customers.refresh()
+        await self.invoices.refresh()
+        await self.products.refresh()
 
     def create_area(self, workbench):
         area = DockView(workbench=workbench)
@@ -128,20 +306,100 @@ class CorePlugin(Plugin):
 
     def save_state(self):
         # Triggers save in _observe_state
-        self.state = pickle.dumps({
-            'area': self.area,
-            'last_save_dir': self.last_save_dir,
-        })
+        state = self.area.save_state()
+        state["last_save_dir"] = self.last_save_dir
+        self.state = pickle.dumps(state)
         del self.area
 
-    def restore_state(self):
-        if data := self.state:
-            try:
-                state = pickle.loads(data)
-                self.area = state['area']
-                self.last_save_dir = state['last_save_dir']
-            except Exception as e:
-                log.exception(e)
+    def restore_state(self) -> Optional[dict]:
+        """Return the saved layout state if it is of the current version."""
+        if not (data := self.state):
+            return None
+        try:
+            state = pickle.loads(data)
+        except Exception as e:
+            log.exception(e)
+            return None
+        if not isinstance(state, dict) or state.get("version") != LAYOUT_VERSION:
+            log.debug("Core plugin state is from another version")
+            return None
+        self.last_save_dir = state.get("last_save_dir", self.last_save_dir)
+        return state
+
+    def restore_area(self, area: DockArea, state: dict):
+        """Add an item for each item of the saved layout that can be restored
+        and apply the layout. The items only stand in for the real ones until
+        they are shown, see `load_item`.
+
+        """
+        names = {item.name for item in area.dock_items()}
+        for saved in state["items"]:
+            kind = saved.get("kind", "")
+            if kind not in RESTORED_ITEMS:
+                continue
+            item = PendingDockItem(
+                kind=kind, uuid=saved.get("uuid", ""), title=saved.get("title", "")
+            )
+            if item.name in names:
+                continue
+            names.add(item.name)
+            item.set_parent(area)
+        area.layout = state["layout"]
+
+    def dock_event_received(self, event):
+        """Load a restored item when it is first shown."""
+        if not isinstance(event, DockItemEvent) or event.type not in SHOWN_EVENTS:
+            return
+        item = self.area.find(event.name) if self.area else None
+        if isinstance(item, PendingDockItem) and not item.loading:
+            item.loading = True
+            deferred_call(self.load_item(item), priority=Priority.INTERACTIVE)
+
+    async def load_item(self, pending: PendingDockItem):
+        """Load the model of the restored item from the database and replace
+        it with the item it stands for.
+
+        """
+        Model, module, name, related = RESTORED_ITEMS[pending.kind]
+        kwargs = {}
+        if Model is not None:
+            member = Model.__name__.lower()
+            model = self.find_open_model(member, pending.uuid)
+            if model is None:
+                model = await Model.objects.get(uuid=pending.uuid)
+                if model is None:
+                    log.debug(f"Cannot restore {pending.name}, it was deleted")
+                    pending.destroy()
+                    return
+                if isinstance(model, Invoice):
+                    await model.load_items()
+                if related:
+                    await prefetch_related([model], *related)
+            kwargs[member] = model
+        area = self.area
+        if area is None or pending.parent is not area:
+            return  # Closed while it was loading
+        with enaml.imports():
+            Item = getattr(import_module(module), name)
+        # Put it where the restored item is
+        layout = area.save_layout()
+        pending.destroy()
+        item = Item(**kwargs)
+        item.set_parent(area)
+        area.apply_layout(layout)
+
+    def find_open_model(self, member: str, uuid: str):
+        """Return the model with the uuid if an open item already shows it so
+        any changes that were not saved are kept.
+
+        """
+        if (area := self.area) is None:
+            return None
+        for item in area.dock_items():
+            model = getattr(item, member, None)
+            if model is not None and getattr(model, "uuid", "") == uuid:
+                return model
+        return None
 
 
 class DefaultWorkspace(Workspace):
@@ -203,10 +461,8 @@ class DefaultWorkspace(Workspace):
         log.debug(f"Loading area {self.plugin_id}")
         workbench = self.workbench
         plugin = workbench.get_plugin(self.plugin_id)
-        plugin.restore_state()
-        if area := plugin.area:
-            area.workbench = workbench
-        else:
-            area = plugin.create_area(workbench)
+        area = plugin.create_area(workbench)
+        if state := plugin.restore_state():
+            plugin.restore_area(area, state)
         area.set_parent(self.content)
         plugin.area = area
@@ -0,0 +1,244 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from collections import OrderedDict
+from typing import Optional
+
+from atom.api import (
+    Atom,
+    Bool,
+    Callable,
+    Dict,
+    Int,
+    List,
+    Set,
+    Str,
+    Subclass,
+    Typed,
+    Value,
+)
+from atomdb.sql import SQLModel, SQLQuerySet
+from enaml.application import deferred_call
+
+from .models.prefetch import prefetch_related
+from .query import compile_query
+from .tasks import Priority
+
+
+class ModelDataSource(Atom):
+    """A windowed view of a model table for the list views.
+
+    Rows are fetched a page at a time as they are requested, using keyset
+    pagination on the primary key when scrolling forward, and only the most
+    recently used `max_pages` pages are kept in memory. The number of rows
+    comes from a COUNT(*) query so the full table is never loaded.
+
+    """
+
+    #: Model to load
+    model = Subclass(SQLModel)
+
+    #: Django style filters applied to every query
+    filters = Dict()
+
+    #: Related fields loaded for each page with one query per relation
+    prefetch = List(str)
+
+    #: Sqlalchemy where clauses applied on top of the filters, eg from a search
+    where = List()
+
+    #: Name of the search schema used by `search`
+    schema = Str()
+
+    #: Order by the primary key descending
+    descending = Bool()
+
+    #: Optional python filter applied to each row. When set the rows matching
+    #: the filters and where clauses are scanned in chunks on refresh and
+    #: only the primary keys of the rows that match are kept.
+    predicate = Callable()
+
+    #: Primary keys of the rows matching the predicate
+    matches = List()
+
+    #: Rows per page
+    page_size = Int(100)
+
+    #: Number of pages to load after the requested one
+    read_ahead = Int(1)
+
+    #: Maximum number of pages kept in memory
+    max_pages = Int(10)
+
+    #: Number of rows in the table matching the filters
+    total = Int()
+
+    #: Number of rows in the view
+    count = Int()
+
+    #: Loaded pages, least recently used first
+    pages = Typed(OrderedDict, ())
+
+    #: Last primary key of the page before the given page index
+    cursors = Dict()
+
+    #: Pages currently being loaded
+    loading = Set()
+
+    #: Incremented whenever the loaded rows change. Bindings should depend on
+    #: this so they update when a page is loaded.
+    version = Int()
+
+    #: Incremented on refresh so pages loaded before it are discarded
+    generation = Int()
+
+    #: Returned for rows that have not been loaded yet
+    placeholder = Value()
+
+    def _default_placeholder(self):
+        return self.model()
+
+    def queryset(self) -> SQLQuerySet:
+        """Return the ordered queryset the rows are loaded from."""
+        qs = self.model.objects.filter(*self.where, **self.filters)
+        pk = self.model.__pk__
+        return qs.order_by(f"-{pk}" if self.descending else pk)
+
+    async def refresh(self):
+        """Update the row count and drop all loaded pages."""
+        self.generation += 1
+        objects = self.model.objects
+        self.total = await objects.filter(**self.filters).count()
+        if predicate := self.predicate:
+            self.matches = await self.scan(predicate)
+            self.count = len(self.matches)
+        else:
+            self.matches = []
+            if self.where:
+                qs = self.queryset()
+                self.count = await qs.count()
+            else:
+                self.count = self.total
+        self.pages = OrderedDict()
+        self.cursors = {}
+        self.loading = set()
+        self.version += 1
+
+    async def search(self, text: str):
+        """Filter the rows using a search query and refresh. The query is
+        compiled to a where clause so the database does the filtering. Terms
+        that cannot be compiled are matched by scanning the rows the where
+        clause selected with a python predicate.
+
+        Raises
+        ------
+        error: SearchError
+            If the query is invalid
+
+        """
+        text = text.strip()
+        if not text:
+            self.where = []
+            self.predicate = None
+        else:
+            query = compile_query(self.schema, text)
+            self.where = [] if query.clause is None else [query.clause]
+            self.predicate = query.remainder
+        await self.refresh()
+
+    async def scan(self, predicate) -> list:
+        """Return the primary keys of all rows that match the predicate. The
+        table is read in chunks so only one chunk is held at a time.
+
+        """
+        pk_column = self.model.objects.table.c[self.model.__pk__]
+        chunk_size = self.page_size * 10
+        matches = []
+        qs = self.queryset()
+        while True:
+            rows = await qs.limit(chunk_size)
+            if self.prefetch:
+                # The predicate may use related fields
+                await prefetch_related(rows, *self.prefetch)
+            matches.extend(row._id for row in rows if predicate(row))
+            if len(rows) < chunk_size:
+                return matches
+            last = rows[-1]._id
+            qs = self.queryset().filter(
+                pk_column < last if self.descending else pk_column > last
+            )
+
+    def get(self, row: int, version: Optional[int] = None) -> SQLModel:
+        """Return the model at the given row or the placeholder if the page
+        it is on has not been loaded yet. Missing pages are requested.
+
+        Parameters
+        ----------
+        row: int
+            The row index
+        version: int
+            Unused, pass the source's version from a binding so it updates
+            when pages are loaded.
+
+        """
+        if row < 0 or row >= self.count:
+            return self.placeholder
+        page_size = self.page_size
+        page = row // page_size
+        self.request(page)
+        items = self.pages.get(page)
+        if items is None:
+            return self.placeholder
+        self.pages.move_to_end(page)
+        i = row - page * page_size
+        return items[i] if i < len(items) else self.placeholder
+
+    def request(self, page: int):
+        """Request the given page and the pages after it be loaded."""
+        pages = self.pages
+        loading = self.loading
+        last = (self.count - 1) // self.page_size
+        for p in range(page, min(page + self.read_ahead, last) + 1):
+            if p in pages or p in loading:
+                continue
+            loading.add(p)
+            deferred_call(self.load_page(p), priority=Priority.INTERACTIVE)
+
+    async def load_page(self, page: int):
+        """Load the rows of the given page."""
+        generation = self.generation
+        page_size = self.page_size
+        Model = self.model
+        pk_column = Model.objects.table.c[Model.__pk__]
+        try:
+            if self.predicate:
+                start, end = page * page_size, (page + 1) * page_size
+                pks = self.matches[start:end]
+                rows = await self.queryset().filter(pk_column.in_(pks))
+                lookup = {row._id: row for row in rows}
+                items = [lookup[pk] for pk in pks if pk in lookup]
+            elif (cursor := self.cursors.get(page)) is not None:
+                # Seek past the last row of the previous page
+                clause = pk_column < cursor if self.descending else pk_column > cursor
+                items = await self.queryset().filter(clause).limit(page_size)
+            else:
+                qs = self.queryset().offset(page * page_size).limit(page_size)
+                items = await qs
+            if self.prefetch:
+                await prefetch_related(items, *self.prefetch)
+        finally:
+            self.loading.discard(page)
+
+        if generation != self.generation:
+            return  # Refreshed while loading
+        if items and not self.predicate:
+            self.cursors[page + 1] = items[-1]._id
+        pages = self.pages
+        pages[page] = items
+        while len(pages) > self.max_pages:
+            pages.popitem(last=False)
+        self.version += 1
@@ -0,0 +1,54 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Open and close the database without importing any of the UI so command line
+tools can use the models.
+"""
+from typing import Optional
+
+from atomdb.sql import SQLModelManager
+
+from .utils import DB_FILE, log
+
+
+async def open_database(url: Optional[str] = None):
+    from aiosqlite.sa import create_engine
+
+    mgr = SQLModelManager.instance()
+    if url is None:
+        url = DB_FILE
+    # If using mysql/postgres...
+    # m = re.match(r"(.+)://(.+):(.*)@(.+):(\d+)/(.+)", url)
+    # if not m:
+    #    raise ValueError("Database url is invalid")
+    # schema, user, pwd, host, port, db = m.groups()
+    # engine = mgr.database = await create_engine(
+    #     host=host,
+    #     port=int(port),
+    #     user=user,
+    #     password=pwd,
+    #     database=db,
+    # )
+    engine = mgr.database = await create_engine(url, isolation_level=None)
+
+    # Each session gets a new identity map
+    from zerobooks.models.cache import install_model_caches
+
+    install_model_caches()
+    return engine
+
+
+async def close_database():
+    from zerobooks.models.cache import cache_stats, clear_model_caches
+
+    for name, stats in cache_stats().items():
+        log.debug(f"{name} cache: {stats}")
+    clear_model_caches()
+    mgr = SQLModelManager.instance()
+    if db := mgr.database:
+        await db.terminate()
+        await db.wait_closed()
@@ -0,0 +1,280 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Compile the template edited in the designer in a worker process.
+
+The source is split into top level blocks (imports, functions, enamldefs)
+and the worker keeps the parsed ast of each block, so an edit only parses
+the block that changed again. The code and any syntax errors are sent back
+as `Diagnostic`s and the UI only runs the code to create the template.
+Compiles are submitted to the task dispatcher with a key so a compile still
+waiting is replaced by the newer one and the result of one that finished
+after a newer one was requested is dropped.
+"""
+import ast
+import asyncio
+import io
+import marshal
+import time
+import tokenize
+import traceback
+import types
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Optional
+
+from atom.api import Atom, Float, Int, List, Str, Typed, Value
+
+#: Parsed blocks kept by the worker
+MAX_BLOCKS = 256
+
+#: Keywords continuing the statement of the previous top level line
+CONTINUATIONS = {"else", "elif", "except", "finally"}
+
+
+class Diagnostic(Atom):
+    #: Line of the error starting from 1
+    line = Int()
+
+    #: Column of the error starting from 0
+    column = Int()
+
+    message = Str()
+
+    def __str__(self) -> str:
+        return f"Line {self.line}: {self.message}"
+
+
+def split_blocks(source: str) -> list[tuple[int, str]]:
+    """Split the source into top level statements as the line each starts on
+    and its text. Comments are part of the statement before them.
+
+    """
+    lines = source.splitlines(keepends=True)
+    starts = [1]
+    depth = 0
+    new_line = True
+    joined = False  # A decorator is part of the next statement
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+            if tok.type == tokenize.INDENT:
+                depth += 1
+            elif tok.type == tokenize.DEDENT:
+                depth -= 1
+            elif tok.type == tokenize.NEWLINE:
+                new_line = True
+            elif tok.type in (tokenize.NL, tokenize.COMMENT, tokenize.ENDMARKER):
+                pass
+            else:
+                if new_line and depth == 0:
+                    line = tok.start[0]
+                    if not joined and tok.string not in CONTINUATIONS:
+                        if line > starts[-1]:
+                            starts.append(line)
+                    joined = tok.string == "@"
+                new_line = False
+    except (tokenize.TokenError, SyntaxError):
+        # Let the parser report it
+        return [(1, source)]
+    # Indexes of the first and after the last line of each block
+    firsts = [s - 1 for s in starts]
+    ends = firsts[1:] + [len(lines)]
+    return [(i + 1, "".join(lines[i:end])) for i, end in zip(firsts, ends)]
+
+
+def shift_lines(node: Any, n: int):
+    """Move the enaml or python ast node down n lines."""
+    if isinstance(node, ast.AST):
+        ast.increment_lineno(node, n)
+    elif isinstance(node, list):
+        for child in node:
+            shift_lines(child, n)
+    elif isinstance(node, Atom):
+        for name in node.members():
+            value = getattr(node, name)
+            if name in ("lineno", "end_lineno"):
+                if value >= 0:
+                    setattr(node, name, value + n)
+            else:
+                shift_lines(value, n)
+
+
+def syntax_diagnostic(e: Exception, offset: int = 0) -> Diagnostic:
+    if isinstance(e, tokenize.TokenError):
+        message, (line, column) = e.args
+    else:
+        message = getattr(e, "msg", "") or str(e)
+        line, column = getattr(e, "lineno", 0) or 1, getattr(e, "offset", 0) or 1
+        column -= 1  # Syntax errors count columns from 1
+    return Diagnostic(line=line + offset, column=max(column, 0), message=message)
+
+
+#: Parsed blocks of the worker by the text as the line the block started on
+#: and the ast. Most recently used last.
+blocks: dict[str, tuple[int, Any]] = {}
+
+
+def parse_block(text: str, start: int, filename: str) -> Any:
+    """Parse the block or reuse the ast parsed for the same text."""
+    from enaml.core.parser import parse
+
+    if (cached := blocks.pop(text, None)) is None:
+        # Parse it alone and move it to where it is in the source
+        module = parse(text, filename)
+        shift_lines(module, start - 1)
+    else:
+        line, module = cached
+        if line != start:
+            shift_lines(module, start - line)
+    blocks[text] = (start, module)
+    if len(blocks) > MAX_BLOCKS:
+        del blocks[next(iter(blocks))]
+    return module
+
+
+def compile_source(source: str, filename: str) -> tuple[Optional[bytes], list, int]:
+    """Compile the enaml source in the worker.
+
+    Returns
+    -------
+    result: tuple[Optional[bytes], list, int]
+        The marshalled code or None if it failed, the line, column and
+        message of each error and the number of blocks that were parsed
+
+    """
+    from enaml.core.enaml_ast import Module
+    from enaml.core.enaml_compiler import EnamlCompiler
+
+    body: list = []
+    pragmas: list = []
+    errors = []
+    parsed = 0
+    seen = set()
+    for start, text in split_blocks(source):
+        if not text.strip():
+            continue
+        if text in seen:
+            blocks.pop(text, None)  # The same ast cannot be used twice
+        seen.add(text)
+        parsed += text not in blocks
+        try:
+            module = parse_block(text, start, filename)
+        except (SyntaxError, tokenize.TokenError) as e:
+            errors.append(syntax_diagnostic(e, start - 1))
+            continue
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}"
+            errors.append(Diagnostic(line=start, message=message))
+            continue
+        body.extend(module.body)
+        pragmas.extend(module.pragmas)
+    if not errors:
+        try:
+            module = Module(body=body, pragmas=pragmas, lineno=1)
+            return marshal.dumps(EnamlCompiler.compile(module, filename)), [], parsed
+        except SyntaxError as e:
+            errors.append(syntax_diagnostic(e))
+        except Exception as e:
+            errors.append(Diagnostic(line=1, message=f"{type(e).__name__}: {e}"))
+    return None, [(d.line, d.column, d.message) for d in errors], parsed
+
+
+def runtime_diagnostics(e: BaseException, filename: str) -> list[Diagnostic]:
+    """Return the lines of the template in the traceback of the error."""
+    message = f"{type(e).__name__}: {e}"
+    if isinstance(e, SyntaxError) and e.filename == filename:
+        return [syntax_diagnostic(e)]
+    lines = [
+        frame.lineno
+        for frame in traceback.extract_tb(e.__traceback__)
+        if frame.filename == filename and frame.lineno
+    ]
+    # The deepest frame is where it failed
+    return [Diagnostic(line=lines[-1] if lines else 1, message=message)]
+
+
+class CompileResult(Atom):
+    #: Compiled code or None if it failed
+    code = Typed(types.CodeType)
+
+    diagnostics = List(Diagnostic)
+
+    #: Number of blocks that were parsed and not reused
+    parsed = Int()
+
+    #: Seconds from the request to the result
+    elapsed = Float()
+
+
+class TemplateCompiler(Atom):
+    #: Name the template is compiled as, used in tracebacks
+    filename = Str("invoice.enaml")
+
+    #: Worker process
+    executor = Typed(ProcessPoolExecutor)
+
+    #: Incremented for each compile requested
+    generation = Int()
+
+    #: Future of the compile running in the worker
+    future = Value()
+
+    def start(self):
+        """Start the worker so the first compile does not wait for it."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(1, mp_context=get_context("spawn"))
+            # Import the parser in the worker now
+            self.executor.submit(compile_source, "", self.filename)
+
+    def stop(self):
+        if executor := self.executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def compile(self, source: str) -> Optional[CompileResult]:
+        """Compile the source in the worker.
+
+        Returns
+        -------
+        result: Optional[CompileResult]
+            The result or None if another compile was requested before this
+            one finished
+
+        """
+        self.start()
+        assert self.executor is not None
+        self.generation += 1
+        generation = self.generation
+        start = time.perf_counter()
+        # Wait for the compile of an older version so only one runs at a time
+        if (future := self.future) is not None:
+            await asyncio.wait([asyncio.wrap_future(future)])
+            if generation != self.generation:
+                return None
+        self.future = self.executor.submit(compile_source, source, self.filename)
+        code, errors, parsed = await asyncio.wrap_future(self.future)
+        if generation != self.generation:
+            return None  # Stale
+        return CompileResult(
+            code=marshal.loads(code) if code is not None else None,
+            diagnostics=[
+                Diagnostic(line=line, column=column, message=message)
+                for line, column, message in errors
+            ],
+            parsed=parsed,
+            elapsed=time.perf_counter() - start,
+        )
+
+    def load(self, code: types.CodeType) -> Any:
+        """Run the compiled code and return the InvoiceTemplate it defines."""
+        import enaml
+
+        module = types.ModuleType("__designer__")
+        module.__file__ = self.filename
+        with enaml.imports():
+            exec(code, module.__dict__)
+        return module.InvoiceTemplate
@@ -0,0 +1,202 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+A disk cache of the documents rendered for invoices.
+
+Documents are stored by a hash of the invoice snapshot (see
+`zerobooks.templates.registry`) and the source of its template, so an invoice
+that did not change is not rendered again and an edit or a new template
+simply misses the cache. The least recently used files are removed when the
+cache grows over its size limit.
+"""
+import hashlib
+import os
+import shutil
+from typing import Optional
+
+from atom.api import Atom, Bool, Int, Str
+
+from .templates.registry import registry, snapshot_invoice, snapshot_state
+from .utils import CONFIG_DIR, log
+
+#: Directory of the cache
+CACHE_DIR = os.path.join(CONFIG_DIR, "documents")
+
+#: Changed when the documents rendered from the same snapshot change
+VERSION = 1
+
+
+def remove(path: str):
+    """Remove the file if it exists."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def invoice_key(invoice) -> str:
+    """Hash of what the documents of the invoice are rendered from. The items
+    and customers must already be loaded.
+
+    """
+    compiled = registry.get(invoice.template_module)
+    snapshot = snapshot_state(snapshot_invoice(invoice))
+    state = (VERSION, compiled.name, compiled.digest, snapshot)
+    return hashlib.sha256(repr(state).encode()).hexdigest()
+
+
+def view_key(invoice) -> str:
+    """Return the key of the invoice if its view is the template the key is
+    for and not eg one from the designer.
+
+    """
+    compiled = registry.get(invoice.template_module)
+    if type(invoice.view) is not compiled.template:
+        return ""
+    return invoice_key(invoice)
+
+
+class DocumentCache(Atom):
+    #: Directory of the files
+    directory = Str(CACHE_DIR)
+
+    #: Files are removed when their total size is over this many bytes
+    max_size = Int(256 * 1024 * 1024)
+
+    #: Total size of the files once they were scanned
+    size = Int()
+
+    #: Whether the size of the files in the directory is known
+    scanned = Bool()
+
+    #: Number of documents found and not found
+    hits = Int()
+    misses = Int()
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{ext}")
+
+    def lookup(self, key: str, ext: str) -> Optional[str]:
+        """Return the path of the cached document and mark it as used."""
+        path = self.path(key, ext)
+        try:
+            # The modified time is when it was last used
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, key: str, ext: str) -> Optional[bytes]:
+        if (path := self.lookup(key, ext)) is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def copy_to(self, key: str, ext: str, dest: str) -> bool:
+        """Copy the cached document to the path and return whether it was
+        cached.
+
+        """
+        if (path := self.lookup(key, ext)) is None:
+            return False
+        tmp = f"{dest}.tmp"
+        try:
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, dest)
+        except OSError as e:
+            log.warning(f"Could not copy cached document {path}: {e}")
+            remove(tmp)
+            return False
+        return True
+
+    def put(self, key: str, ext: str, data: bytes):
+        """Store the document."""
+        self.write(key, ext, lambda f: f.write(data))
+
+    def put_file(self, key: str, ext: str, src: str):
+        """Store a copy of the file."""
+
+        def copy(f):
+            with open(src, "rb") as source:
+                shutil.copyfileobj(source, f)
+
+        self.write(key, ext, copy)
+
+    def write(self, key: str, ext: str, write):
+        path = self.path(key, ext)
+        # Readers see the whole file or none of it
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            log.warning(f"Could not cache document {path}: {e}")
+            remove(tmp)
+            return
+        # Replacing a document only changes the size by the difference
+        self.size += size - old_size
+        if not self.scanned or self.size > self.max_size:
+            self.evict()
+
+    def files(self) -> list[tuple[float, int, str]]:
+        """Return the last used time, size and path of each file."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for f in os.scandir(entry.path):
+                if f.name.endswith(".tmp"):
+                    continue  # Being written
+                try:
+                    stat = f.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, f.path))
+        return files
+
+    def evict(self):
+        """Remove the least recently used files until the cache is under
+        90% of its size limit so it is not scanned after every write.
+
+        """
+        files = self.files()
+        self.size = sum(f[1] for f in files)
+        self.scanned = True
+        if self.size <= self.max_size:
+            return
+        target = self.max_size * 9 // 10
+        removed = 0
+        for used, size, path in sorted(files):
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            removed += 1
+        log.debug(f"Removed {removed} documents from the cache")
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.size = 0
+
+
+#: Rendered documents
+document_cache = DocumentCache()
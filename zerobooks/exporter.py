@@ -0,0 +1,356 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Export the ledger (invoices, line items, payments and refunds) to CSV or JSON
+lines files.
+
+Rows are read a page at a time straight from the tables, without creating any
+models, and written as they are read so memory use does not depend on the
+size of the database. Run it with `python -m zerobooks export path/to/dir`.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal as D
+from typing import IO, Any, AsyncIterator, Callable, Optional
+
+import sqlalchemy as sa
+from atom.api import Atom, Dict, Float, Int, List, Str
+
+from .models.customer import Customer
+from .models.invoice import Invoice, InvoiceItem
+from .models.payment import Payment, Refund
+from .utils import log
+
+#: Number of rows read per query
+PAGE_SIZE = 1000
+
+FORMATS = ("csv", "jsonl")
+
+CENTS = D("0.01")
+
+#: Kinds of records in the order they are exported
+KINDS = ("invoices", "items", "payments", "refunds")
+
+
+class ExportStats(Atom):
+    #: Number of rows written of each kind
+    counts = Dict(str, int)
+
+    #: Total number of rows written
+    rows = Int()
+
+    #: Files written
+    files = List(str)
+
+    #: Kind of records being exported
+    kind = Str()
+
+    #: Seconds since the export started
+    elapsed = Float()
+
+    @property
+    def rate(self) -> float:
+        """Rows written per second"""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        counts = ", ".join(f"{n} {kind}" for kind, n in self.counts.items())
+        return (
+            f"Exported {counts} in {self.elapsed:.1f}s ({self.rate:.0f} rows/s)"
+        )
+
+
+def invoices_query() -> sa.sql.Select:
+    c = Invoice.objects.table.c
+    customer = Customer.objects.table.c
+    return sa.select(
+        c.id,
+        c.uuid,
+        c.number,
+        c.date,
+        c.due_date,
+        c.terms,
+        c.status,
+        c.customer.label("customer_id"),
+        customer.company.label("customer_company"),
+        customer.first_name.label("customer_first_name"),
+        customer.last_name.label("customer_last_name"),
+        customer.email.label("customer_email"),
+        c.project,
+        c.subtotal,
+        c.tax_rate,
+        c.total_tax,
+        c.total_adjustments,
+        c.total_amount,
+        c.notes,
+        c.created,
+        c.updated,
+    ).select_from(
+        Invoice.objects.table.outerjoin(
+            Customer.objects.table, c.customer == customer.id
+        )
+    )
+
+
+def items_query() -> sa.sql.Select:
+    c = InvoiceItem.objects.table.c
+    invoice = Invoice.objects.table.c
+    return sa.select(
+        c.id,
+        c.invoice.label("invoice_id"),
+        invoice.number.label("invoice_number"),
+        c.position,
+        c.name,
+        c.description,
+        c.quantity,
+        c.rate,
+        c.amount,
+        c.taxable,
+    ).select_from(
+        InvoiceItem.objects.table.join(
+            Invoice.objects.table, c.invoice == invoice.id
+        )
+    )
+
+
+def payments_query() -> sa.sql.Select:
+    c = Payment.objects.table.c
+    return sa.select(
+        c.id,
+        c.uuid,
+        c.invoice.label("invoice_id"),
+        c.customer.label("customer_id"),
+        c.amount,
+        c.ref,
+        c.created,
+        c.updated,
+    )
+
+
+def refunds_query() -> sa.sql.Select:
+    c = Refund.objects.table.c
+    return sa.select(
+        c.id,
+        c.uuid,
+        c.payment.label("payment_id"),
+        c.amount,
+        c.ref,
+        c.created,
+        c.updated,
+    )
+
+
+#: Query of each kind, the first column is the primary key
+QUERIES = {
+    "invoices": invoices_query,
+    "items": items_query,
+    "payments": payments_query,
+    "refunds": refunds_query,
+}
+
+
+async def iter_pages(
+    query: sa.sql.Select, page_size: int = PAGE_SIZE
+) -> AsyncIterator[list]:
+    """Yield the rows of the query a page at a time. The first column must be
+    the primary key, each page continues after the last key of the previous
+    one so every query uses the primary key index no matter how far along it
+    is.
+
+    """
+    key = query.selected_columns[0]
+    last = None
+    while True:
+        q = query.order_by(key).limit(page_size)
+        if last is not None:
+            q = q.where(key > last)
+        rows = await Invoice.objects.fetchall(q)
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def plain(value: Any) -> Any:
+    """Convert a database value to a value that can be written to a file."""
+    if value is None:
+        return ""
+    if isinstance(value, D):
+        # Drop the padding of the column scale but keep at least cents
+        value = value.normalize()
+        if value.as_tuple().exponent > -2:
+            value = value.quantize(CENTS)
+        return f"{value:f}"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def columns(kind: str) -> tuple[str, ...]:
+    return tuple(c.name for c in QUERIES[kind]().selected_columns)
+
+
+class Writer:
+    """Writes rows to a csv or JSON lines file."""
+
+    def __init__(self, f: IO[str], format: str, columns: tuple[str, ...]):
+        self.f = f
+        self.columns = columns
+        if format == "csv":
+            self.csv = csv.writer(f)
+            self.csv.writerow(columns)
+        else:
+            self.csv = None
+
+    def write(self, rows: list[tuple]):
+        if self.csv is not None:
+            self.csv.writerows(rows)
+        else:
+            names = self.columns
+            self.f.writelines(
+                json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n"
+                for row in rows
+            )
+
+
+def open_file(path: str, compress: bool) -> IO[str]:
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+async def export_kind(
+    kind: str,
+    path: str,
+    format: str = "csv",
+    compress: bool = False,
+    page_size: int = PAGE_SIZE,
+    stats: Optional[ExportStats] = None,
+    progress: Optional[Callable[[ExportStats], Any]] = None,
+) -> ExportStats:
+    """Export every record of one kind to the file at the path.
+
+    Parameters
+    ----------
+    kind: str
+        One of invoices, items, payments or refunds
+    path: str
+        The file to write
+    format: str
+        Either csv or jsonl
+    compress: bool
+        Whether to gzip the file
+    page_size: int
+        Number of rows read per query
+    stats: ExportStats
+        Stats to add to when exporting several kinds
+    progress: Callable[[ExportStats], Any]
+        Called with the stats after each page is written
+
+    Returns
+    -------
+    stats: ExportStats
+        The number of rows written
+
+    """
+    if kind not in QUERIES:
+        raise ValueError(f"Cannot export '{kind}', expected one of {KINDS}")
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format '{format}', expected one of {FORMATS}")
+    if stats is None:
+        stats = ExportStats()
+    stats.kind = kind
+    stats.counts[kind] = 0
+    start = time.perf_counter() - stats.elapsed
+    names = columns(kind)
+    indexes = range(len(names))
+    with open_file(path, compress) as f:
+        writer = Writer(f, format, names)
+        async for page in iter_pages(QUERIES[kind](), page_size):
+            rows = [tuple(plain(row[i]) for i in indexes) for row in page]
+            writer.write(rows)
+            stats.counts[kind] += len(rows)
+            stats.rows += len(rows)
+            stats.elapsed = time.perf_counter() - start
+            if progress is not None:
+                progress(stats)
+    stats.files.append(path)
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+async def export_ledger(
+    directory: str,
+    format: str = "csv",
+    compress: bool = False,
+    page_size: int = PAGE_SIZE,
+    progress: Optional[Callable[[ExportStats], Any]] = None,
+) -> ExportStats:
+    """Export the invoices, line items, payments and refunds to a file of
+    each kind (eg invoices.csv.gz) in the directory.
+
+    Returns
+    -------
+    stats: ExportStats
+        The number of rows written of each kind and the files
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    ext = f".{format}.gz" if compress else f".{format}"
+    stats = ExportStats()
+    for kind in KINDS:
+        path = os.path.join(directory, f"{kind}{ext}")
+        await export_kind(kind, path, format, compress, page_size, stats, progress)
+    log.info(str(stats))
+    return stats
+
+
+async def run(args: argparse.Namespace) -> ExportStats:
+    from .db import close_database, open_database
+
+    def progress(stats: ExportStats):
+        print(f"{stats.rows} rows ({stats.rate:.0f} rows/s)", end="\r")
+
+    await open_database(args.db)
+    try:
+        return await export_ledger(
+            args.directory, args.format, args.gzip, args.page_size, progress
+        )
+    finally:
+        await close_database()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks export",
+        description="Export the invoices, line items, payments and refunds",
+    )
+    parser.add_argument("directory", help="Directory to write the files to")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true", help="Compress the files")
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    parser.add_argument(
+        "--page-size", type=int, default=PAGE_SIZE, help="Rows read per query"
+    )
+    args = parser.parse_args(argv)
+    stats = asyncio.run(run(args))
+    print()
+    print(stats)
+    for path in stats.files:
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
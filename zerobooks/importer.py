@@ -0,0 +1,737 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Bulk import customers, addresses, products and invoices from CSV, JSON or
+JSON lines files.
+
+Records are read and validated a chunk at a time and each chunk is inserted
+with executemany in a single transaction, so large files import at a
+steady rate in constant memory. Invalid rows are skipped and reported. Run it
+with `python -m zerobooks import customers path/to/customers.csv`.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal as D
+from decimal import InvalidOperation
+from itertools import groupby, islice
+from typing import Any, Callable, Iterable, Iterator, Optional
+from uuid import uuid4
+
+import sqlalchemy as sa
+from atom.api import Atom, Dict, Float, Int, List, Str, Typed
+
+from .models.address import Address
+from .models.balance import Effects, add_effect, apply_effects, ledger, month_of
+from .models.customer import Customer, split_name
+from .models.invoice import Invoice, InvoiceItem
+from .models.prefetch import chunks
+from .models.product import Product
+from .models.sequence import advance_sequence, format_number, reserve_numbers
+from .models.system import System
+from .utils import log
+from .validators import PhoneNumberValidator
+
+#: Number of records validated and inserted per transaction
+CHUNK_SIZE = 1000
+
+#: Number of error messages kept for the report
+MAX_ERRORS = 100
+
+ADDRESS_FIELDS = ("street", "city", "state", "zipcode", "country")
+
+#: An address as (street, city, state, zipcode, country)
+AddressKey = tuple[str, str, str, str, str]
+
+EMPTY_ADDRESS: AddressKey = ("", "", "", "", "US")
+
+
+class RowError(ValueError):
+    """Raised when a record cannot be imported."""
+
+
+class ImportStats(Atom):
+    #: Kind of records imported
+    kind = Str()
+
+    #: Number of records read
+    rows = Int()
+
+    #: Number of rows inserted
+    created = Int()
+
+    #: Number of records skipped because they are invalid
+    skipped = Int()
+
+    #: The first errors as (line, message) tuples
+    errors = List(tuple)
+
+    #: Seconds since the import started
+    elapsed = Float()
+
+    @property
+    def rate(self) -> float:
+        """Records read per second"""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def error(self, line: int, message: str):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self) -> str:
+        return (
+            f"Imported {self.created} {self.kind} from {self.rows} records in "
+            f"{self.elapsed:.1f}s ({self.rate:.0f} rows/s), "
+            f"{self.skipped} skipped"
+        )
+
+
+def read_records(path: str) -> Iterator[dict[str, Any]]:
+    """Yield each record of a .csv, .jsonl or .json file."""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+    elif path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif path.endswith(".json"):
+        # An array has to be loaded whole, use JSON lines for large files
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from data if isinstance(data, list) else [data]
+    else:
+        raise ValueError(f"Cannot import {path}, expected a csv, json or jsonl file")
+
+
+def chunked(records: Iterable, size: int) -> Iterator[list]:
+    it = iter(records)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def text(value: Any) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def to_decimal(value: Any, default: D = D()) -> D:
+    value = text(value).lstrip("$").replace(",", "")
+    if not value:
+        return default
+    try:
+        return D(value)
+    except InvalidOperation:
+        raise RowError(f"Invalid number '{value}'")
+
+
+def to_datetime(value: Any) -> Optional[datetime]:
+    value = text(value)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError(f"Invalid date '{value}', expected YYYY-MM-DD")
+
+
+def to_bool(value: Any) -> bool:
+    return text(value).lower() in ("1", "true", "yes", "y", "x")
+
+
+async def insert_rows(conn, table: sa.Table, rows: list[dict]):
+    """Insert the rows with a single executemany. All rows must have the same
+    keys.
+
+    """
+    if rows:
+        await conn.execute(table.insert(), rows)
+
+
+async def find_addresses(conn, keys: set[AddressKey]) -> dict[AddressKey, int]:
+    """Return the id of the existing address matching each key."""
+    c = Address.objects.table.c
+    ids: dict[AddressKey, int] = {}
+    streets = sorted({key[0] for key in keys})
+    for part in chunks(streets):
+        q = sa.select(c.id, c.street, c.city, c.state, c.zipcode, c.country)
+        rows = await Address.objects.fetchall(
+            q.where(c.street.in_(part)), connection=conn
+        )
+        for row in rows:
+            key = (row[1], row[2], row[3], row[4], row[5])
+            if key in keys:
+                ids.setdefault(key, row[0])
+    return ids
+
+
+async def create_addresses(conn, keys: list[AddressKey]) -> list[int]:
+    """Insert an address for each key and return the new ids in order."""
+    if not keys:
+        return []
+    now = datetime.now()
+    rows = [
+        dict(zip(ADDRESS_FIELDS, key), uuid=uuid4().hex, created=now, updated=now)
+        for key in keys
+    ]
+    await insert_rows(conn, Address.objects.table, rows)
+    c = Address.objects.table.c
+    ids = {}
+    for part in chunks([row["uuid"] for row in rows]):
+        q = sa.select(c.uuid, c.id).where(c.uuid.in_(part))
+        for row in await Address.objects.fetchall(q, connection=conn):
+            ids[row[0]] = row[1]
+    return [ids[row["uuid"]] for row in rows]
+
+
+async def resolve_addresses(conn, keys: set[AddressKey]) -> dict[AddressKey, int]:
+    """Return the id of the address matching each key, inserting the ones
+    that do not exist yet.
+
+    """
+    ids = await find_addresses(conn, keys)
+    missing = [key for key in keys if key not in ids]
+    ids.update(zip(missing, await create_addresses(conn, missing)))
+    return ids
+
+
+class Importer(Atom):
+    """Imports one kind of record. Subclasses validate each record into a
+    table row in `prepare` and insert a chunk of rows in `insert`.
+
+    """
+
+    #: Name used on the command line and in the menu
+    kind = ""
+
+    #: Model the records are imported into
+    model = None
+
+    #: Progress of the current import
+    stats = Typed(ImportStats)
+
+    #: Column values of a new row
+    defaults = Dict()
+
+    def _default_defaults(self):
+        defaults = self.model().__prepare_state_for_db__()
+        for name in ("uuid", "created", "updated"):
+            defaults.pop(name, None)
+        return defaults
+
+    def new_row(self, **values) -> dict[str, Any]:
+        now = datetime.now()
+        row = dict(self.defaults, uuid=uuid4().hex, created=now, updated=now)
+        row.update(values)
+        return row
+
+    def records(self, path: str) -> Iterator[tuple[int, Any]]:
+        """Yield (line, record) for each record in the file."""
+        return enumerate(read_records(path), 1)
+
+    async def setup(self):
+        """Load anything needed before the first chunk."""
+
+    def prepare(self, record: Any) -> dict[str, Any]:
+        """Validate the record and return the row to insert.
+
+        Raises
+        ------
+        RowError
+            If the record is invalid.
+
+        """
+        raise NotImplementedError
+
+    async def insert(self, conn, rows: list[tuple[int, dict]]) -> int:
+        """Insert the prepared rows and return the number inserted."""
+        await insert_rows(conn, self.model.objects.table, [row for _, row in rows])
+        return len(rows)
+
+    def committed(self, rows: list[tuple[int, Any]]):
+        """Called after the transaction inserting the rows was committed."""
+
+    async def run(
+        self,
+        path: str,
+        chunk_size: int = CHUNK_SIZE,
+        progress: Optional[Callable[[ImportStats], Any]] = None,
+    ) -> ImportStats:
+        """Import the file.
+
+        Parameters
+        ----------
+        path: str
+            The .csv, .json or .jsonl file to import
+        chunk_size: int
+            Number of records inserted per transaction
+        progress: Callable[[ImportStats], Any]
+            Called with the stats after each chunk
+
+        Returns
+        -------
+        stats: ImportStats
+            The number of records imported and skipped
+
+        """
+        stats = self.stats = ImportStats(kind=self.kind)
+        start = time.perf_counter()
+        await self.setup()
+        for chunk in chunked(self.records(path), chunk_size):
+            rows = []
+            for line, record in chunk:
+                stats.rows += 1
+                try:
+                    rows.append((line, self.prepare(record)))
+                except RowError as e:
+                    stats.error(line, str(e))
+            if rows:
+                async with self.model.transaction() as conn:
+                    stats.created += await self.insert(conn, rows)
+                self.committed(rows)
+            stats.elapsed = time.perf_counter() - start
+            if progress is not None:
+                progress(stats)
+        stats.elapsed = time.perf_counter() - start
+        log.info(str(stats))
+        return stats
+
+
+class AddressImporter(Importer):
+    """Imports addresses that do not exist yet. Records have the street,
+    city, state, zipcode and country columns.
+
+    """
+
+    kind = "addresses"
+    model = Address
+
+    def address(self, record: dict, prefix: str = "") -> Optional[AddressKey]:
+        """Validate the address columns of the record with the prefix and
+        return the address key or None if they are blank.
+
+        """
+        street, city, state, zipcode, country = (
+            text(record.get(f"{prefix}{name}")) for name in ADDRESS_FIELDS
+        )
+        if not (street or city or state or zipcode):
+            return None
+        state = state.upper()
+        country = country.upper() or "US"
+        if state not in Address.STATES and state:
+            raise RowError(f"Invalid {prefix}state '{state}'")
+        if country not in Address.COUNTRIES:
+            raise RowError(f"Invalid {prefix}country '{country}'")
+        return (street, city, state, zipcode, country)
+
+    def prepare(self, record: dict) -> AddressKey:
+        key = self.address(record)
+        if key is None:
+            raise RowError("Address is blank")
+        return key
+
+    async def insert(self, conn, rows: list[tuple[int, AddressKey]]) -> int:
+        keys = {key for _, key in rows}
+        ids = await find_addresses(conn, keys)
+        missing = [key for key in keys if key not in ids]
+        await create_addresses(conn, missing)
+        return len(missing)
+
+
+class CustomerImporter(AddressImporter):
+    """Imports customers. Records have either a name column or the name part
+    columns, the contact columns and the billing and shipping addresses as
+    columns prefixed with `billing_` and `shipping_`. Addresses matching an
+    existing one are shared. The open balance and total spend are computed
+    from the invoices and payments so are not imported.
+
+    """
+
+    kind = "customers"
+    model = Customer
+
+    #: Columns copied as is
+    fields = (
+        "title",
+        "first_name",
+        "middle_name",
+        "last_name",
+        "suffix",
+        "company",
+        "email",
+        "website",
+        "notes",
+        "display_name_format",
+    )
+
+    #: Validates the phone columns
+    validator = Typed(PhoneNumberValidator, ())
+
+    #: Name parts from the system config
+    prefixes = Typed(frozenset)
+    suffixes = Typed(frozenset)
+
+    async def setup(self):
+        sys_config, _ = await System.objects.get_or_create()
+        self.prefixes = frozenset(sys_config.name_prefixes)
+        self.suffixes = frozenset(sys_config.name_suffixes)
+
+    def phone_number(self, record: dict, name: str) -> str:
+        value = text(record.get(name))
+        validator = self.validator
+        if not value or validator.validate(value):
+            return value
+        value = validator.fixup(value)
+        if not validator.validate(value):
+            raise RowError(f"Invalid {name} '{value}'")
+        return value
+
+    def prepare(self, record: dict) -> dict[str, Any]:
+        values = {name: text(record[name]) for name in self.fields if name in record}
+        if name := text(record.get("name")):
+            for part, value in split_name(name, self.prefixes, self.suffixes).items():
+                if not values.get(part):
+                    values[part] = value
+        if not (
+            values.get("first_name") or values.get("last_name") or values.get("company")
+        ):
+            raise RowError("Missing name or company")
+        for name in ("phone", "mobile", "fax"):
+            values[name] = self.phone_number(record, name)
+        values["internal"] = False
+
+        # Resolved to ids when the chunk is inserted, the billing address
+        # columns may also be given without the prefix
+        billing = self.address(record, "billing_") or self.address(record)
+        values["billing_address"] = billing
+        values["shipping_address"] = self.address(record, "shipping_")
+        return self.new_row(**values)
+
+    async def insert(self, conn, rows: list[tuple[int, dict]]) -> int:
+        rows = [row for _, row in rows]
+        keys = set()
+        for row in rows:
+            keys.add(row["billing_address"])
+            keys.add(row["shipping_address"])
+        keys.discard(None)
+        ids = await resolve_addresses(conn, keys)
+
+        # Every customer has a billing address so the ones without one each
+        # get an empty address of their own to edit
+        blank = [row for row in rows if row["billing_address"] is None]
+        empty = await create_addresses(conn, [EMPTY_ADDRESS] * len(blank))
+        for row in rows:
+            for name in ("billing_address", "shipping_address"):
+                if key := row[name]:
+                    row[name] = ids[key]
+        for row, pk in zip(blank, empty):
+            row["billing_address"] = pk
+        await insert_rows(conn, Customer.objects.table, rows)
+        return len(rows)
+
+
+class ProductImporter(Importer):
+    """Imports products. Records have the name, description, price and
+    taxable columns.
+
+    """
+
+    kind = "products"
+    model = Product
+
+    def prepare(self, record: dict) -> dict[str, Any]:
+        name = text(record.get("name"))
+        if not name:
+            raise RowError("Missing name")
+        return self.new_row(
+            name=name,
+            description=text(record.get("description")),
+            price=to_decimal(record.get("price")),
+            taxable=to_bool(record.get("taxable")),
+        )
+
+
+class InvoiceImporter(Importer):
+    """Imports invoices issued by the company. Records have the number, date,
+    due_date, terms, status, project, notes, tax_rate, total_tax and
+    total_adjustments columns and the customer as either a `customer` id or
+    `customer_email` column. The total_tax is only used when there is no
+    tax_rate.
+
+    Invoices without a number are given the next numbers of the sequence of
+    the company.
+
+    The line items are either an `items` column with a JSON list of objects
+    with the name, description, quantity, rate and taxable or the
+    `item_name`, `item_description`, `item_quantity`, `item_rate` and
+    `item_taxable` columns of consecutive records with the same invoice
+    number.
+
+    """
+
+    kind = "invoices"
+    model = Invoice
+
+    #: Id of the company issuing the invoices
+    owner = Int()
+
+    async def setup(self):
+        company, _ = await Customer.objects.get_or_create(internal=True)
+        self.owner = company._id
+
+    def records(self, path: str) -> Iterator[tuple[int, list[dict]]]:
+        """Yield the records of each invoice, the records of an invoice with
+        one record per line item are consecutive and have the same number.
+
+        """
+
+        def number(item):
+            line, record = item
+            return text(record.get("number")) or -line
+
+        for _, group in groupby(enumerate(read_records(path), 1), number):
+            group = list(group)
+            yield group[0][0], [record for _, record in group]
+
+    def items(self, records: list[dict]) -> list[InvoiceItem]:
+        items = records[0].get("items")
+        if isinstance(items, str):
+            try:
+                items = json.loads(items) if items.strip() else []
+            except ValueError:
+                raise RowError("Invalid items, expected a JSON list")
+        if items is None:
+            items = [
+                {
+                    name[5:]: value
+                    for name, value in record.items()
+                    if name.startswith("item_")
+                }
+                for record in records
+            ]
+        if not isinstance(items, list):
+            raise RowError("Invalid items, expected a JSON list")
+        return [
+            InvoiceItem(
+                name=text(item.get("name")),
+                description=text(item.get("description")),
+                quantity=to_decimal(item.get("quantity"), D(1)),
+                rate=to_decimal(item.get("rate")),
+                taxable=to_bool(item.get("taxable")),
+            )
+            for item in items
+            if isinstance(item, dict) and any(map(text, item.values()))
+        ]
+
+    def prepare(self, records: list[dict]) -> tuple[dict, list[dict]]:
+        record = records[0]
+        # Invoices without a number are numbered when the chunk is inserted
+        invoice = Invoice(number=text(record.get("number")))
+        if terms := text(record.get("terms")):
+            invoice.terms = terms
+        if date := to_datetime(record.get("date")):
+            invoice.date = date
+        if due_date := to_datetime(record.get("due_date")):
+            invoice.due_date = due_date
+        if status := text(record.get("status")).lower():
+            if status not in Invoice.status.items:
+                raise RowError(f"Invalid status '{status}'")
+            invoice.status = status
+        invoice.project = text(record.get("project"))
+        invoice.notes = text(record.get("notes"))
+        invoice.tax_rate = to_decimal(record.get("tax_rate"))
+        invoice.total_adjustments = to_decimal(record.get("total_adjustments"))
+        invoice.items = self.items(records)
+        if not invoice.tax_rate and text(record.get("total_tax")):
+            # Keep the tax of invoices from systems without a tax rate
+            invoice.total_tax = to_decimal(record.get("total_tax"))
+
+        row = invoice.__prepare_state_for_db__()
+        row["owner"] = self.owner
+        # Resolved to an id when the chunk is inserted
+        if customer := text(record.get("customer")):
+            try:
+                row["customer"] = ("id", int(customer))
+            except ValueError:
+                raise RowError(f"Invalid customer id '{customer}'")
+        elif email := text(record.get("customer_email")):
+            row["customer"] = ("email", email.lower())
+        else:
+            raise RowError("Missing customer or customer_email")
+
+        # The invoice is set when the chunk is inserted
+        items = []
+        for position, item in enumerate(invoice.items):
+            item.position = position
+            items.append(item.__prepare_state_for_db__())
+        return row, items
+
+    async def find_customers(self, conn, name: str, values: set) -> dict:
+        """Return the id of the customer with each id or email."""
+        c = Customer.objects.table.c
+        column = c.id if name == "id" else sa.func.lower(c.email)
+        ids: dict = {}
+        for part in chunks(sorted(values)):
+            q = sa.select(column.label("value"), c.id).where(column.in_(part))
+            q = q.where(c.internal.is_(False)).order_by(c.id)
+            for row in await Customer.objects.fetchall(q, connection=conn):
+                ids.setdefault(row[0], row[1])
+        return ids
+
+    async def assign_numbers(self, conn, rows: list[dict]):
+        """Number the invoices without a number from the sequence of the
+        company and make sure the sequence continues after any imported
+        numbers.
+
+        """
+        unnumbered = [row for row in rows if not row["number"]]
+        if unnumbered:
+            numbers, format = await reserve_numbers(
+                conn, self.owner, len(unnumbered)
+            )
+            for row, n in zip(unnumbered, numbers):
+                row["number"] = format_number(format, n, row["date"])
+        imported = [
+            int(number)
+            for row in rows
+            if (number := row["number"]).isascii() and number.isdigit()
+        ]
+        if imported:
+            await advance_sequence(conn, self.owner, max(imported))
+
+    async def insert(self, conn, rows: list[tuple[int, tuple]]) -> int:
+        values: dict[str, set] = {"id": set(), "email": set()}
+        for _, (row, items) in rows:
+            name, value = row["customer"]
+            values[name].add(value)
+        ids = {
+            name: await self.find_customers(conn, name, found)
+            for name, found in values.items()
+            if found
+        }
+        valid = []
+        items = {}
+        for line, (row, row_items) in rows:
+            name, value = row["customer"]
+            if pk := ids[name].get(value):
+                row["customer"] = pk
+                valid.append(row)
+                items[row["uuid"]] = row_items
+            else:
+                self.stats.error(line, f"No customer with {name} '{value}'")
+        await self.assign_numbers(conn, valid)
+        await insert_rows(conn, Invoice.objects.table, valid)
+
+        # Open invoices add to the balance of the customer
+        balances: Effects = {}
+        for row in valid:
+            if row["status"] == "open":
+                add_effect(balances, row["customer"], open_balance=row["total_amount"])
+        await apply_effects(conn, {}, balances)
+
+        # Add the items with the ids of the new invoices
+        c = Invoice.objects.table.c
+        item_rows = []
+        for part in chunks(list(items)):
+            q = sa.select(c.uuid, c.id).where(c.uuid.in_(part))
+            for row in await Invoice.objects.fetchall(q, connection=conn):
+                for item in items[row[0]]:
+                    item["invoice"] = row[1]
+                    item_rows.append(item)
+        await insert_rows(conn, InvoiceItem.objects.table, item_rows)
+        return len(valid)
+
+    def committed(self, rows: list[tuple[int, tuple]]):
+        # Rows of unknown customers still have the ("id", value) lookup
+        inserted = [row for _, (row, items) in rows if type(row["customer"]) is int]
+        ledger.notify(
+            (row["customer"] for row in inserted),
+            (month_of(row["date"]) for row in inserted),
+        )
+
+
+#: Importers by kind
+IMPORTERS = {
+    cls.kind: cls
+    for cls in (AddressImporter, CustomerImporter, ProductImporter, InvoiceImporter)
+}
+
+
+async def import_file(
+    kind: str,
+    path: str,
+    chunk_size: int = CHUNK_SIZE,
+    progress: Optional[Callable[[ImportStats], Any]] = None,
+) -> ImportStats:
+    """Import the records in the file into the open database.
+
+    Parameters
+    ----------
+    kind: str
+        One of addresses, customers, products or invoices
+    path: str
+        The .csv, .json or .jsonl file to import
+    chunk_size: int
+        Number of records inserted per transaction
+    progress: Callable[[ImportStats], Any]
+        Called with the stats after each chunk
+
+    Returns
+    -------
+    stats: ImportStats
+        The number of records imported and skipped
+
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"Cannot import '{kind}', expected one of {list(IMPORTERS)}")
+    importer = IMPORTERS[kind]()
+    return await importer.run(path, chunk_size, progress)
+
+
+async def run(args: argparse.Namespace) -> ImportStats:
+    from .db import close_database, open_database
+
+    def progress(stats: ImportStats):
+        print(f"{stats.rows} records ({stats.rate:.0f} rows/s)", end="\r")
+
+    await open_database(args.db)
+    try:
+        return await import_file(args.kind, args.path, args.chunk_size, progress)
+    finally:
+        await close_database()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks import",
+        description="Import customers, addresses, products or invoices",
+    )
+    parser.add_argument("kind", choices=list(IMPORTERS))
+    parser.add_argument("path", help="The .csv, .json or .jsonl file to import")
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Records inserted per transaction",
+    )
+    args = parser.parse_args(argv)
+    stats = asyncio.run(run(args))
+    print()
+    for line, message in stats.errors:
+        print(f"Record {line}: {message}", file=sys.stderr)
+    print(stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,7 +26,7 @@ sys.path.append(abspath(dirname(dirname(dirname(__file__)))))
 # Create tables
 from atomdb.sql import SQLModelManager  # noqa: E402
 
-from zerobooks.app import ZeroApplication  # noqa: E402
+from zerobooks.db import close_database, open_database  # noqa: E402
 
 # First load all db models
 from zerobooks.models import api  # noqa: F401, E402
@@ -48,9 +48,11 @@ def get_db_url():
     also modifies it to use the pymysql backend.
 
     """
-    from zerobooks.app import DB_FILE
+    from zerobooks.utils import DB_FILE
 
-    return f"sqlite:///{DB_FILE}"
+    # The tests migrate a temporary database
+    db_file = config.attributes.get("db_file", DB_FILE)
+    return f"sqlite:///{db_file}"
 
 
 def run_migrations_offline():
@@ -90,7 +92,7 @@ def run_migrations_online():
     )
     loop = asyncio.get_event_loop()
     db_file = url.split("://")[-1]
-    loop.run_until_complete(ZeroApplication.open_database(db_file))
+    loop.run_until_complete(open_database(db_file))
     assert manager.database is not None
 
     try:
@@ -100,7 +102,7 @@ def run_migrations_online():
             with context.begin_transaction():
                 context.run_migrations()
     finally:
-        loop.run_until_complete(ZeroApplication.close_database())
+        loop.run_until_complete(close_database())
 
 
 if context.is_offline_mode():
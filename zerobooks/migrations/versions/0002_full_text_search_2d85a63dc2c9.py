@@ -0,0 +1,94 @@
+"""0002 full text search
+
+Revision ID: 2d85a63dc2c9
+Revises: 86e52189f0c6
+Create Date: 2026-10-18 10:12:41.205118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2d85a63dc2c9'
+down_revision = '86e52189f0c6'
+branch_labels = None
+depends_on = None
+
+# Table, columns and the expression used to get each column from a row.
+# The rowid of the fts table is the id of the row it indexes.
+INDEXES = {
+    'customer': {
+        'name': (
+            "trim({row}.title || ' ' || {row}.first_name || ' ' || "
+            "{row}.middle_name || ' ' || {row}.last_name || ' ' || "
+            "{row}.suffix)"
+        ),
+        'company': '{row}.company',
+        'email': '{row}.email',
+    },
+    'invoice': {
+        'number': '{row}.number',
+        'project': '{row}.project',
+        'notes': '{row}.notes',
+        'items': (
+            "CASE WHEN json_valid({row}.items) THEN ("
+            "SELECT group_concat(json_extract(value, '$.name'), ' ') "
+            "FROM json_each({row}.items)) ELSE '' END"
+        ),
+    },
+    'product': {
+        'name': '{row}.name',
+        'description': '{row}.description',
+    },
+}
+
+# Columns that trigger a reindex when updated
+SOURCES = {
+    'customer': 'title, first_name, middle_name, last_name, suffix, company, email',
+    'invoice': 'number, project, notes, items',
+    'product': 'name, description',
+}
+
+
+def insert(table, row):
+    columns = INDEXES[table]
+    names = ', '.join(columns)
+    values = ', '.join(expr.format(row=row) for expr in columns.values())
+    return f"INSERT INTO {table}_fts(rowid, {names}) VALUES ({row}.id, {values});"
+
+
+def upgrade():
+    for table, columns in INDEXES.items():
+        names = ', '.join(columns)
+        op.execute(
+            f"CREATE VIRTUAL TABLE {table}_fts USING fts5({names}, "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        op.execute(
+            f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+            f"{insert(table, 'new')} END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM {table}_fts WHERE rowid = old.id; END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {SOURCES[table]} "
+            f"ON {table} BEGIN "
+            f"DELETE FROM {table}_fts WHERE rowid = old.id; "
+            f"{insert(table, 'new')} END"
+        )
+        # Index existing rows
+        values = ', '.join(expr.format(row=table) for expr in columns.values())
+        op.execute(
+            f"INSERT INTO {table}_fts(rowid, {names}) "
+            f"SELECT {table}.id, {values} FROM {table}"
+        )
+        op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('optimize')")
+
+
+def downgrade():
+    for table in INDEXES:
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+        op.execute(f"DROP TABLE IF EXISTS {table}_fts")
@@ -0,0 +1,151 @@
+"""0004 invoice items
+
+Move the line items from the invoice items JSON column to the invoice_item
+table and index the item names in invoice_fts from it.
+
+Revision ID: 5c1e7a9d3b42
+Revises: 8f2838d86f9c
+Create Date: 2026-10-18 13:05:44.912305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a9d3b42'
+down_revision = '8f2838d86f9c'
+branch_labels = None
+depends_on = None
+
+
+# Decimals are flattened as {"__py__": "decimal", "value": "1.50"}
+def json_decimal(name, default):
+    return (
+        f"coalesce(json_extract(item.value, '$.{name}.value'), "
+        f"json_extract(item.value, '$.{name}'), {default})"
+    )
+
+
+# Rebuild the fts row of an invoice from the invoice and its items
+def reindex(invoice_id, items):
+    return (
+        f"DELETE FROM invoice_fts WHERE rowid = {invoice_id}; "
+        f"INSERT INTO invoice_fts(rowid, number, project, notes, items) "
+        f"SELECT id, number, project, notes, {items} "
+        f"FROM invoice WHERE id = {invoice_id};"
+    )
+
+
+ITEM_NAMES = (
+    "coalesce((SELECT group_concat(name, ' ') FROM invoice_item "
+    "WHERE invoice_item.invoice = invoice.id), '')"
+)
+
+JSON_ITEM_NAMES = (
+    "CASE WHEN json_valid(invoice.items) THEN ("
+    "SELECT group_concat(json_extract(value, '$.name'), ' ') "
+    "FROM json_each(invoice.items)) ELSE '' END"
+)
+
+
+def create_invoice_fts_triggers(items, sources):
+    op.execute(
+        "CREATE TRIGGER invoice_fts_insert AFTER INSERT ON invoice BEGIN "
+        f"{reindex('new.id', items)} END"
+    )
+    op.execute(
+        f"CREATE TRIGGER invoice_fts_update AFTER UPDATE OF {sources} "
+        f"ON invoice BEGIN {reindex('new.id', items)} END"
+    )
+
+
+def upgrade():
+    op.create_table(
+        'invoice_item',
+        sa.Column('uuid', sa.String(length=36), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('invoice', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('description', sa.String(), nullable=False),
+        sa.Column('quantity', sa.Numeric(), nullable=False),
+        sa.Column('rate', sa.Numeric(), nullable=False),
+        sa.Column('amount', sa.Numeric(), nullable=False),
+        sa.ForeignKeyConstraint(['invoice'], ['invoice.id'], name=op.f('fk_invoice_item_invoice_invoice'), ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_invoice_item')),
+        sa.UniqueConstraint('uuid', name=op.f('uq_invoice_item_uuid'))
+    )
+    op.create_index('ix_invoice_item_invoice_position', 'invoice_item', ['invoice', 'position'], unique=False)
+
+    # Copy the items of every invoice
+    quantity = json_decimal('quantity', 1)
+    rate = json_decimal('rate', 0)
+    op.execute(
+        "INSERT INTO invoice_item (uuid, created, updated, invoice, position, "
+        "name, description, quantity, rate, amount) "
+        "SELECT lower(hex(randomblob(16))), invoice.created, invoice.updated, "
+        "invoice.id, CAST(item.key AS INTEGER), "
+        "coalesce(json_extract(item.value, '$.name'), ''), "
+        "coalesce(json_extract(item.value, '$.description'), ''), "
+        f"{quantity}, {rate}, "
+        f"coalesce({json_decimal('amount', 'NULL')}, {quantity} * {rate}) "
+        "FROM invoice, json_each(invoice.items) AS item "
+        "WHERE json_valid(invoice.items) ORDER BY invoice.id, item.key"
+    )
+
+    # The triggers reference the items column so must be replaced before
+    # it can be dropped
+    op.execute("DROP TRIGGER IF EXISTS invoice_fts_insert")
+    op.execute("DROP TRIGGER IF EXISTS invoice_fts_update")
+    op.drop_column('invoice', 'items')
+    create_invoice_fts_triggers(ITEM_NAMES, 'number, project, notes')
+    op.execute(
+        "CREATE TRIGGER invoice_item_fts_insert AFTER INSERT ON invoice_item "
+        f"BEGIN {reindex('new.invoice', ITEM_NAMES)} END"
+    )
+    op.execute(
+        "CREATE TRIGGER invoice_item_fts_delete AFTER DELETE ON invoice_item "
+        f"BEGIN {reindex('old.invoice', ITEM_NAMES)} END"
+    )
+    op.execute(
+        "CREATE TRIGGER invoice_item_fts_update AFTER UPDATE OF name, invoice "
+        f"ON invoice_item BEGIN {reindex('old.invoice', ITEM_NAMES)} "
+        f"{reindex('new.invoice', ITEM_NAMES)} END"
+    )
+
+
+def downgrade():
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f"DROP TRIGGER IF EXISTS invoice_item_fts_{trigger}")
+    op.execute("DROP TRIGGER IF EXISTS invoice_fts_insert")
+    op.execute("DROP TRIGGER IF EXISTS invoice_fts_update")
+    op.add_column('invoice', sa.Column('items', sa.JSON(), nullable=False, server_default='[]'))
+
+    # Copy the items back in the flattened JSON form
+    def decimal(name):
+        return (
+            f"json_object('__py__', 'decimal', 'value', "
+            f"CAST(invoice_item.{name} AS TEXT))"
+        )
+
+    op.execute(
+        "UPDATE invoice SET items = coalesce(("
+        "SELECT json_group_array(json(item)) FROM ("
+        "SELECT json_object("
+        "'name', invoice_item.name, "
+        "'description', invoice_item.description, "
+        f"'quantity', json({decimal('quantity')}), "
+        f"'rate', json({decimal('rate')}), "
+        f"'amount', json({decimal('amount')}), "
+        "'__model__', 'zerobooks.models.invoice.InvoiceItem'"
+        ") AS item FROM invoice_item WHERE invoice_item.invoice = invoice.id "
+        "ORDER BY invoice_item.position)), '[]')"
+    )
+    create_invoice_fts_triggers(
+        JSON_ITEM_NAMES, 'number, project, notes, items'
+    )
+    op.drop_index('ix_invoice_item_invoice_position', table_name='invoice_item')
+    op.drop_table('invoice_item')
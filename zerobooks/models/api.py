@@ -1,6 +1,8 @@
 from .address import Address  # noqa: F401
 from .customer import Customer  # noqa: F401
-from .invoice import Invoice, InvoiceItem  # noqa: F401
+from .invoice import Invoice, InvoiceItem, assign_numbers, load_items  # noqa: F401
 from .payment import Payment  # noqa: F401
+from .prefetch import prefetch_related  # noqa: F401
 from .product import Product  # noqa: F401
+from .sequence import InvoiceSequence, configure_sequence  # noqa: F401
 from .system import System  # noqa: F401
@@ -0,0 +1,351 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Keep the open balance and total spend of customers up to date.
+
+The open balance of a customer is the total of their open invoices less what
+has been paid on them and the total spend is what they have paid less any
+refunds. Saving or deleting an invoice, payment or refund applies the change
+it made to these in the same transaction, so they never have to be summed
+from every invoice and payment. `rebuild_balances` recomputes all of them at
+once in case they ever drift.
+
+Every change is also announced by the `ledger` with the customers and the
+months of invoice dates it affected, so anything computed from the ledger
+(eg the reports) only has to recompute those.
+"""
+from datetime import datetime
+from decimal import Decimal as D
+from typing import Iterable, Optional
+
+import sqlalchemy as sa
+from atom.api import Atom, Event, Int, List
+
+from .base import after_commit
+from .customer import Customer
+
+#: Scale of the numeric columns, sums from SQLite are rounded to it
+SCALE = D("0.0000000001")
+
+CENTS = D("0.01")
+
+#: The open balance and total spend a record adds to each customer
+Effects = dict[int, tuple[D, D]]
+
+
+def decimal(value) -> D:
+    return D() if value is None else D(str(value)).quantize(SCALE)
+
+
+def add_effect(
+    effects: Effects,
+    customer: Optional[int],
+    open_balance: D = D(),
+    total_spend: D = D(),
+):
+    if customer:
+        balance, spend = effects.get(customer, (D(), D()))
+        effects[customer] = (balance + open_balance, spend + total_spend)
+
+
+def month_of(date: datetime) -> str:
+    """Key of the month of the date as used by the ledger changes eg 2023-04"""
+    return f"{date:%Y-%m}"
+
+
+class Ledger(Atom):
+    #: Fired with the set of customer ids and the set of months (see
+    #: `month_of`) affected after invoices, payments or refunds were saved or
+    #: deleted. Either is None when every customer or month may have changed.
+    changed = Event(tuple)
+
+    def notify(
+        self,
+        customers: Optional[Iterable[Optional[int]]] = None,
+        months: Optional[Iterable[str]] = None,
+    ):
+        """Announce a change of the ledger, None means everything changed."""
+        if customers is not None:
+            customers = {pk for pk in customers if pk}
+        if months is not None:
+            months = set(months)
+        if customers == set() and months == set():
+            return
+        self.changed((customers, months))
+
+
+#: Announces the changes made to the ledger
+ledger = Ledger()
+
+
+def tables():
+    from .invoice import Invoice
+    from .payment import Payment, Refund
+
+    return (
+        Invoice.objects.table.c,
+        Payment.objects.table.c,
+        Refund.objects.table.c,
+    )
+
+
+def refunded(payment_id) -> sa.sql.ColumnElement:
+    """Total refunded of the payment id or column."""
+    invoice, payment, refund = tables()
+    return (
+        sa.select(sa.func.coalesce(sa.func.sum(refund.amount), 0))
+        .where(refund.payment == payment_id)
+        .scalar_subquery()
+    )
+
+
+def unpaid() -> sa.sql.ColumnElement:
+    """Total of the invoice less the payments made on it net of refunds."""
+    invoice, payment, refund = tables()
+    net = payment.amount - refunded(payment.id)
+    paid = (
+        sa.select(sa.func.coalesce(sa.func.sum(net), 0))
+        .where(payment.invoice == invoice.id)
+        .scalar_subquery()
+    )
+    return invoice.total_amount - paid
+
+
+async def invoice_effects(connection, invoice_id: int) -> Effects:
+    """An open invoice adds the amount not yet paid to the open balance of
+    the customer.
+
+    """
+    from .invoice import Invoice
+
+    effects: Effects = {}
+    if not invoice_id:
+        return effects
+    invoice, payment, refund = tables()
+    q = sa.select(invoice.customer, unpaid()).where(
+        invoice.id == invoice_id, invoice.status == "open"
+    )
+    for row in await Invoice.objects.fetchall(q, connection=connection):
+        add_effect(effects, row[0], open_balance=decimal(row[1]))
+    return effects
+
+
+async def invoice_keys(connection, invoice_id: int) -> tuple[set, set]:
+    """Return the customer and month of the invoice as stored."""
+    from .invoice import Invoice
+
+    if not invoice_id:
+        return set(), set()
+    c = Invoice.objects.table.c
+    q = sa.select(c.customer, c.date).where(c.id == invoice_id)
+    rows = await Invoice.objects.fetchall(q, connection=connection)
+    return {row[0] for row in rows}, {month_of(row[1]) for row in rows}
+
+
+async def payment_effects(connection, payment_id: int) -> Effects:
+    """A payment adds what was not refunded to the total spend of the
+    customer paying and takes it off the open balance of the customer of the
+    invoice if it is still open.
+
+    """
+    from .invoice import Invoice
+    from .payment import Payment
+
+    effects: Effects = {}
+    if not payment_id:
+        return effects
+    invoice, payment, refund = tables()
+    q = (
+        sa.select(
+            payment.customer,
+            payment.amount - refunded(payment.id),
+            invoice.customer,
+            invoice.status,
+        )
+        .select_from(
+            Payment.objects.table.outerjoin(
+                Invoice.objects.table, payment.invoice == invoice.id
+            )
+        )
+        .where(payment.id == payment_id)
+    )
+    for row in await Payment.objects.fetchall(q, connection=connection):
+        net = decimal(row[1])
+        add_effect(effects, row[0], total_spend=net)
+        if row[3] == "open":
+            add_effect(effects, row[2], open_balance=-net)
+    return effects
+
+
+async def refund_effects(connection, payment_ids: set[int]) -> Effects:
+    """A refund changes the effects of the payments it was and is now for."""
+    effects: Effects = {}
+    for payment_id in payment_ids:
+        for customer, change in (await payment_effects(connection, payment_id)).items():
+            add_effect(effects, customer, *change)
+    return effects
+
+
+async def refund_payments(connection, refund) -> set[int]:
+    """Return the ids of the payment of the refund and of the payment it was
+    saved with.
+
+    """
+    from .payment import Refund
+
+    ids = {refund.payment._id} if refund.payment else set()
+    if refund._id:
+        c = Refund.objects.table.c
+        q = sa.select(c.payment).where(c.id == refund._id)
+        rows = await Refund.objects.fetchall(q, connection=connection)
+        ids.update(row[0] for row in rows)
+    return ids
+
+
+async def apply_effects(connection, before: Effects, after: Effects):
+    """Add the difference between the effects a record had before and after
+    it was changed to the balances of the customers.
+
+    """
+    table = Customer.objects.table
+    c = table.c
+    changes: Effects = {}
+    for customer in before.keys() | after.keys():
+        balance, spend = after.get(customer, (D(), D()))
+        old_balance, old_spend = before.get(customer, (D(), D()))
+        balance -= old_balance
+        spend -= old_spend
+        if not (balance or spend):
+            continue
+        await connection.execute(
+            table.update()
+            .where(c.id == customer)
+            .values(
+                open_balance=c.open_balance + balance,
+                total_spend=c.total_spend + spend,
+            )
+        )
+        changes[customer] = (balance, spend)
+    if changes:
+        # Loaded customers only change if the transaction is committed
+        after_commit(connection, lambda: update_loaded(changes))
+
+
+def update_loaded(changes: Effects):
+    """Add the changes to the balances of the customers that are loaded."""
+    cache = Customer.objects.cache
+    for customer, (balance, spend) in changes.items():
+        if obj := cache.get(customer):
+            obj.open_balance += balance
+            obj.total_spend += spend
+
+
+def expected_open_balance(customer_id) -> sa.sql.ColumnElement:
+    """Total not paid of the open invoices of the customer id or column."""
+    invoice, payment, refund = tables()
+    return (
+        sa.select(sa.func.coalesce(sa.func.sum(unpaid()), 0))
+        .where(invoice.customer == customer_id, invoice.status == "open")
+        .scalar_subquery()
+    )
+
+
+def expected_total_spend(customer_id) -> sa.sql.ColumnElement:
+    """Total paid less refunds of the customer id or column."""
+    invoice, payment, refund = tables()
+    net = payment.amount - refunded(payment.id)
+    return (
+        sa.select(sa.func.coalesce(sa.func.sum(net), 0))
+        .where(payment.customer == customer_id)
+        .scalar_subquery()
+    )
+
+
+def balances_query() -> sa.sql.Select:
+    """Query the stored and the expected open balance and total spend of
+    every customer in one pass.
+
+    """
+    c = Customer.objects.table.c
+    return sa.select(
+        c.id,
+        c.open_balance,
+        c.total_spend,
+        expected_open_balance(c.id),
+        expected_total_spend(c.id),
+    )
+
+
+class BalanceCheck(Atom):
+    #: Number of customers checked
+    customers = Int()
+
+    #: Customers whose balances were wrong as the id, stored open balance,
+    #: stored total spend, open balance and total spend
+    drifted = List(tuple)
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.drifted)} of {self.customers} customers had wrong "
+            f"balances"
+        )
+
+
+async def check_balances(connection=None) -> BalanceCheck:
+    """Compare the balances of every customer to the balances computed from
+    the invoices, payments and refunds.
+
+    """
+    check = BalanceCheck()
+    q = balances_query()
+    for row in await Customer.objects.fetchall(q, connection=connection):
+        check.customers += 1
+        stored = (decimal(row[1]), decimal(row[2]))
+        expected = (decimal(row[3]), decimal(row[4]))
+        # Ignore rounding of the floats SQLite stores the numbers as
+        if any(abs(a - b) >= CENTS / 2 for a, b in zip(stored, expected)):
+            check.drifted.append((row[0], *stored, *expected))
+    return check
+
+
+async def rebuild_balances(connection=None) -> BalanceCheck:
+    """Recompute the open balance and total spend of every customer with one
+    update and check the result.
+
+    Returns
+    -------
+    check: BalanceCheck
+        The customers that had wrong balances before the rebuild
+
+    Raises
+    ------
+    RuntimeError
+        If any balance is still wrong after the rebuild
+
+    """
+    table = Customer.objects.table
+    async with Customer.transaction(connection) as conn:
+        check = await check_balances(conn)
+        await conn.execute(
+            table.update().values(
+                open_balance=expected_open_balance(table.c.id),
+                total_spend=expected_total_spend(table.c.id),
+            )
+        )
+        after = await check_balances(conn)
+        if after.drifted:
+            raise RuntimeError(f"Rebuild failed, {after}")
+        after_commit(conn, lambda: reset_loaded(check.drifted))
+    return check
+
+
+def reset_loaded(drifted: list[tuple]):
+    """Set the rebuilt balances of the drifted customers that are loaded."""
+    cache = Customer.objects.cache
+    for row in drifted:
+        if obj := cache.get(row[0]):
+            obj.open_balance, obj.total_spend = row[3], row[4]
@@ -5,12 +5,30 @@ Distributed under the terms of the GPL v3 License.
 
 The full license is in the file LICENSE, distributed with this software.
 """
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Any, AsyncIterator, Callable
 from uuid import uuid4
 
 from atom.api import Str, Typed
 from atomdb.sql import SQLModel
 
+#: Callbacks to run after the transaction of each connection is committed
+_after_commit: dict[int, list[Callable[[], Any]]] = {}
+
+
+def after_commit(connection, callback: Callable[[], Any]):
+    """Call the callback once the transaction started by
+    `BaseModel.transaction` on the connection is committed. It is never called
+    if the transaction is rolled back. Connections not in such a transaction
+    call it right away.
+
+    """
+    if (callbacks := _after_commit.get(id(connection))) is not None:
+        callbacks.append(callback)
+    else:
+        callback()
+
 
 class BaseModel(SQLModel):
     #: UUID
@@ -22,5 +40,26 @@ class BaseModel(SQLModel):
         self.updated = datetime.now()
         await super().save(*args, **kwargs)
 
+    @classmethod
+    @asynccontextmanager
+    async def transaction(cls, connection=None) -> AsyncIterator:
+        """Use the connection of the transaction it is given or start a new
+        transaction. The callbacks added with `after_commit` are called once
+        a new transaction is committed.
+
+        """
+        if connection is not None:
+            yield connection
+        else:
+            async with cls.objects.connection() as connection:
+                callbacks = _after_commit[id(connection)] = []
+                try:
+                    async with connection.begin():
+                        yield connection
+                finally:
+                    del _after_commit[id(connection)]
+            for callback in callbacks:
+                callback()
+
     class Meta:
         abstract = True
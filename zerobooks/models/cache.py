@@ -0,0 +1,126 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from collections import OrderedDict
+from typing import Any, Optional
+from weakref import WeakValueDictionary
+
+from atomdb.sql import SQLModel, SQLModelManager, find_sql_models
+
+
+class ModelCache(WeakValueDictionary):
+    """The identity map of a model's table, keyed by primary key.
+
+    Every query restores rows through this cache so a row loaded by the list
+    views, a foreign key and a lookup is the same instance. Instances are
+    weakly referenced so the ones in use (eg open in a dock item) are always
+    found, and the most recently used `capacity` instances are also kept
+    alive so repeated lookups do not reload them. Once an instance falls out
+    of the LRU it is dropped as soon as nothing else references it.
+
+    """
+
+    def __init__(self, capacity: int = 1000):
+        super().__init__()
+        #: Strong references to the most recently used instances
+        self.recent: OrderedDict = OrderedDict()
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    def touch(self, key: Any, obj: SQLModel):
+        recent = self.recent
+        recent[key] = obj
+        recent.move_to_end(key)
+        while len(recent) > self.capacity:
+            recent.popitem(last=False)
+
+    def get(self, key: Any, default: Optional[SQLModel] = None):
+        obj = super().get(key)
+        if obj is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.touch(key, obj)
+        return obj
+
+    def __setitem__(self, key: Any, obj: SQLModel):
+        super().__setitem__(key, obj)
+        self.touch(key, obj)
+
+    def __delitem__(self, key: Any):
+        super().__delitem__(key)
+        self.recent.pop(key, None)
+
+    def pop(self, key: Any, *args):
+        self.recent.pop(key, None)
+        return super().pop(key, *args)
+
+    def clear(self):
+        self.recent.clear()
+        super().clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def install_model_caches(capacity: int = 1000) -> dict[str, ModelCache]:
+    """Give each model table a new ModelCache. This is done when the database
+    is opened so each session starts with an empty identity map.
+
+    Parameters
+    ----------
+    capacity: int
+        Number of unreferenced instances kept alive per model
+
+    Returns
+    -------
+    caches: dict[str, ModelCache]
+        The caches by table name
+
+    """
+    SQLModelManager.instance().create_tables()
+    caches = {}
+    for Model in find_sql_models():
+        if Model.__table__ is None:
+            continue  # Abstract
+        cache = Model.objects.cache = ModelCache(capacity)
+        caches[Model.__name__] = cache
+    return caches
+
+
+def clear_model_caches():
+    """Drop every instance from the model caches. This is done when the
+    database is closed so no instances of it are found after.
+
+    """
+    for Model in find_sql_models():
+        if Model.__table__ is None:
+            continue
+        cache = Model.objects.cache
+        if isinstance(cache, ModelCache):
+            cache.clear()
+
+
+def cache_stats() -> dict[str, dict[str, Any]]:
+    """Return the size and hit/miss counts of each model cache."""
+    stats = {}
+    for Model in find_sql_models():
+        if Model.__table__ is None:
+            continue
+        cache = Model.objects.cache
+        if isinstance(cache, ModelCache):
+            stats[Model.__name__] = {
+                "size": len(cache),
+                "recent": len(cache.recent),
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "hit_rate": cache.hit_rate,
+            }
+    return stats
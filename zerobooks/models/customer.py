@@ -6,6 +6,7 @@ Distributed under the terms of the GPL v3 License.
 The full license is in the file LICENSE, distributed with this software.
 """
 from decimal import Decimal as D
+from typing import Container
 
 from atom.api import Bool, Int, Property, Str, Typed, observe
 from atomdb.sql import Relation, SQLModel
@@ -15,12 +16,52 @@ from .address import Address
 from .base import BaseModel
 
 
+def split_name(
+    name: str, prefixes: Container[str], suffixes: Container[str]
+) -> dict[str, str]:
+    """Split a full name into the title, first name, last name and suffix.
+
+    A leading word that is one of the prefixes is the title and a trailing
+    word that is one of the suffixes is the suffix. The first remaining word
+    is the first name and the rest is the last name.
+
+    Parameters
+    ----------
+    name: str
+        The full name eg "Dr. Jane Smith PhD"
+    prefixes: Container[str]
+        The name prefixes (titles)
+    suffixes: Container[str]
+        The name suffixes
+
+    Returns
+    -------
+    parts: dict[str, str]
+        The title, first_name, last_name and suffix
+
+    """
+    words = name.split()
+    title = suffix = ""
+    if len(words) > 1 and words[0] in prefixes:
+        title = words.pop(0)
+    if len(words) > 1 and words[-1] in suffixes:
+        # Eg "Jane Smith, CPA"
+        suffix = words.pop()
+        words[-1] = words[-1].rstrip(",")
+    return {
+        "title": title,
+        "first_name": words[0] if words else "",
+        "last_name": " ".join(words[1:]),
+        "suffix": suffix,
+    }
+
+
 class Customer(BaseModel):
     #: Customer ID
     id = Int().tag(primary_key=True)
 
     #: Internal
-    internal = Bool()
+    internal = Bool().tag(index=True)
 
     #: Title or Prefix
     title = Str().tag(length=10)
@@ -48,28 +89,14 @@ class Customer(BaseModel):
         return " ".join([p.strip() for p in parts if p])
 
     def _set_name(self, name: str):
-        # Any matching titles sorted by length
-        app = Application.instance()
-        sys_config = app.sys_config
-        titles = sorted(
-            [x for x in sys_config.name_prefixes.keys() if x and x in name],
-            key=lambda x: -len(x),
-        )
-        if titles:
-            self.title = titles[0]
-            name = self.title.join(name.split(self.title)[1:])
-
-        suffixes = sorted(
-            [x for x in sys_config.name_suffixes.keys() if x and x in name],
-            key=lambda x: -len(x),
+        sys_config = Application.instance().sys_config
+        parts = split_name(
+            name, sys_config.name_prefixes, sys_config.name_suffixes
         )
-        if suffixes:
-            name, self.suffix = name.split(suffixes[0])
-
-        parts = name.split(" ")
-        self.first_name = parts[0]
-        if len(parts) > 1:
-            self.last_name = " ".join(parts[1:])
+        self.title = parts["title"]
+        self.first_name = parts["first_name"]
+        self.last_name = parts["last_name"]
+        self.suffix = parts["suffix"]
         self.name  # Trigger update
 
     #: Shortcut for getting and setting the name
@@ -129,11 +156,24 @@ class Customer(BaseModel):
     #: Parent customer
     # parent = ForwardInstance(lambda: Customer)
 
-    #: Balance
+    #: Total of the open invoices less what was paid on them. This and the
+    #: total spend are kept up to date as invoices, payments and refunds are
+    #: saved (see balance.py) so saving the customer never writes them.
     open_balance = Typed(D, ())
 
-    #: Total spend
+    #: Total paid less refunds
     total_spend = Typed(D, ())
 
+    async def save(self, *args, **kwargs):
+        if self._id and not kwargs.get("force_insert"):
+            kwargs.setdefault("update_fields", self.editable_fields())
+        await super().save(*args, **kwargs)
+
+    @classmethod
+    def editable_fields(cls) -> list[str]:
+        """Columns written when an existing customer is saved."""
+        skip = {cls.__pk__, "open_balance", "total_spend"}
+        return [c.name for c in cls.objects.table.c if c.name not in skip]
+
     class Meta:
         db_table = "customer"
@@ -5,21 +5,31 @@ Distributed under the terms of the GPL v3 License.
 
 The full license is in the file LICENSE, distributed with this software.
 """
-import json
-import importlib
 from datetime import datetime, timedelta
+from decimal import ROUND_HALF_UP
 from decimal import Decimal as D
-from uuid import uuid4
-
-import enaml
-from atom.api import ContainerList, Enum, Instance, Int, Str, Typed, observe
-from atomdb.sql import JSONModel, Relation, SQLModel
-from web.components.api import Html
-
-from zerobooks.utils import log
-
+from typing import Iterable, Sequence
+
+from atom.api import (
+    Bool,
+    Callable,
+    Enum,
+    Int,
+    Str,
+    Typed,
+    Value,
+    atomref,
+    observe,
+)
+from atomdb.sql import Relation
+
+from .balance import apply_effects, invoice_effects, invoice_keys, ledger, month_of
 from .base import BaseModel
 from .customer import Customer
+from .prefetch import chunks
+from .sequence import format_number, reserve_numbers
+
+CENTS = D("0.01")
 
 
 def import_payment():
@@ -28,53 +38,16 @@ def import_payment():
     return Payment
 
 
-class InvoiceItem(JSONModel):
-    #: Product or service
-    name = Str()
-
-    #: Extra information
-    description = Str()
-
-    #: Quantity
-    quantity = Typed(D, (1,))
-
-    #: Rate
-    rate = Typed(D, ())
-
-    #: Line amount
-    amount = Typed(D, ())
-
-    def _default_amount(self) -> D:
-        return self.quantity * self.rate
-
-    @observe("rate", "quantity")
-    def _update_amount(self, change):
-        self.amount = self._default_amount()
-
-
-async def unflatten_items(value, scope):
-    # TODO: aiosqlite does not seem to support json?
-    if isinstance(value, str):
-        items = json.loads(value)
-        return [await InvoiceItem.restore(item) for item in items]
-    return await InvoiceItem.serializer.unflatten(value, scope)
-
-
 class Invoice(BaseModel):
     #: Address ID
     id = Int().tag(primary_key=True)
 
-    #: Invoice number
-    __counter__ = 10000
+    #: Invoice number. Invoices without one get the next number of the
+    #: sequence of the owner when they are first saved.
     number = Str().tag(length=30)
 
-    def _default_number(self) -> str:
-        n = Invoice.__counter__
-        Invoice.__counter__ += 1
-        return str(n)
-
     #: Invoice date
-    date = Typed(datetime, factory=datetime.now)
+    date = Typed(datetime, factory=datetime.now).tag(index=True)
 
     #: Due date
     due_date = Typed(datetime, factory=datetime.now)
@@ -103,7 +76,7 @@ class Invoice(BaseModel):
         self.due_date = self._default_due_date()
 
     #: Invoicer
-    owner = Typed(Customer).tag(ondelete="RESTRICT")
+    owner = Typed(Customer).tag(ondelete="RESTRICT", index=True)
 
     #: Invoicer
     customer = Typed(Customer).tag(ondelete="RESTRICT")
@@ -114,16 +87,28 @@ class Invoice(BaseModel):
     #: Project
     project = Str().tag(length=255)
 
-    #: Items
-    items = ContainerList(InvoiceItem).tag(unflatten=unflatten_items)
+    #: Line items. These are only loaded when needed using `load_items`
+    items = Relation(lambda: InvoiceItem)
 
-    #: Balance
+    #: Whether the items have been loaded. A new invoice has nothing to load.
+    items_loaded = Bool().tag(store=False)
+
+    def _default_items_loaded(self) -> bool:
+        return not self._id
+
+    #: Sum of the item amounts
     subtotal = Typed(D, ())
 
+    #: Sum of the amounts of the taxable items
+    taxable_subtotal = Typed(D, ()).tag(store=False)
+
+    #: Tax rate of the taxable items eg 0.0825 for 8.25%
+    tax_rate = Typed(D, ())
+
     #: Balance
     total_adjustments = Typed(D, ())
 
-    #: Balance
+    #: Tax on the taxable items
     total_tax = Typed(D, ())
 
     #: Balance
@@ -133,11 +118,13 @@ class Invoice(BaseModel):
     status = Enum("pending", "open", "paid", "void").tag(length=10)
 
     #: Payments made
-    payments = Relation(lambda: import_payment)
+    payments = Relation(import_payment)
 
     #: Template
     template_module = Str("zerobooks.templates.simple").tag(length=255)
-    view = Instance(Html).tag(store=False)
+    #: The Html view of the template. It is not typed since atomdb resolves
+    #: the type of every member and the commands must not import the views.
+    view = Value().tag(store=False)
 
     def _default_subtotal(self) -> D:
         subtotal = D()
@@ -145,28 +132,194 @@ class Invoice(BaseModel):
             subtotal += i.amount
         return subtotal
 
+    def _default_taxable_subtotal(self) -> D:
+        subtotal = D()
+        for i in self.items:
+            if i.taxable:
+                subtotal += i.amount
+        return subtotal
+
+    def _default_total_tax(self) -> D:
+        tax = self.taxable_subtotal * self.tax_rate
+        return tax.quantize(CENTS, ROUND_HALF_UP)
+
     def _default_total_amount(self):
         return self.subtotal + self.total_tax + self.total_adjustments
 
-    @observe("items")
-    def _update_totals(self, change):
-        # TODO: Handle removed
-        for item in self.items:
-            item.unobserve("amount", self._update_totals)
-            item.observe("amount", self._update_totals)
+    #: Observer of the amount and taxable of each item
+    item_observer = Callable().tag(store=False)
+
+    def _default_item_observer(self):
+        # Atom adds and removes a plain function as an observer in constant
+        # time but a bound method takes longer the more items it observes
+        ref = atomref(self)
+
+        def update_item(change):
+            if invoice := ref():
+                invoice._update_item(change)
 
-        self.subtotal = self._default_subtotal()
+        return update_item
+
+    # The totals are kept up to date by applying the change of each edit to
+    # the running sums so editing invoices with many items stays fast. The
+    # saved totals are kept as is until the items are loaded.
+
+    @observe("items")
+    def _update_items(self, change):
+        if not self.items_loaded:
+            return
+        op = change.get("operation")
+        if op in ("reverse", "sort"):
+            return  # Same items
+        if op is None or op == "__imul__":
+            # The list was replaced or multiplied
+            return self._reset_totals(change.get("oldvalue") or ())
+
+        def changed(key: str) -> list:
+            # Slice assignments and deletes have a list of items
+            items = change[key]
+            return items if isinstance(change["index"], slice) else [items]
+
+        if op in ("append", "insert"):
+            self._add_items([change["item"]])
+        elif op in ("extend", "__iadd__"):
+            self._add_items(change["items"])
+        elif op in ("pop", "remove"):
+            self._remove_items([change["item"]])
+        elif op == "__delitem__":
+            self._remove_items(changed("item"))
+        elif op == "__setitem__":
+            self._remove_items(changed("olditem"))
+            self._add_items(changed("newitem"))
+
+    def _watch_items(self, items: Iterable["InvoiceItem"]) -> tuple[D, D]:
+        """Observe the items and return the sum of the amounts and the sum of
+        the taxable amounts.
+
+        """
+        subtotal = taxable = D()
+        for item in items:
+            # Read the values first so only updates are observed
+            amount = item.amount
+            subtotal += amount
+            if item.taxable:
+                taxable += amount
+            item.observe(("amount", "taxable"), self.item_observer)
+        return subtotal, taxable
+
+    def _add_items(self, items: Iterable["InvoiceItem"]):
+        self._apply_delta(*self._watch_items(items))
+
+    def _remove_items(self, items: Iterable["InvoiceItem"]):
+        subtotal = taxable = D()
+        for item in items:
+            item.unobserve(("amount", "taxable"), self.item_observer)
+            subtotal -= item.amount
+            if item.taxable:
+                taxable -= item.amount
+        self._apply_delta(subtotal, taxable)
+
+    def _reset_totals(self, removed: Iterable["InvoiceItem"]):
+        for item in removed:
+            item.unobserve(("amount", "taxable"), self.item_observer)
+        self.subtotal, self.taxable_subtotal = self._watch_items(self.items)
+        self.total_tax = self._default_total_tax()
         self.total_amount = self._default_total_amount()
 
-    def _default_view(self) -> Html:
-        with enaml.imports():
-            try:
-                pkg, name = self.template_module.rsplit(".", 1)
-                module = importlib.import_module(name, pkg)
-                InvoiceTemplate = module.InvoiceTemplate
-            except Exception as e:
-                log.exception(e)
-                from zerobooks.templates.simple import InvoiceTemplate
+    def _update_item(self, change):
+        item = change["object"]
+        if change["name"] == "amount":
+            delta = change["value"] - change.get("oldvalue", D())
+            self._apply_delta(delta, delta if item.taxable else D())
+        elif change["value"] != change.get("oldvalue", False):
+            amount = item.amount
+            self._apply_delta(D(), amount if change["value"] else -amount)
+
+    def _apply_delta(self, subtotal: D, taxable: D):
+        if subtotal:
+            self.subtotal += subtotal
+        if taxable:
+            self.taxable_subtotal += taxable
+
+    @observe("taxable_subtotal", "tax_rate")
+    def _update_tax(self, change):
+        if self.items_loaded:
+            self.total_tax = self._default_total_tax()
+
+    @observe("subtotal", "total_tax", "total_adjustments")
+    def _update_total_amount(self, change):
+        if self.items_loaded:
+            self.total_amount = self._default_total_amount()
+
+    async def load_items(self, reload: bool = False):
+        """Load the line items if they have not been loaded yet."""
+        if reload or not self.items_loaded:
+            await load_items([self])
+        return self.items
+
+    async def save(self, *args, **kwargs):
+        if not self.items_loaded and self.items:
+            # Items were added before the saved ones were loaded
+            await self.load_items()
+        created = not self._id
+        numbered = not self.number
+        # Items that were never loaded have not changed
+        save_items = self.items_loaded
+        try:
+            # Save the number, the invoice, the items and the balance of the
+            # customer together
+            async with self.transaction(kwargs.get("connection")) as connection:
+                kwargs["connection"] = connection
+                before = await invoice_effects(connection, self._id)
+                customers, months = await invoice_keys(connection, self._id)
+                if numbered:
+                    await assign_numbers([self], connection)
+                await super().save(*args, **kwargs)
+                if save_items:
+                    await self.save_items(connection=connection)
+                after = await invoice_effects(connection, self._id)
+                await apply_effects(connection, before, after)
+        except BaseException:
+            # The transaction was rolled back so nothing was saved
+            if numbered:
+                self.number = ""
+            if created:
+                self._id = 0
+                for item in self.items:
+                    item._id = 0
+            raise
+        customers.add(self.customer._id if self.customer else None)
+        months.add(month_of(self.date))
+        ledger.notify(customers, months)
+
+    async def delete(self, connection=None):
+        async with self.transaction(connection) as connection:
+            before = await invoice_effects(connection, self._id)
+            customers, months = await invoice_keys(connection, self._id)
+            await InvoiceItem.objects.filter(invoice=self._id).delete(
+                connection=connection
+            )
+            await super().delete(connection=connection)
+            await apply_effects(connection, before, {})
+        ledger.notify(customers, months)
+
+    async def save_items(self, connection=None):
+        """Save the line items in order and delete any that were removed."""
+        ids = []
+        for position, item in enumerate(self.items):
+            item.invoice = self
+            item.position = position
+            await item.save(connection=connection)
+            ids.append(item._id)
+        c = InvoiceItem.objects.table.c
+        await InvoiceItem.objects.filter(
+            c.invoice == self._id, c.id.not_in(ids)
+        ).delete(connection=connection)
+
+    def _default_view(self):
+        from zerobooks.templates.registry import registry
+
+        InvoiceTemplate = registry.get(self.template_module).template
         return InvoiceTemplate(invoice=self)
 
     def generate_filename(self) -> str:
@@ -178,3 +331,90 @@ class Invoice(BaseModel):
 
     class Meta:
         db_table = "invoice"
+        # These also cover lookups by customer and by status alone
+        composite_indexes = (
+            ("ix_invoice_customer_date", "customer", "date"),
+            ("ix_invoice_status_due_date", "status", "due_date"),
+            ("ix_invoice_updated", "updated"),
+        )
+
+
+class InvoiceItem(BaseModel):
+    id = Int().tag(primary_key=True)
+
+    #: Invoice the item is on
+    invoice = Typed(Invoice).tag(nullable=False, ondelete="CASCADE")
+
+    #: Order of the item on the invoice
+    position = Int()
+
+    #: Product or service
+    name = Str().tag(length=255)
+
+    #: Extra information
+    description = Str()
+
+    #: Quantity
+    quantity = Typed(D, (1,))
+
+    #: Rate
+    rate = Typed(D, ())
+
+    #: Line amount
+    amount = Typed(D, ())
+
+    #: Whether the tax rate of the invoice applies to the amount
+    taxable = Bool()
+
+    def _default_amount(self) -> D:
+        return self.quantity * self.rate
+
+    @observe("rate", "quantity")
+    def _update_amount(self, change):
+        self.amount = self._default_amount()
+
+    class Meta:
+        db_table = "invoice_item"
+        # Also covers looking up the items of an invoice
+        composite_indexes = (
+            ("ix_invoice_item_invoice_position", "invoice", "position"),
+        )
+
+
+async def load_items(invoices: Sequence[Invoice]):
+    """Load the line items of the invoices with one query."""
+    ids = [invoice._id for invoice in invoices if invoice._id]
+    groups: dict[int, list[InvoiceItem]] = {pk: [] for pk in ids}
+    c = InvoiceItem.objects.table.c
+    for pks in chunks(ids):
+        rows = await InvoiceItem.objects.filter(c.invoice.in_(pks)).order_by(
+            "invoice", "position"
+        )
+        for item in rows:
+            groups[item.invoice._id].append(item)
+    for invoice in invoices:
+        if (items := groups.get(invoice._id)) is not None:
+            if not invoice.items_loaded:
+                # Keep the items added while the saved ones were loading
+                items.extend(item for item in invoice.items if not item._id)
+            invoice.items_loaded = True
+            invoice.items = items
+        else:
+            invoice.items_loaded = True
+
+
+async def assign_numbers(invoices: Sequence[Invoice], connection):
+    """Number the invoices without a number using the sequence of their
+    owner. The numbers of each owner are reserved with one update so this
+    must be called in the transaction that saves the invoices.
+
+    """
+    groups: dict[int, list[Invoice]] = {}
+    for invoice in invoices:
+        if not invoice.number:
+            owner = invoice.owner._id if invoice.owner else 0
+            groups.setdefault(owner, []).append(invoice)
+    for owner, group in groups.items():
+        numbers, format = await reserve_numbers(connection, owner, len(group))
+        for invoice, n in zip(group, numbers):
+            invoice.number = format_number(format, n, invoice.date)
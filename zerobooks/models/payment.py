@@ -11,6 +11,13 @@ from decimal import Decimal as D
 from atom.api import Int, Str, Typed
 from atomdb.sql import Relation
 
+from .balance import (
+    apply_effects,
+    ledger,
+    payment_effects,
+    refund_effects,
+    refund_payments,
+)
 from .base import BaseModel
 from .customer import Customer
 from .invoice import Invoice
@@ -22,23 +29,62 @@ class Payment(BaseModel):
     ref = Str().tag(length=255)
 
     #: Invoice paid
-    invoice = Typed(Invoice).tag(nullable=False, ondelete="CASCADE")
+    invoice = Typed(Invoice).tag(nullable=False, ondelete="CASCADE", index=True)
 
     #: Customer
-    customer = Typed(Customer).tag(nullable=False, ondelete="CASCADE")
+    customer = Typed(Customer).tag(nullable=False, ondelete="CASCADE", index=True)
 
     #: Refunds made
     refunds = Relation(lambda: Refund)
 
+    async def save(self, *args, **kwargs):
+        # Update the balances of the customers in the same transaction
+        async with self.transaction(kwargs.get("connection")) as connection:
+            kwargs["connection"] = connection
+            before = await payment_effects(connection, self._id)
+            await super().save(*args, **kwargs)
+            after = await payment_effects(connection, self._id)
+            await apply_effects(connection, before, after)
+        ledger.notify(before.keys() | after.keys())
+
+    async def delete(self, connection=None):
+        async with self.transaction(connection) as connection:
+            before = await payment_effects(connection, self._id)
+            await super().delete(connection=connection)
+            await apply_effects(connection, before, {})
+        ledger.notify(before.keys())
+
     class Meta:
         db_table = "payment"
+        composite_indexes = (("ix_payment_updated", "updated"),)
 
 
 class Refund(BaseModel):
     id = Int().tag(primary_key=True)
     amount = Typed(D, ())
     ref = Str().tag(length=255)
-    payment = Typed(Payment).tag(nullable=False, ondelete="CASCADE")
+    payment = Typed(Payment).tag(nullable=False, ondelete="CASCADE", index=True)
+
+    async def save(self, *args, **kwargs):
+        # Update the balances of the customers in the same transaction
+        async with self.transaction(kwargs.get("connection")) as connection:
+            kwargs["connection"] = connection
+            payments = await refund_payments(connection, self)
+            before = await refund_effects(connection, payments)
+            await super().save(*args, **kwargs)
+            after = await refund_effects(connection, payments)
+            await apply_effects(connection, before, after)
+        ledger.notify(before.keys() | after.keys())
+
+    async def delete(self, connection=None):
+        async with self.transaction(connection) as connection:
+            payments = await refund_payments(connection, self)
+            before = await refund_effects(connection, payments)
+            await super().delete(connection=connection)
+            after = await refund_effects(connection, payments)
+            await apply_effects(connection, before, after)
+        ledger.notify(before.keys() | after.keys())
 
     class Meta:
         db_table = "refund"
+        composite_indexes = (("ix_refund_updated", "updated"),)
@@ -0,0 +1,120 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+from typing import Any, Sequence, TypeVar
+
+from atomdb.sql import Relation, SQLModel, resolve_relation
+
+T = TypeVar("T", bound=SQLModel)
+
+#: Maximum number of ids in a single IN (...) clause
+CHUNK_SIZE = 500
+
+
+def chunks(values: list, size: int = CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        end = i + size
+        yield values[i:end]
+
+
+async def prefetch_related(
+    items: Sequence[T], *related: str, connection: Any = None
+) -> Sequence[T]:
+    """Load the related rows of the given items with one query per relation
+    instead of one per item.
+
+    Foreign keys that were not joined are restored in place, so every item
+    that references the same row shares the same instance, and relations
+    are set to the list of rows referring to each item. Nested relations are
+    given as a path such as `"customer.billing_address"` or
+    `"payments.refunds"`.
+
+    Parameters
+    ----------
+    items: Sequence[SQLModel]
+        The items to load the related rows of. All must be the same model.
+    related: str
+        The foreign key or relation fields to load.
+    connection: Database connection
+        The connection to use or a new one will be created
+
+    Returns
+    -------
+    items: Sequence[SQLModel]
+        The items passed in
+
+    """
+    tree: dict = {}
+    for path in related:
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    await _prefetch(items, tree, connection)
+    return items
+
+
+async def _prefetch(items: Sequence[SQLModel], tree: dict, connection: Any):
+    if not items:
+        return
+    Model = type(items[0])
+    members = Model.members()
+    for name, subtree in tree.items():
+        member = members.get(name)
+        if member is None:
+            raise AttributeError(f"{Model.__name__} has no field '{name}'")
+        if isinstance(member, Relation):
+            related = await load_relation(items, name, connection)
+        else:
+            related = await load_foreign_keys(items, name, connection)
+        if subtree:
+            await _prefetch(related, subtree, connection)
+
+
+async def load_foreign_keys(
+    items: Sequence[SQLModel], name: str, connection: Any
+) -> list[SQLModel]:
+    """Restore the unloaded models referenced by the given foreign key field
+    of the items using a single IN query.
+
+    """
+    values = {}
+    for item in items:
+        value = getattr(item, name)
+        if value is not None and value._id is not None:
+            values[value._id] = value
+    if not values:
+        return []
+    RelModel = type(next(iter(values.values())))
+    missing = [pk for pk, value in values.items() if not value.__restored__]
+    pk_column = RelModel.objects.table.c[RelModel.__pk__]
+    for pks in chunks(missing):
+        # Restoring uses the cached instance for each pk so this fills in the
+        # instances the items already reference
+        await RelModel.objects.filter(pk_column.in_(pks), connection=connection)
+    return list(values.values())
+
+
+async def load_relation(
+    items: Sequence[SQLModel], name: str, connection: Any
+) -> list[SQLModel]:
+    """Load the rows referring to each of the items and set the relation
+    field of each item using a single IN query.
+
+    """
+    Model = type(items[0])
+    _, RelModel, ref_member, rel_col = resolve_relation(Model, name)
+    groups: dict[Any, list] = {item._id: [] for item in items if item._id}
+    results = []
+    for pks in chunks(list(groups)):
+        rows = await RelModel.objects.filter(rel_col.in_(pks), connection=connection)
+        for row in rows:
+            groups[ref_member.get_slot(row)._id].append(row)
+        results.extend(rows)
+    for item in items:
+        if (rows := groups.get(item._id)) is not None:
+            setattr(item, name, rows)
+    return results
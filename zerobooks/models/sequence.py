@@ -0,0 +1,190 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Invoice numbers are taken from a sequence stored in the database for each
+company so they stay unique across restarts and between processes using the
+same database.
+
+Numbers are reserved a block at a time, a batch of N invoices reserves N
+numbers with one update. The update is made in the same transaction as the
+inserts of the invoices so if they fail the numbers are released again and
+there are no gaps. SQLite only allows one writer at a time so other processes
+wait for the transaction to finish before they can reserve numbers.
+"""
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy as sa
+from atom.api import Int, Str
+
+from .base import BaseModel
+
+#: Number of the first invoice of a company without any numbered invoices
+FIRST_NUMBER = 10000
+
+#: Format of invoice numbers unless the company sets another
+DEFAULT_FORMAT = "{n}"
+
+
+def format_number(format: str, n: int, date: Optional[datetime] = None) -> str:
+    """Format an invoice number.
+
+    Parameters
+    ----------
+    format: str
+        A format string with the fields `n` for the number in the sequence and
+        `date` for the invoice date eg "INV-{date:%Y}-{n:06d}"
+    n: int
+        The number in the sequence
+    date: datetime
+        The invoice date, defaults to now
+
+    Returns
+    -------
+    number: str
+        The invoice number
+
+    """
+    return format.format(n=n, date=date or datetime.now())
+
+
+def validate_format(format: str):
+    """Raise a ValueError if the format cannot be used for invoice numbers."""
+    try:
+        first = format_number(format, FIRST_NUMBER)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"Invalid invoice number format '{format}': {e}")
+    if first == format_number(format, FIRST_NUMBER + 1):
+        raise ValueError(f"Invoice number format '{format}' must include {{n}}")
+
+
+class InvoiceSequence(BaseModel):
+    id = Int().tag(primary_key=True)
+
+    #: Id of the company issuing the invoices, 0 for invoices without one
+    owner = Int().tag(unique=True)
+
+    #: Next number to use
+    next_number = Int(FIRST_NUMBER)
+
+    #: Format of the invoice numbers, see `format_number`
+    format = Str(DEFAULT_FORMAT).tag(length=100)
+
+    class Meta:
+        db_table = "invoice_sequence"
+
+
+def numbered_invoices(owner: int) -> sa.sql.Select:
+    """Query the invoices of the company with a number that is all digits."""
+    from .invoice import Invoice
+
+    c = Invoice.objects.table.c
+    owned = c.owner == owner if owner else c.owner.is_(None)
+    # GLOB "[0-9]*" would also match numbers that only start with a digit
+    all_digits = sa.and_(c.number != "", sa.not_(c.number.op("GLOB")("*[^0-9]*")))
+    return sa.select(c.number).where(owned, all_digits)
+
+
+async def reserve_numbers(connection, owner: int, count: int) -> tuple[range, str]:
+    """Reserve the next count numbers in the sequence of the company. This
+    must be called in the transaction that saves the invoices using them.
+
+    The sequence of a company is created the first time it is used and
+    starts after the largest all digit invoice number it already has.
+
+    Parameters
+    ----------
+    connection: Connection
+        The connection of the transaction saving the invoices
+    owner: int
+        Id of the company issuing the invoices, 0 if there is none
+    count: int
+        Number of invoice numbers to reserve
+
+    Returns
+    -------
+    result: tuple[range, str]
+        The reserved numbers and the format of the company
+
+    """
+    table = InvoiceSequence.objects.table
+    c = table.c
+    # Take the write lock first so no other process can reserve the same
+    # numbers between the read and the update
+    r = await connection.execute(
+        table.update()
+        .where(c.owner == owner)
+        .values(next_number=c.next_number + count, updated=datetime.now())
+    )
+    if not r.rowcount:
+        # The update took the write lock even though there was no row
+        numbers = numbered_invoices(owner).subquery()
+        q = sa.select(sa.func.max(sa.cast(numbers.c.number, sa.Integer)))
+        rows = await InvoiceSequence.objects.fetchall(q, connection=connection)
+        start = max(rows[0][0] + 1 if rows[0][0] is not None else 0, FIRST_NUMBER)
+        state = InvoiceSequence(owner=owner).__prepare_state_for_db__()
+        state = {k: v for k, v in state.items() if k in c and k != "id"}
+        state["next_number"] = start + count
+        await connection.execute(table.insert().values(**state))
+    q = sa.select(c.next_number, c.format).where(c.owner == owner)
+    rows = await InvoiceSequence.objects.fetchall(q, connection=connection)
+    end, format = rows[0][0], rows[0][1]
+    return range(end - count, end), format
+
+
+async def advance_sequence(connection, owner: int, number: int):
+    """Make sure the sequence of the company continues after the number, eg
+    when invoices with numbers from another system are imported.
+
+    """
+    await reserve_numbers(connection, owner, 0)
+    c = InvoiceSequence.objects.table.c
+    await connection.execute(
+        InvoiceSequence.objects.table.update()
+        .where(c.owner == owner, c.next_number <= number)
+        .values(next_number=number + 1, updated=datetime.now())
+    )
+
+
+async def configure_sequence(
+    owner: int,
+    format: Optional[str] = None,
+    next_number: Optional[int] = None,
+):
+    """Change the number format or the next number of the company.
+
+    Parameters
+    ----------
+    owner: int
+        Id of the company issuing the invoices, 0 for invoices without one
+    format: str
+        The new format, see `format_number`
+    next_number: int
+        The number of the next invoice. It cannot be lowered below numbers
+        already used as that would create duplicates.
+
+    """
+    if format is not None:
+        validate_format(format)
+    c = InvoiceSequence.objects.table.c
+    async with InvoiceSequence.objects.connection() as conn:
+        async with conn.begin():
+            await reserve_numbers(conn, owner, 0)
+            update = InvoiceSequence.objects.table.update().where(c.owner == owner)
+            if format is not None:
+                await conn.execute(update.values(format=format))
+            if next_number is not None:
+                r = await conn.execute(
+                    update.where(c.next_number <= next_number).values(
+                        next_number=next_number
+                    )
+                )
+                if not r.rowcount:
+                    raise ValueError(
+                        "The next invoice number cannot be lowered below "
+                        "numbers that were already used"
+                    )
@@ -0,0 +1,491 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Export invoices as PDF files in bulk.
+
+The html of each invoice is rendered from its template in this process and
+converted to a PDF by weasyprint in a pool of worker processes, which is what
+takes most of the time, so the event loop keeps running while thousands of
+invoices are exported. Run it with
+`python -m zerobooks export-pdf --status open --since 2023-01-01 path/to/dir`.
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any
+from typing import Callable as CallableType
+from typing import Optional, Sequence
+
+import sqlalchemy as sa
+from atom.api import Atom, Callable, Float, Instance, Int, List, Typed, Value
+
+from .documents import DocumentCache, document_cache, invoice_key
+from .utils import log
+
+#: Invoices loaded and rendered at a time
+BATCH_SIZE = 100
+
+#: Related records the templates use
+RELATED = ("owner.billing_address", "customer.billing_address", "payments.refunds")
+
+
+class PdfExportStats(Atom):
+    #: Number of invoices to export
+    total = Int()
+
+    #: Number of invoices exported
+    done = Int()
+
+    #: Invoices that could not be exported as the number and the error
+    failed = List(tuple)
+
+    #: Files written
+    files = List(str)
+
+    #: Number of files copied from the cache
+    cached = Int()
+
+    #: Seconds since the export started
+    elapsed = Float()
+
+    @property
+    def rate(self) -> float:
+        """Invoices exported per second"""
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        text = (
+            f"Exported {self.done} of {self.total} invoices to pdf in "
+            f"{self.elapsed:.1f}s ({self.rate:.1f}/s)"
+        )
+        if self.cached:
+            text += f", {self.cached} unchanged"
+        if self.failed:
+            text += f", {len(self.failed)} failed"
+        return text
+
+
+# Workers only import this module so the models are imported where they are
+# used instead of at the top.
+
+#: Style elements of the rendered html
+STYLE = re.compile(r"<style[^>]*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
+
+#: Parsed stylesheets kept by a worker
+MAX_STYLESHEETS = 32
+
+
+class WorkerState:
+    """What a worker process keeps between jobs. Parsing the stylesheets
+    and resolving the fonts is most of the work of a small document.
+
+    """
+
+    def __init__(self):
+        import weasyprint
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.weasyprint = weasyprint
+        self.fonts = FontConfiguration()
+        self.stylesheets: dict[str, Any] = {}
+        # Load the default fonts before the first job
+        weasyprint.HTML(string="<p>zerobooks</p>").render(font_config=self.fonts)
+
+    def stylesheet(self, css: str):
+        if (sheet := self.stylesheets.pop(css, None)) is None:
+            sheet = self.weasyprint.CSS(string=css, font_config=self.fonts)
+            if len(self.stylesheets) >= MAX_STYLESHEETS:
+                del self.stylesheets[next(iter(self.stylesheets))]
+        self.stylesheets[css] = sheet  # Most recently used last
+        return sheet
+
+    def write_pdf(self, html: str, path: str):
+        # Use the parsed stylesheets of the style elements
+        stylesheets = [self.stylesheet(css) for css in STYLE.findall(html)]
+        document = self.weasyprint.HTML(string=STYLE.sub("", html))
+        tmp = f"{path}.tmp"
+        document.write_pdf(tmp, stylesheets=stylesheets, font_config=self.fonts)
+        os.replace(tmp, path)
+
+
+#: State of the worker when this is a worker process
+worker_state: Optional[WorkerState] = None
+
+
+def start_worker():
+    global worker_state
+    worker_state = WorkerState()
+
+
+def write_pdf(html: str, path: str) -> str:
+    """Convert the html to a PDF at the path in a worker process."""
+    if worker_state is None:
+        start_worker()
+    assert worker_state is not None
+    worker_state.write_pdf(html, path)
+    return path
+
+
+def max_rss() -> int:
+    """Peak memory used by this process in bytes."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def serve(
+    conn: Connection,
+    write: CallableType[[str, str], str] = write_pdf,
+    initializer: Optional[CallableType[[], Any]] = start_worker,
+):
+    """Write the PDFs requested over the pipe until it is closed. Each
+    request is the html and the path and the reply is whether it succeeded,
+    the path or error and the peak memory use of the worker.
+
+    """
+    if initializer is not None:
+        initializer()
+    conn.send((True, "", max_rss()))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        try:
+            reply = (True, write(*request), max_rss())
+        except Exception as e:
+            reply = (False, f"{type(e).__name__}: {e}", max_rss())
+        conn.send(reply)
+    conn.close()
+
+
+class PdfWorker(Atom):
+    """A worker process that stays running so each PDF is written with the
+    stylesheets and fonts already loaded. It is restarted after a number of
+    jobs or when its memory grows too much.
+
+    """
+
+    #: Restart after this many jobs
+    max_jobs = Int(500)
+
+    #: Restart when the peak memory grew this many bytes since it started
+    max_growth = Int(256 * 1024 * 1024)
+
+    #: Worker process
+    process = Instance(BaseProcess)
+
+    #: Our end of the pipe
+    conn = Value()
+
+    #: Jobs done by the current process
+    jobs = Int()
+
+    #: Peak memory of the process when it was ready
+    baseline = Int()
+
+    #: Number of times the worker was started
+    starts = Int()
+
+    #: Only one job at a time is sent over the pipe
+    lock = Typed(asyncio.Lock, ())
+
+    #: Function the worker writes the html as a PDF to the path with
+    write = Callable(write_pdf)
+
+    #: Function the worker runs when it starts
+    initializer = Callable(start_worker)
+
+    def start(self):
+        """Start the worker if it is not running so the first job does not
+        wait for it to load.
+
+        """
+        if self.process is not None and self.process.is_alive():
+            return
+        self.stop()
+        context = get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=serve, args=(child, self.write, self.initializer), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.jobs = self.baseline = 0
+        self.starts += 1
+
+    def stop(self):
+        """Stop the worker, it is started again by the next job."""
+        if conn := self.conn:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+            self.conn = None
+        if process := self.process:
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+            self.process = None
+
+    async def request(self, message: Optional[tuple]) -> tuple:
+        assert self.conn is not None
+        if message is not None:
+            self.conn.send(message)
+        loop = asyncio.get_running_loop()
+        try:
+            # Wait for the reply without blocking the event loop
+            return await loop.run_in_executor(None, self.conn.recv)
+        except (EOFError, OSError):
+            self.stop()
+            raise RuntimeError("The pdf worker stopped unexpectedly")
+        except asyncio.CancelledError:
+            # The reply would be read as the reply to the next job
+            self.stop()
+            raise
+
+    async def write_pdf(self, html: str, path: str) -> str:
+        """Write the html as a PDF to the path in the worker.
+
+        Returns
+        -------
+        path: str
+            The path written
+
+        Raises
+        ------
+        RuntimeError
+            If the PDF could not be written
+
+        """
+        async with self.lock:
+            if self.conn is None:
+                self.start()
+            if not self.baseline:
+                ok, result, self.baseline = await self.request(None)
+            ok, result, rss = await self.request((html, path))
+            self.jobs += 1
+            if self.jobs >= self.max_jobs or rss - self.baseline > self.max_growth:
+                log.debug(f"Restarting the pdf worker after {self.jobs} jobs")
+                self.stop()
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+
+def pdf_filename(invoice) -> str:
+    return invoice.generate_filename().replace(os.sep, "-")
+
+
+async def find_invoices(
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> list[int]:
+    """Return the ids of the invoices with the status dated in the range by
+    date. Only the ids are read so `export_pdfs` can load the invoices a
+    batch at a time.
+
+    """
+    from .models.invoice import Invoice
+
+    c = Invoice.objects.table.c
+    q = sa.select(c.id).order_by(c.date, c.id)
+    if status:
+        q = q.where(c.status == status)
+    if since is not None:
+        q = q.where(c.date >= since)
+    if until is not None:
+        q = q.where(c.date < until)
+    return [row[0] for row in await Invoice.objects.fetchall(q)]
+
+
+async def load_invoices(ids: Sequence[int]) -> list:
+    """Load the invoices with the ids in the same order."""
+    from .models.invoice import Invoice
+
+    c = Invoice.objects.table.c
+    invoices = await Invoice.objects.filter(c.id.in_(ids))
+    lookup = {invoice._id: invoice for invoice in invoices}
+    return [lookup[pk] for pk in ids if pk in lookup]
+
+
+async def export_pdfs(
+    ids: Sequence[int],
+    directory: str,
+    workers: Optional[int] = None,
+    progress: Optional[CallableType[[PdfExportStats], Any]] = None,
+    cache: Optional[DocumentCache] = None,
+    write: CallableType[[str, str], str] = write_pdf,
+) -> PdfExportStats:
+    """Export each invoice to a PDF named by `Invoice.generate_filename` in
+    the directory. The invoices are loaded `BATCH_SIZE` at a time.
+
+    Parameters
+    ----------
+    ids: Sequence[int]
+        Ids of the invoices to export, see `find_invoices`
+    directory: str
+        The directory to write the files to
+    workers: int
+        Number of processes converting the html, defaults to the number of
+        cpus
+    progress: Callable[[PdfExportStats], Any]
+        Called with the stats after each file is written
+    cache: DocumentCache
+        Cache of the PDFs of invoices that did not change since they were
+        last exported, if given
+    write: Callable[[str, str], str]
+        Function run in the worker processes to write the html as a PDF to
+        the path, see `write_pdf`
+
+    Returns
+    -------
+    stats: PdfExportStats
+        The files written and any invoices that failed
+
+    """
+    from .models.invoice import load_items
+    from .models.prefetch import chunks, prefetch_related
+    from .templates.registry import render_invoice
+
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    stats = PdfExportStats(total=len(ids))
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    pending: dict[asyncio.Future, tuple[Any, str]] = {}
+    pool: Optional[ProcessPoolExecutor] = None
+
+    def exported(path: str):
+        stats.files.append(path)
+        stats.done += 1
+        stats.elapsed = time.perf_counter() - start
+        if progress is not None:
+            progress(stats)
+
+    def finished(futures):
+        for future in futures:
+            invoice, key = pending.pop(future)
+            try:
+                path = future.result()
+            except Exception as e:
+                log.warning(f"Failed to export invoice {invoice.number}: {e}")
+                stats.failed.append((invoice.number, str(e)))
+                continue
+            if cache is not None:
+                cache.put_file(key, ".pdf", path)
+            exported(path)
+
+    try:
+        for part in chunks(list(ids), BATCH_SIZE):
+            batch = await load_invoices(part)
+            await load_items(batch)
+            await prefetch_related(batch, *RELATED)
+            for invoice in batch:
+                # Keep the workers busy without rendering far ahead of them
+                if len(pending) >= 2 * workers:
+                    done, _ = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    finished(done)
+                path = os.path.join(directory, pdf_filename(invoice))
+                try:
+                    key = invoice_key(invoice) if cache is not None else ""
+                    if cache is not None and cache.copy_to(key, ".pdf", path):
+                        stats.cached += 1
+                        exported(path)
+                        continue
+                    html = render_invoice(invoice)
+                except Exception as e:
+                    log.exception(e)
+                    stats.failed.append((invoice.number, str(e)))
+                    continue
+                if pool is None:
+                    # Spawn so the workers do not inherit the state of the app
+                    pool = ProcessPoolExecutor(
+                        workers,
+                        mp_context=get_context("spawn"),
+                        initializer=start_worker if write is write_pdf else None,
+                    )
+                future = loop.run_in_executor(pool, write, html, path)
+                pending[future] = (invoice, key)
+                # Let the event loop run between renders
+                await asyncio.sleep(0)
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished(done)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    stats.elapsed = time.perf_counter() - start
+    log.info(str(stats))
+    return stats
+
+
+async def run(args: argparse.Namespace) -> PdfExportStats:
+    from .db import close_database, open_database
+
+    def progress(stats: PdfExportStats):
+        print(f"{stats.done}/{stats.total} ({stats.rate:.1f}/s)", end="\r")
+
+    await open_database(args.db)
+    try:
+        ids = await find_invoices(args.status, args.since, args.until)
+        cache = None if args.no_cache else document_cache
+        return await export_pdfs(ids, args.directory, args.workers, progress, cache)
+    finally:
+        await close_database()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from .models.invoice import Invoice
+
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks export-pdf",
+        description="Export invoices as PDF files",
+    )
+    parser.add_argument("directory", help="Directory to write the files to")
+    parser.add_argument("--status", choices=Invoice.status.items)
+    parser.add_argument(
+        "--since", type=datetime.fromisoformat, help="Invoices dated on or after"
+    )
+    parser.add_argument(
+        "--until", type=datetime.fromisoformat, help="Invoices dated before"
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Processes writing pdfs, defaults to the cpus"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Render every invoice instead of copying unchanged ones from the cache",
+    )
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    args = parser.parse_args(argv)
+    stats = asyncio.run(run(args))
+    print()
+    print(stats)
+    for number, error in stats.failed:
+        print(f"Invoice {number}: {error}")
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
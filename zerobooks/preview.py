@@ -0,0 +1,244 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Update the invoice preview with DOM patches instead of reloading the page.
+
+The `modified` event of an html component tree says which node changed and
+how. A `PreviewChannel` turns these into patches, keeps only the last value
+of each attribute changed within a frame and sends them to a script in the
+page which applies them on the next animation frame. The whole page is only
+loaded again when it is not in sync with the tree, eg after the template was
+replaced or the page did not finish loading.
+"""
+import json
+from typing import Any, Optional
+
+from atom.api import Atom, Bool, Callable, Dict, Instance, Int, List, atomref
+from web.components.api import Html
+
+#: Script applying the patches, added to the page
+PATCH_SCRIPT = """
+window.zerobooks = (function () {
+  var queue = [];
+  var frame = 0;
+  function setText(node, value) {
+    var first = node.firstChild;
+    if (first && first.nodeType === 3) first.nodeValue = value;
+    else node.insertBefore(document.createTextNode(value), first);
+  }
+  function setTail(node, value) {
+    var next = node.nextSibling;
+    if (next && next.nodeType === 3) next.nodeValue = value;
+    else node.parentNode.insertBefore(document.createTextNode(value), next);
+  }
+  function insert(parent, child, index) {
+    parent.insertBefore(child, parent.children[index] || null);
+  }
+  function apply(p) {
+    var node = document.getElementById(p.id);
+    if (!node) return;
+    if (p.op === "text") setText(node, p.value);
+    else if (p.op === "tail") setTail(node, p.value);
+    else if (p.op === "attr") {
+      if (p.value === null) node.removeAttribute(p.name);
+      else node.setAttribute(p.name, p.value);
+    } else if (p.op === "add") {
+      var template = document.createElement("template");
+      template.innerHTML = p.value;
+      insert(node, template.content.firstElementChild, p.index);
+    } else if (p.op === "move" || p.op === "remove") {
+      var child = document.getElementById(p.value);
+      if (!child) return;
+      child.remove();
+      if (p.op === "move") insert(node, child, p.index);
+    }
+  }
+  function flush() {
+    frame = 0;
+    var patches = queue;
+    queue = [];
+    patches.forEach(apply);
+  }
+  return {
+    patch: function (patches) {
+      queue.push.apply(queue, patches);
+      if (!frame) frame = window.requestAnimationFrame(flush);
+      return true;
+    }
+  };
+})();
+"""
+
+
+def with_script(html: str) -> str:
+    """Add the patch script to the end of the page."""
+    script = f"<script>{PATCH_SCRIPT}</script>"
+    end = html.rfind("</body>")
+    if end < 0:
+        return html + script
+    return html[:end] + script + html[end:]
+
+
+def attribute(name: str, value: Any) -> tuple[str, Optional[str]]:
+    """Return the attribute name and value as the lxml components set it.
+    A value of None removes the attribute.
+
+    """
+    if name == "cls":
+        if isinstance(value, (tuple, list)):
+            value = " ".join(value)
+        return "class", value
+    if name == "style" and isinstance(value, dict):
+        return name, ";".join(f"{k}:{v}" for k, v in value.items())
+    if name in ("clickable", "draggable"):
+        return name, "true" if value else "false"
+    if value is True:
+        return name, name
+    if value is False or value is None:
+        return name, None
+    return name, f"{value}"
+
+
+class PreviewChannel(Atom):
+    #: Root of the tree shown in the page
+    view = Instance(Html)
+
+    #: Load the whole page, called with the html
+    load = Callable()
+
+    #: Run a script in the page, called with the script and a callback taking
+    #: the result
+    run_script = Callable()
+
+    #: Call a function after a number of ms, defaults to the app timed_call
+    schedule = Callable()
+
+    #: Time to collect changes before they are sent, about one frame
+    delay = Int(16)
+
+    #: Reload the page instead when a frame has more patches than this
+    max_patches = Int(500)
+
+    #: Whether the page shows the current tree so it can be patched
+    synced = Bool()
+
+    #: Whether a flush is scheduled
+    scheduled = Bool()
+
+    #: Patches waiting to be sent
+    patches = List()
+
+    #: Index of the patch of each node attribute so only the last value of
+    #: an attribute changed more than once is sent
+    updates = Dict()
+
+    #: Number of patches and full loads sent
+    patches_sent = Int()
+    loads = Int()
+
+    #: Observer of the modified event of the view
+    observer = Callable()
+
+    def _default_observer(self):
+        # A plain function is observed so the view does not keep the
+        # channel alive
+        ref = atomref(self)
+
+        def modified(change):
+            if channel := ref():
+                channel.add(change["value"])
+
+        return modified
+
+    def _default_schedule(self):
+        from enaml.application import timed_call
+
+        return timed_call
+
+    def connect(self, view: Optional[Html]):
+        """Show the view and patch the page as it changes."""
+        if self.view is not None:
+            self.view.unobserve("modified", self.observer)
+        self.view = view
+        self.synced = False
+        if view is not None:
+            view.observe("modified", self.observer)
+        self.request_flush()
+
+    def disconnect(self):
+        self.connect(None)
+
+    def add(self, change: dict[str, Any]):
+        """Add a patch for a change of the tree."""
+        if not self.synced:
+            return self.request_flush()  # The whole page is loaded anyway
+        node, kind, name = change["id"], change["type"], change["name"]
+        value = change["value"]
+        if kind in ("added", "moved"):
+            op = "add" if kind == "added" else "move"
+            index = int(change["index"])
+            self.patches.append({"op": op, "id": node, "value": value, "index": index})
+        elif kind == "removed":
+            self.patches.append({"op": "remove", "id": node, "value": value})
+        elif name in ("text", "tail"):
+            self.update({"op": name, "id": node, "value": value or ""})
+        elif name == "attrs":
+            old = change.get("oldvalue") or {}
+            for key in old.keys() - (value or {}).keys():
+                self.update({"op": "attr", "id": node, "name": key, "value": None})
+            for key, v in (value or {}).items():
+                self.update({"op": "attr", "id": node, "name": key, "value": f"{v}"})
+        elif name in ("tag", "id"):
+            self.synced = False  # The node cannot be found by the page
+        else:
+            name, value = attribute(name, value)
+            self.update({"op": "attr", "id": node, "name": name, "value": value})
+        self.request_flush()
+
+    def update(self, patch: dict[str, Any]):
+        key = (patch["id"], patch["op"], patch.get("name"))
+        if (i := self.updates.get(key)) is not None:
+            self.patches[i] = patch
+        else:
+            self.updates[key] = len(self.patches)
+            self.patches.append(patch)
+
+    def request_flush(self):
+        if not self.scheduled:
+            self.scheduled = True
+            self.schedule(self.delay, self.flush)
+
+    def flush(self):
+        """Send the patches collected or load the page if it is out of sync."""
+        self.scheduled = False
+        patches = self.patches
+        self.patches = []
+        self.updates = {}
+        if self.view is None:
+            return
+        if not self.synced or len(patches) > self.max_patches:
+            return self.reload()
+        if not patches:
+            return
+        self.patches_sent += len(patches)
+        script = f"window.zerobooks && zerobooks.patch({json.dumps(patches)})"
+        self.run_script(script, self.applied)
+
+    def applied(self, result: Any):
+        """Load the whole page if the patches could not be applied because
+        it was still loading.
+
+        """
+        if result is not True and self.synced:
+            self.synced = False
+            self.request_flush()
+
+    def reload(self):
+        assert self.view is not None
+        self.synced = True
+        self.loads += 1
+        self.load(with_script(self.view.render()))
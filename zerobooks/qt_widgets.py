@@ -0,0 +1,29 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Qt implementations of the widgets in `zerobooks.widgets`. These are
+registered with the Qt factories by `zerobooks.app.main`.
+"""
+from enamlx.qt.qt_table_view import QAtomTableModel, QtTableView
+
+from .widgets import ProxyModelTableView
+
+
+class QModelTableModel(QAtomTableModel):
+    """Table model that takes the number of rows from the declaration."""
+
+    def rowCount(self, parent=None):
+        return self.declaration.row_count
+
+
+class QtModelTableView(QtTableView, ProxyModelTableView):
+    def init_model(self):
+        self.set_model(QModelTableModel(parent=self.widget))
+
+    def set_row_count(self, count: int):
+        # Resets the model the same way as changing the items
+        self.set_items(None)
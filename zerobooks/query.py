@@ -0,0 +1,731 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+A small query language for the list view search fields.
+
+Queries look like `"john" in customer and amount > 500, status = open`,
+where a comma is the same as `and`. Quotes are optional around single words
+and dates like 2023-01-31. The text is parsed into an AST, checked against
+the fields of a SearchSchema and then compiled into a sqlalchemy where clause
+so the filtering is done by the database. Bare words are matched using the
+full text search index. Terms of the top level `and` that use a field with no
+column are matched by a python predicate on the rows the other terms matched.
+Compiled queries are cached by schema and query text.
+"""
+import functools
+import operator
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal as D
+from decimal import InvalidOperation
+from typing import Any
+from typing import Callable as CallableType
+from typing import Optional
+
+import sqlalchemy as sa
+from atom.api import (
+    Atom,
+    Bool,
+    Callable,
+    Dict,
+    Enum,
+    Instance,
+    List,
+    Str,
+    Value,
+)
+
+from zerobooks.models.api import Customer, Invoice, Product
+from zerobooks.search import match_expression, match_ids
+
+
+class SearchError(ValueError):
+    """Raised when a query cannot be parsed or does not match the schema."""
+
+
+# -----------------------------------------------------------------------------
+# AST
+# -----------------------------------------------------------------------------
+class Node(Atom):
+    """Base class for query nodes."""
+
+
+class Name(Node):
+    #: Field name
+    id = Str()
+
+
+class Literal(Node):
+    #: String or Decimal value
+    value = Value()
+
+
+class Compare(Node):
+    op = Enum("==", "!=", "<", "<=", ">", ">=", "in", "not in")
+    left = Instance(Node)
+    right = Instance(Node)
+
+
+class BoolOp(Node):
+    op = Enum("and", "or")
+    values = List(Node)
+
+
+class Not(Node):
+    operand = Instance(Node)
+
+
+class Condition(Node):
+    """A comparison of a schema field to a value of the field's type. This is
+    produced by checking a Compare node against a schema.
+
+    """
+
+    field = Instance(object)
+    op = Enum("==", "!=", "<", "<=", ">", ">=", "contains", "not contains")
+    value = Value()
+
+
+class AnyText(Node):
+    """Free text that matches if any text field contains it."""
+
+    value = Str()
+
+
+# -----------------------------------------------------------------------------
+# Parser
+# -----------------------------------------------------------------------------
+TOKENS = re.compile(
+    r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<date>\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}(?::\d{2})?)?)(?![^\s,()=!<>])
+    |(?P<number>\d+(?:\.\d*)?|\.\d+)
+    |(?P<op>==|!=|<=|>=|=|<|>|\(|\)|,)
+    |(?P<name>[^\s"'(),=!<>]+)
+    )""",
+    re.VERBOSE,
+)
+
+KEYWORDS = {"and", "or", "not", "in"}
+
+
+def tokenize(text: str) -> list[tuple[str, Any]]:
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = TOKENS.match(text, pos)
+        if m is None or m.end() == pos:
+            raise SearchError(f"Unexpected character at {pos}: {text[pos:]}")
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "number":
+            value = D(value)
+        elif kind == "op" and value == "=":
+            value = "=="
+        elif kind == "name" and value.lower() in KEYWORDS:
+            kind = value = value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser for the grammar
+
+    expr    := and ("or" and)*
+    and     := not (("and" | ",") not)*
+    not     := "not" not | compare
+    compare := operand (("==" | "!=" | "<" | "<=" | ">" | ">=" | "in" |
+                         "not" "in") operand)?
+    operand := string | date | number | name | "(" expr ")"
+
+    """
+
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> tuple[Optional[str], Any]:
+        i = self.pos + offset
+        if i < len(self.tokens):
+            return self.tokens[i]
+        return (None, None)
+
+    def next(self) -> tuple[Optional[str], Any]:
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self) -> Node:
+        node = self.parse_or()
+        kind, value = self.peek()
+        if kind is not None:
+            raise SearchError(f"Unexpected '{value}'")
+        return node
+
+    def parse_or(self) -> Node:
+        values = [self.parse_and()]
+        while self.peek()[0] == "or":
+            self.next()
+            values.append(self.parse_and())
+        return values[0] if len(values) == 1 else BoolOp(op="or", values=values)
+
+    def parse_and(self) -> Node:
+        values = [self.parse_not()]
+        while self.peek()[0] == "and" or self.peek() == ("op", ","):
+            self.next()
+            values.append(self.parse_not())
+        return values[0] if len(values) == 1 else BoolOp(op="and", values=values)
+
+    def parse_not(self) -> Node:
+        if self.peek()[0] == "not":
+            self.next()
+            return Not(operand=self.parse_not())
+        return self.parse_compare()
+
+    def parse_compare(self) -> Node:
+        left = self.parse_operand()
+        kind, value = self.peek()
+        if kind == "op" and value not in ("(", ")", ","):
+            op = value
+        elif kind == "in":
+            op = "in"
+        elif kind == "not" and self.peek(1)[0] == "in":
+            self.next()
+            op = "not in"
+        else:
+            return left
+        self.next()
+        return Compare(op=op, left=left, right=self.parse_operand())
+
+    def parse_operand(self) -> Node:
+        kind, value = self.next()
+        if kind in ("string", "date", "number"):
+            return Literal(value=value)
+        if kind == "name":
+            return Name(id=value)
+        if kind == "op" and value == "(":
+            node = self.parse_or()
+            if self.next() != ("op", ")"):
+                raise SearchError("Missing ')'")
+            return node
+        if kind is None:
+            raise SearchError("Unexpected end of query")
+        raise SearchError(f"Unexpected '{value}'")
+
+
+def parse(text: str) -> Node:
+    """Parse the query text into an AST."""
+    return Parser(text).parse()
+
+
+# -----------------------------------------------------------------------------
+# Schema
+# -----------------------------------------------------------------------------
+class SearchField(Atom):
+    #: Name used in queries
+    name = Str()
+
+    #: Type of the field
+    kind = Enum("text", "number", "date", "choice")
+
+    #: Function returning the sqlalchemy column expression. None if the
+    #: field can only be matched in python.
+    column = Callable()
+
+    #: Function returning the value from a model
+    getter = Callable()
+
+    #: For columns of a related table, a function returning the foreign key
+    #: column and the primary key column of the related table. The condition
+    #: is then matched with a subquery on the related table.
+    related = Callable()
+
+    #: Compare text case insensitively
+    ignore_case = Bool()
+
+    #: Allowed values for choice fields
+    choices = List(str)
+
+    #: Whether bare text in a query is matched against this field
+    default = Bool()
+
+    def coerce(self, value: Any) -> Any:
+        """Convert a literal to the field's type."""
+        kind = self.kind
+        if kind == "number":
+            try:
+                return D(value)
+            except (InvalidOperation, ValueError):
+                raise SearchError(f"{self.name} must be compared to a number")
+        if kind == "date":
+            if isinstance(value, D):
+                raise SearchError(f"{self.name} must be a date like 2023-01-31")
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                raise SearchError(f"{self.name} must be a date like 2023-01-31")
+        value = str(value)
+        if kind == "choice" and value.lower() not in self.choices:
+            options = ", ".join(self.choices)
+            raise SearchError(f"{self.name} must be one of {options}")
+        return value.lower() if self.ignore_case or kind == "choice" else value
+
+
+class SearchSchema(Atom):
+    #: Name the compiled queries are cached by
+    name = Str()
+
+    #: Fields by name
+    fields = Dict(str, SearchField)
+
+    #: Full text indexes bare text is matched against, as pairs of the
+    #: index kind and a function returning the column holding its ids
+    fts = List(tuple)
+
+    def field(self, name: str) -> SearchField:
+        field = self.fields.get(name.lower())
+        if field is None:
+            names = ", ".join(self.fields)
+            raise SearchError(f"Unknown field '{name}', use one of {names}")
+        return field
+
+
+#: Registered schemas
+SCHEMAS: dict[str, SearchSchema] = {}
+
+
+def register_schema(
+    name: str, *fields: SearchField, fts: Optional[list] = None
+) -> SearchSchema:
+    schema = SCHEMAS[name] = SearchSchema(
+        name=name, fields={f.name: f for f in fields}, fts=fts or []
+    )
+    return schema
+
+
+def column(Model, name: str) -> CallableType:
+    """Return a function that looks up the column when the query is compiled
+    since the tables are not created until they are first used.
+
+    """
+    return lambda: Model.objects.table.c[name]
+
+
+def invoice_customer():
+    return Invoice.objects.table.c.customer, Customer.objects.table.c.id
+
+
+register_schema(
+    "invoice",
+    SearchField(
+        name="number",
+        column=column(Invoice, "number"),
+        getter=lambda it: it.number,
+        default=True,
+    ),
+    SearchField(
+        name="customer",
+        column=lambda: (
+            Customer.objects.table.c.first_name
+            + " "
+            + Customer.objects.table.c.last_name
+        ),
+        getter=lambda it: it.customer.name if it.customer else "",
+        related=invoice_customer,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="company",
+        column=column(Customer, "company"),
+        getter=lambda it: it.customer.company if it.customer else "",
+        related=invoice_customer,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="display",
+        getter=lambda it: it.customer.display_name if it.customer else "",
+        ignore_case=True,
+    ),
+    SearchField(
+        name="project",
+        column=column(Invoice, "project"),
+        getter=lambda it: it.project,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="amount",
+        kind="number",
+        column=column(Invoice, "total_amount"),
+        getter=lambda it: it.total_amount,
+    ),
+    SearchField(
+        name="date",
+        kind="date",
+        column=column(Invoice, "date"),
+        getter=lambda it: it.date,
+    ),
+    SearchField(
+        name="due",
+        kind="date",
+        column=column(Invoice, "due_date"),
+        getter=lambda it: it.due_date,
+    ),
+    SearchField(
+        name="status",
+        kind="choice",
+        column=column(Invoice, "status"),
+        getter=lambda it: it.status,
+        choices=list(Invoice.status.items),
+    ),
+    fts=[
+        ("invoice", column(Invoice, "id")),
+        ("customer", column(Invoice, "customer")),
+    ],
+)
+
+register_schema(
+    "customer",
+    SearchField(
+        name="name",
+        column=lambda: (
+            Customer.objects.table.c.first_name
+            + " "
+            + Customer.objects.table.c.last_name
+        ),
+        getter=lambda it: it.name,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="company",
+        column=column(Customer, "company"),
+        getter=lambda it: it.company,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="email",
+        column=column(Customer, "email"),
+        getter=lambda it: it.email,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="phone",
+        column=column(Customer, "phone"),
+        getter=lambda it: it.phone,
+        default=True,
+    ),
+    SearchField(
+        name="display",
+        getter=lambda it: it.display_name,
+        ignore_case=True,
+    ),
+    SearchField(
+        name="balance",
+        kind="number",
+        column=column(Customer, "open_balance"),
+        getter=lambda it: it.open_balance,
+    ),
+    SearchField(
+        name="spend",
+        kind="number",
+        column=column(Customer, "total_spend"),
+        getter=lambda it: it.total_spend,
+    ),
+    fts=[("customer", column(Customer, "id"))],
+)
+
+register_schema(
+    "product",
+    SearchField(
+        name="id",
+        kind="number",
+        column=column(Product, "id"),
+        getter=lambda it: it.id,
+    ),
+    SearchField(
+        name="name",
+        column=column(Product, "name"),
+        getter=lambda it: it.name,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="description",
+        column=column(Product, "description"),
+        getter=lambda it: it.description,
+        ignore_case=True,
+        default=True,
+    ),
+    SearchField(
+        name="price",
+        kind="number",
+        column=column(Product, "price"),
+        getter=lambda it: it.price,
+    ),
+    fts=[("product", column(Product, "id"))],
+)
+
+
+# -----------------------------------------------------------------------------
+# Type checking
+# -----------------------------------------------------------------------------
+FLIPPED = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+
+def check(node: Node, schema: SearchSchema) -> Node:
+    """Resolve the names in the AST to fields of the schema and convert the
+    literals to the type of the field they are compared to.
+
+    """
+    if isinstance(node, BoolOp):
+        return BoolOp(op=node.op, values=[check(v, schema) for v in node.values])
+    if isinstance(node, Not):
+        return Not(operand=check(node.operand, schema))
+    if isinstance(node, Name):
+        return AnyText(value=node.id)
+    if isinstance(node, Literal):
+        return AnyText(value=str(node.value))
+    assert isinstance(node, Compare)
+    left, op, right = node.left, node.op, node.right
+    if op in ("in", "not in"):
+        # "john" in customer, the quotes are optional for single words
+        if isinstance(left, Name):
+            left = Literal(value=left.id)
+        if not isinstance(left, Literal) or not isinstance(right, Name):
+            raise SearchError(f"Use '\"text\" {op} field'")
+        field = schema.field(right.id)
+        if field.kind in ("number", "date"):
+            raise SearchError(f"Cannot use '{op}' with {field.name}")
+        value = str(left.value)
+        op = "contains" if op == "in" else "not contains"
+        return Condition(field=field, op=op, value=value.lower())
+    if isinstance(left, Literal) and isinstance(right, Name):
+        left, right, op = right, left, FLIPPED[op]
+    elif isinstance(left, Name) and isinstance(right, Name):
+        # status = open, the quotes are optional for single words
+        right = Literal(value=right.id)
+    if not isinstance(left, Name) or not isinstance(right, Literal):
+        raise SearchError(f"Use 'field {op} value'")
+    field = schema.field(left.id)
+    if field.kind == "choice" and op not in ("==", "!="):
+        raise SearchError(f"Cannot use '{op}' with {field.name}")
+    return Condition(field=field, op=op, value=field.coerce(right.value))
+
+
+def default_fields(schema: SearchSchema) -> list[SearchField]:
+    return [f for f in schema.fields.values() if f.default]
+
+
+# -----------------------------------------------------------------------------
+# SQL compiler
+# -----------------------------------------------------------------------------
+SQL_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def to_clause(node: Node, schema: SearchSchema):
+    """Compile a checked AST into a sqlalchemy where clause. Returns None if
+    any field used has no column.
+
+    """
+    if isinstance(node, BoolOp):
+        clauses = [to_clause(v, schema) for v in node.values]
+        if any(c is None for c in clauses):
+            return None
+        return sa.and_(*clauses) if node.op == "and" else sa.or_(*clauses)
+    if isinstance(node, Not):
+        clause = to_clause(node.operand, schema)
+        return None if clause is None else sa.not_(clause)
+    if isinstance(node, AnyText):
+        if schema.fts and match_expression(node.value):
+            return sa.or_(
+                *(col().in_(match_ids(kind, node.value)) for kind, col in schema.fts)
+            )
+        fields = default_fields(schema)
+        clauses = [
+            to_clause(Condition(field=f, op="contains", value=node.value), schema)
+            for f in fields
+        ]
+        if any(c is None for c in clauses):
+            return None
+        return sa.or_(*clauses)
+
+    assert isinstance(node, Condition)
+    field = node.field
+    if field.column is None:
+        return None
+    clause = condition_clause(field, node.op, node.value)
+    if field.related is not None:
+        fk, pk = field.related()
+        clause = fk.in_(sa.select(pk).where(clause))
+    return clause
+
+
+def condition_clause(field: SearchField, op: str, value: Any):
+    col = field.column()
+    if op in ("contains", "not contains"):
+        clause = sa.func.lower(col).contains(value.lower(), autoescape=True)
+        return clause if op == "contains" else sa.not_(clause)
+    if field.kind == "date" and op in ("==", "!="):
+        # Match the whole day
+        clause = sa.and_(col >= value, col < value + timedelta(days=1))
+        return clause if op == "==" else sa.not_(clause)
+    if field.ignore_case:
+        col = sa.func.lower(col)
+    return SQL_OPS[op](col, value)
+
+
+# -----------------------------------------------------------------------------
+# Python compiler
+# -----------------------------------------------------------------------------
+def to_predicate(node: Node, schema: SearchSchema) -> CallableType[[Any], bool]:
+    """Compile a checked AST into a python function that tests an item."""
+    if isinstance(node, BoolOp):
+        tests = [to_predicate(v, schema) for v in node.values]
+        if node.op == "and":
+            return lambda item: all(test(item) for test in tests)
+        return lambda item: any(test(item) for test in tests)
+    if isinstance(node, Not):
+        test = to_predicate(node.operand, schema)
+        return lambda item: not test(item)
+    if isinstance(node, AnyText):
+        tests = [
+            to_predicate(Condition(field=f, op="contains", value=node.value), schema)
+            for f in default_fields(schema)
+        ]
+        return lambda item: any(test(item) for test in tests)
+
+    assert isinstance(node, Condition)
+    getter, op, value = node.field.getter, node.op, node.value
+    if op in ("contains", "not contains"):
+        value = value.lower()
+        negate = op == "not contains"
+        return lambda item: (value in str(getter(item) or "").lower()) != negate
+    if node.field.kind == "date" and op in ("==", "!="):
+        day = value.date()
+        negate = op == "!="
+        return lambda item: (getter(item).date() == day) != negate
+    compare = SQL_OPS[op]
+    if node.field.ignore_case or node.field.kind == "choice":
+        return lambda item: compare(str(getter(item)).lower(), value)
+    if node.field.kind == "number":
+        return lambda item: compare(D(getter(item)), value)
+    return lambda item: compare(getter(item), value)
+
+
+class Query(Atom):
+    #: Query text
+    text = Str()
+
+    #: Schema the query was checked against
+    schema = Instance(SearchSchema)
+
+    #: Checked AST
+    node = Instance(Node)
+
+    #: Where clause of the terms that have a column or None if no term has
+    clause = Value()
+
+    #: Python predicate of the terms that have no column. Rows matching the
+    #: clause must also match it, None if the clause matches the query.
+    remainder = Callable()
+
+    #: Python predicate of the whole query
+    predicate = Callable()
+
+
+def and_terms(node: Node) -> list[Node]:
+    """Return the terms of the top level `and` of a checked AST."""
+    if isinstance(node, BoolOp) and node.op == "and":
+        return [term for value in node.values for term in and_terms(value)]
+    return [node]
+
+
+def split_query(
+    node: Node, schema: SearchSchema
+) -> tuple[Any, Optional[CallableType]]:
+    """Compile the terms of the top level `and` that have a column into a
+    where clause and the rest into a python predicate. So a field without
+    a column only makes its own term be matched in python, on the rows the
+    where clause matched.
+
+    Returns
+    -------
+    result: tuple[clause, remainder]
+        The where clause or None and the python predicate or None
+
+    """
+    clauses, rest = [], []
+    for term in and_terms(node):
+        clause = to_clause(term, schema)
+        if clause is None:
+            rest.append(term)
+        else:
+            clauses.append(clause)
+    clause = None
+    if clauses:
+        clause = clauses[0] if len(clauses) == 1 else sa.and_(*clauses)
+    remainder = None
+    if rest:
+        term = rest[0] if len(rest) == 1 else BoolOp(op="and", values=rest)
+        remainder = to_predicate(term, schema)
+    return clause, remainder
+
+
+@functools.lru_cache(256)
+def compile_query(schema: str, text: str) -> Query:
+    """Parse and compile the query text for the given schema name. The
+    result is cached so repeated searches only compile once.
+
+    """
+    search_schema = SCHEMAS[schema]
+    node = check(parse(text), search_schema)
+    clause, remainder = split_query(node, search_schema)
+    return Query(
+        text=text,
+        schema=search_schema,
+        node=node,
+        clause=clause,
+        remainder=remainder,
+        predicate=to_predicate(node, search_schema),
+    )
+
+
+@functools.lru_cache(256)
+def compile_scope_query(kinds: tuple[tuple[str, str], ...], text: str) -> Query:
+    """Compile a query for matching dicts with the given keys and field
+    kinds. This only has a python predicate.
+
+    """
+    schema = SearchSchema(name="scope")
+    for key, kind in kinds:
+        schema.fields[key] = SearchField(
+            name=key,
+            kind=kind,
+            getter=operator.itemgetter(key),
+            ignore_case=kind == "text",
+            default=kind == "text",
+        )
+    node = check(parse(text), schema)
+    return Query(
+        text=text, schema=schema, node=node, predicate=to_predicate(node, schema)
+    )
@@ -0,0 +1,541 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Reports computed with SQL aggregates instead of loading the models.
+
+`Reports` keeps the accounts receivable aging, the revenue of each month and
+of each customer between reads and only recomputes the customers and months
+the `ledger` says have changed since. Run `python -m zerobooks reports` to
+print them without the app.
+"""
+import argparse
+import asyncio
+import heapq
+import sys
+from datetime import date, datetime
+from decimal import Decimal as D
+from typing import Awaitable, Callable, Iterable, Optional, Sequence
+
+import sqlalchemy as sa
+from atom.api import Atom, Bool, Dict, Int, List, Str, Tuple, Typed
+
+from .models.balance import ledger, unpaid
+from .models.customer import Customer
+from .models.invoice import Invoice, InvoiceItem
+from .models.prefetch import chunks
+
+#: Invoices counted as revenue
+REVENUE_STATUSES = ("open", "paid")
+
+#: Aging buckets by days past due
+AGING_BUCKETS = ("current", "1-30", "31-60", "61-90", "90+")
+
+#: Most days past due of each aging bucket but the last
+AGING_DAYS = (0, 30, 60, 90)
+
+CENTS = D("0.01")
+
+
+def decimal(value) -> D:
+    return D() if value is None else D(str(value))
+
+
+def cents(value) -> D:
+    """Round a sum of the floats SQLite stores the amounts as."""
+    return decimal(value).quantize(CENTS)
+
+
+class ProductRevenue(Atom):
+    #: Product or service name of the line items
+    name = Str()
+
+    #: Number of line items
+    lines = Int()
+
+    #: Total quantity sold
+    quantity = Typed(D, ())
+
+    #: Total of the line amounts
+    revenue = Typed(D, ())
+
+
+def revenue_by_product_query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    statuses: Sequence[str] = REVENUE_STATUSES,
+) -> sa.sql.Select:
+    item = InvoiceItem.objects.table.c
+    invoice = Invoice.objects.table.c
+    revenue = sa.func.sum(item.amount)
+    q = (
+        sa.select(
+            item.name,
+            sa.func.count(item.id),
+            sa.func.sum(item.quantity),
+            revenue,
+        )
+        .select_from(
+            InvoiceItem.objects.table.join(
+                Invoice.objects.table, item.invoice == invoice.id
+            )
+        )
+        .where(invoice.status.in_(statuses))
+        .group_by(item.name)
+        .order_by(revenue.desc())
+    )
+    if start is not None:
+        q = q.where(invoice.date >= start)
+    if end is not None:
+        q = q.where(invoice.date < end)
+    return q
+
+
+async def revenue_by_product(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    statuses: Sequence[str] = REVENUE_STATUSES,
+) -> list[ProductRevenue]:
+    """Return the revenue of each product or service name on the line items
+    of the invoices dated in the range, highest revenue first.
+
+    Parameters
+    ----------
+    start: datetime
+        Only include invoices dated on or after this
+    end: datetime
+        Only include invoices dated before this
+    statuses: Sequence[str]
+        Only include invoices with these statuses
+
+    Returns
+    -------
+    results: list[ProductRevenue]
+        The revenue by name
+
+    """
+    q = revenue_by_product_query(start, end, statuses)
+    return [
+        ProductRevenue(
+            name=row[0], lines=row[1], quantity=decimal(row[2]), revenue=decimal(row[3])
+        )
+        for row in await InvoiceItem.objects.fetchall(q)
+    ]
+
+
+class CustomerAging(Atom):
+    #: Customer owing the amounts
+    customer = Typed(Customer)
+
+    #: Amount not paid in each of the AGING_BUCKETS
+    buckets = Tuple(D)
+
+    @property
+    def total(self) -> D:
+        return sum(self.buckets, D())
+
+
+class AgingReport(Atom):
+    #: Date the days past due are counted to
+    as_of = Typed(date)
+
+    #: Customers owing anything, most owed first
+    customers = List(CustomerAging)
+
+    #: Amount not paid in each of the AGING_BUCKETS by every customer
+    totals = Tuple(D)
+
+    @property
+    def total(self) -> D:
+        return sum(self.totals, D())
+
+
+class MonthRevenue(Atom):
+    #: Month of the invoice dates eg 2023-04
+    month = Str()
+
+    #: Number of invoices
+    invoices = Int()
+
+    #: Total of the invoices
+    revenue = Typed(D, ())
+
+
+class CustomerRevenue(Atom):
+    #: Customer invoiced
+    customer = Typed(Customer)
+
+    #: Number of invoices
+    invoices = Int()
+
+    #: Total of the invoices
+    revenue = Typed(D, ())
+
+
+def month_range(months: Iterable[str]) -> tuple[datetime, datetime]:
+    """Return the start of the first and the end of the last of the months."""
+    months = sorted(months)
+    start = datetime.strptime(months[0], "%Y-%m")
+    end = datetime.strptime(months[-1], "%Y-%m")
+    if end.month == 12:
+        return start, end.replace(year=end.year + 1, month=1)
+    return start, end.replace(month=end.month + 1)
+
+
+def aging_query(
+    as_of: date, customers: Optional[Sequence[int]] = None
+) -> sa.sql.Select:
+    """Query the amount not paid of open invoices by customer and the index
+    of the aging bucket of their due date.
+
+    """
+    invoice = Invoice.objects.table.c
+    days = sa.func.julianday(as_of.isoformat()) - sa.func.julianday(
+        sa.func.date(invoice.due_date)
+    )
+    bucket = sa.case(
+        *((days <= n, i) for i, n in enumerate(AGING_DAYS)),
+        else_=len(AGING_DAYS),
+    ).label("bucket")
+    q = (
+        sa.select(invoice.customer, bucket, sa.func.sum(unpaid()))
+        .where(invoice.status == "open")
+        .group_by(invoice.customer, bucket)
+    )
+    if customers is not None:
+        q = q.where(invoice.customer.in_(customers))
+    return q
+
+
+def revenue_by_month_query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    statuses: Sequence[str] = REVENUE_STATUSES,
+) -> sa.sql.Select:
+    invoice = Invoice.objects.table.c
+    month = sa.func.strftime("%Y-%m", invoice.date).label("month")
+    q = (
+        sa.select(month, sa.func.count(invoice.id), sa.func.sum(invoice.total_amount))
+        .where(invoice.status.in_(statuses))
+        .group_by(month)
+    )
+    if start is not None:
+        q = q.where(invoice.date >= start)
+    if end is not None:
+        q = q.where(invoice.date < end)
+    return q
+
+
+def revenue_by_customer_query(
+    customers: Optional[Sequence[int]] = None,
+    statuses: Sequence[str] = REVENUE_STATUSES,
+) -> sa.sql.Select:
+    invoice = Invoice.objects.table.c
+    q = (
+        sa.select(
+            invoice.customer,
+            sa.func.count(invoice.id),
+            sa.func.sum(invoice.total_amount),
+        )
+        .where(invoice.status.in_(statuses))
+        .group_by(invoice.customer)
+    )
+    if customers is not None:
+        q = q.where(invoice.customer.in_(customers))
+    return q
+
+
+async def load_customers(ids: Iterable[int]) -> dict[int, Customer]:
+    """Return the customers with the ids, using the loaded ones if any."""
+    cache = Customer.objects.cache
+    found = {}
+    missing = []
+    for pk in ids:
+        if customer := cache.get(pk):
+            found[pk] = customer
+        else:
+            missing.append(pk)
+    for part in chunks(missing):
+        for customer in await Customer.objects.filter(id__in=part):
+            found[customer._id] = customer
+    return found
+
+
+#: Loads the results of the keys or of every key if None
+Loader = Callable[[Optional[set]], Awaitable[dict]]
+
+
+class ReportCache(Atom):
+    """Results by key (eg customer or month) that are only recomputed for the
+    keys that changed since they were loaded.
+
+    """
+
+    #: Results by key
+    values = Dict()
+
+    #: Whether the results of every key were loaded
+    loaded = Bool()
+
+    #: Keys that have changed since they were loaded
+    stale = Typed(set, ())
+
+    #: Incremented when everything is invalidated
+    generation = Int()
+
+    def invalidate(self, keys: Optional[set] = None):
+        """Mark the keys as changed, None means every key."""
+        if keys is None:
+            self.values = {}
+            self.loaded = False
+            self.stale = set()
+            self.generation += 1
+        else:
+            # Also kept while the first load is running
+            self.stale.update(keys)
+
+    async def get(self, load: Loader) -> dict:
+        """Return the results by key after loading any that changed."""
+        if self.loaded and not self.stale:
+            return self.values
+        keys = self.stale if self.loaded else None
+        generation = self.generation
+        self.stale = set()
+        results = await load(keys)
+        if generation != self.generation:
+            # Everything changed while loading, load it again
+            return await self.get(load)
+        if keys is None:
+            self.values = results
+            self.loaded = True
+        else:
+            for key in keys:
+                self.values.pop(key, None)
+            self.values.update(results)
+        return self.values
+
+
+class Reports(Atom):
+    """The aging and revenue reports. The results are kept between reads and
+    only what changed is recomputed so reading them again is cheap.
+
+    """
+
+    #: Aging buckets by customer
+    aging_cache = Typed(ReportCache, ())
+
+    #: Number and total of invoices by month
+    month_cache = Typed(ReportCache, ())
+
+    #: Number and total of invoices by customer
+    customer_cache = Typed(ReportCache, ())
+
+    #: Date the aging was computed for
+    as_of = Typed(date)
+
+    #: Incremented whenever any result may have changed
+    version = Int()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        ledger.observe("changed", self._invalidate)
+
+    def _invalidate(self, change: dict):
+        customers, months = change["value"]
+        self.aging_cache.invalidate(customers)
+        self.customer_cache.invalidate(customers)
+        self.month_cache.invalidate(months)
+        self.version += 1
+
+    def clear(self):
+        """Drop every result so they are all recomputed."""
+        for cache in (self.aging_cache, self.month_cache, self.customer_cache):
+            cache.invalidate()
+        self.version += 1
+
+    async def load_aging(self, customers: Optional[set]) -> dict:
+        results: dict[int, list[D]] = {}
+        for part in chunks(sorted(customers)) if customers is not None else [None]:
+            q = aging_query(self.as_of, part)
+            for row in await Invoice.objects.fetchall(q):
+                buckets = results.setdefault(row[0], [D()] * len(AGING_BUCKETS))
+                buckets[row[1]] += cents(row[2])
+        # Drop customers whose open invoices are fully paid
+        return {pk: tuple(b) for pk, b in results.items() if any(b)}
+
+    async def aging(
+        self, as_of: Optional[date] = None, limit: Optional[int] = None
+    ) -> AgingReport:
+        """Return the amounts not paid of open invoices by how many days past
+        due they are.
+
+        Parameters
+        ----------
+        as_of: date
+            Date to count the days past due to, defaults to today
+        limit: int
+            Only include this many of the customers owing the most
+
+        Returns
+        -------
+        report: AgingReport
+            The amounts of each customer and of all of them
+
+        """
+        as_of = as_of or date.today()
+        if as_of != self.as_of:
+            self.as_of = as_of
+            self.aging_cache.invalidate()
+        values = await self.aging_cache.get(self.load_aging)
+        totals = [D()] * len(AGING_BUCKETS)
+        for buckets in values.values():
+            totals = [a + b for a, b in zip(totals, buckets)]
+
+        # Ties are listed by id
+        def owed(pk: int) -> tuple[D, int]:
+            return sum(values[pk], D()), -pk
+
+        if limit is not None:
+            keys = heapq.nlargest(limit, values, key=owed)
+        else:
+            keys = sorted(values, key=owed, reverse=True)
+        customers = await load_customers(keys)
+        return AgingReport(
+            as_of=as_of,
+            totals=tuple(totals),
+            customers=[
+                CustomerAging(customer=customers[pk], buckets=values[pk])
+                for pk in keys
+                if pk in customers
+            ],
+        )
+
+    async def load_months(self, months: Optional[set]) -> dict:
+        start, end = month_range(months) if months else (None, None)
+        q = revenue_by_month_query(start, end)
+        results = {
+            row[0]: (row[1], cents(row[2]))
+            for row in await Invoice.objects.fetchall(q)
+        }
+        if months is None:
+            return results
+        return {month: results[month] for month in months if month in results}
+
+    async def revenue_by_month(
+        self, start: Optional[str] = None, end: Optional[str] = None
+    ) -> list[MonthRevenue]:
+        """Return the number and total of invoices counted as revenue in each
+        month with any, in order.
+
+        Parameters
+        ----------
+        start: str
+            First month to include eg 2023-01
+        end: str
+            Last month to include
+
+        Returns
+        -------
+        results: list[MonthRevenue]
+            The revenue of each month
+
+        """
+        values = await self.month_cache.get(self.load_months)
+        return [
+            MonthRevenue(month=month, invoices=n, revenue=revenue)
+            for month, (n, revenue) in sorted(values.items())
+            if (start is None or month >= start) and (end is None or month <= end)
+        ]
+
+    async def load_customer_revenue(self, customers: Optional[set]) -> dict:
+        results = {}
+        for part in chunks(sorted(customers)) if customers is not None else [None]:
+            q = revenue_by_customer_query(part)
+            for row in await Invoice.objects.fetchall(q):
+                if row[0] is not None:
+                    results[row[0]] = (row[1], cents(row[2]))
+        return results
+
+    async def top_customers(self, limit: int = 10) -> list[CustomerRevenue]:
+        """Return the customers with the most revenue, most first."""
+        values = await self.customer_cache.get(self.load_customer_revenue)
+        keys = heapq.nlargest(limit, values, key=lambda pk: (values[pk][1], -pk))
+        customers = await load_customers(keys)
+        return [
+            CustomerRevenue(
+                customer=customers[pk], invoices=values[pk][0], revenue=values[pk][1]
+            )
+            for pk in keys
+            if pk in customers
+        ]
+
+
+def money(value: D) -> str:
+    return f"{value:,.2f}"
+
+
+def customer_name(customer: Customer) -> str:
+    return customer.display_name or customer.name
+
+
+async def run(args: argparse.Namespace) -> list[str]:
+    from .db import close_database, open_database
+
+    await open_database(args.db)
+    try:
+        reports = Reports()
+        aging = await reports.aging(args.as_of, args.limit)
+        months = await reports.revenue_by_month(args.start, args.end)
+        top = await reports.top_customers(args.limit)
+    finally:
+        await close_database()
+
+    lines = [f"Aging as of {aging.as_of}"]
+    header = "".join(f"{name:>14}" for name in (*AGING_BUCKETS, "total"))
+    lines.append(f"{'':<30}{header}")
+    for row in aging.customers:
+        amounts = "".join(f"{money(v):>14}" for v in (*row.buckets, row.total))
+        lines.append(f"{customer_name(row.customer)[:29]:<30}{amounts}")
+    amounts = "".join(f"{money(v):>14}" for v in (*aging.totals, aging.total))
+    lines.append(f"{'Total':<30}{amounts}")
+    lines.append("")
+    lines.append("Revenue by month")
+    for m in months:
+        lines.append(f"{m.month:<10}{m.invoices:>8} invoices {money(m.revenue):>14}")
+    lines.append("")
+    lines.append("Top customers")
+    for c in top:
+        lines.append(
+            f"{customer_name(c.customer)[:29]:<30}{c.invoices:>8} invoices "
+            f"{money(c.revenue):>14}"
+        )
+    return lines
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks reports",
+        description="Print the aging, revenue by month and top customers",
+    )
+    parser.add_argument(
+        "--as-of",
+        type=date.fromisoformat,
+        help="Date to age the open invoices to, defaults to today",
+    )
+    parser.add_argument("--start", help="First month of revenue eg 2023-01")
+    parser.add_argument("--end", help="Last month of revenue eg 2023-12")
+    parser.add_argument(
+        "--limit", type=int, default=10, help="Number of customers to list"
+    )
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    args = parser.parse_args(argv)
+    for line in asyncio.run(run(args)):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Full text search using the SQLite FTS5 tables created by the 0002 migration.
+The tables are kept in sync with the customer, invoice and product tables by
+triggers and the rowid of each fts row is the id of the row it indexes.
+"""
+import re
+from typing import Optional
+
+import sqlalchemy as sa
+from atom.api import Atom, Float, Int, Str
+
+from zerobooks.models.api import Customer, Invoice, Product
+
+#: Model and columns of each fts table by kind
+INDEXES = {
+    "customer": (Customer, ("name", "company", "email")),
+    "invoice": (Invoice, ("number", "project", "notes", "items")),
+    "product": (Product, ("name", "description")),
+}
+
+WORD = re.compile(r"\w+")
+
+#: Number of customers an invoice can choose from at once
+CUSTOMER_CHOICES = 50
+
+
+class SearchHit(Atom):
+    #: Kind of model, one of the INDEXES keys
+    kind = Str()
+
+    #: Id of the model
+    id = Int()
+
+    #: FTS5 bm25 rank, lower is a better match
+    rank = Float()
+
+
+def fts_table(kind: str) -> sa.sql.expression.TableClause:
+    columns = INDEXES[kind][1]
+    return sa.table(
+        f"{kind}_fts",
+        sa.column("rowid"),
+        sa.column("rank"),
+        *(sa.column(c) for c in columns),
+    )
+
+
+def match_expression(text: str) -> Optional[str]:
+    """Convert search text into an FTS5 match expression where every word
+    must be the prefix of a word in the row. Returns None if the text has no
+    words.
+
+    """
+    words = WORD.findall(text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def match_clause(kind: str, text: str):
+    """Return the where clause matching the fts rows of the given kind. If
+    the text has no words nothing matches.
+
+    """
+    if (expr := match_expression(text)) is None:
+        return sa.false()
+    return sa.literal_column(f"{kind}_fts").op("MATCH")(expr)
+
+
+def match_query(kind: str, text: str, limit: int) -> sa.sql.Select:
+    """Return a query selecting the ids and ranks of the best rows of the
+    given kind matching the text.
+
+    """
+    fts = fts_table(kind)
+    q = sa.select(fts.c.rowid, fts.c.rank).where(match_clause(kind, text))
+    return q.order_by(fts.c.rank).limit(limit)
+
+
+def match_ids(kind: str, text: str) -> sa.sql.Select:
+    """Return a subquery of the ids matching the text for use with `in_`."""
+    fts = fts_table(kind)
+    return sa.select(fts.c.rowid).where(match_clause(kind, text))
+
+
+async def search_ids(kind: str, text: str, limit: int = 100) -> list[int]:
+    """Return the ids of the best matches of the given kind.
+
+    Parameters
+    ----------
+    kind: str
+        One of customer, invoice or product
+    text: str
+        The text to search for
+    limit: int
+        Maximum number of ids to return
+
+    Returns
+    -------
+    ids: list[int]
+        Model ids ordered by rank
+
+    """
+    Model = INDEXES[kind][0]
+    rows = await Model.objects.fetchall(match_query(kind, text, limit))
+    return [row[0] for row in rows]
+
+
+async def global_search(text: str, limit: int = 20) -> list[SearchHit]:
+    """Search customers, invoices and products.
+
+    Parameters
+    ----------
+    text: str
+        The text to search for
+    limit: int
+        Maximum number of hits to return
+
+    Returns
+    -------
+    hits: list[SearchHit]
+        Hits of all kinds ordered by rank
+
+    """
+    hits = []
+    if match_expression(text) is None:
+        return hits
+    for kind, (Model, _) in INDEXES.items():
+        rows = await Model.objects.fetchall(match_query(kind, text, limit))
+        hits.extend(SearchHit(kind=kind, id=row[0], rank=row[1]) for row in rows)
+    hits.sort(key=lambda hit: hit.rank)
+    return hits[:limit]
+
+
+async def customer_choices(
+    text: str = "", limit: int = CUSTOMER_CHOICES
+) -> list[Customer]:
+    """Return the customers that best match the text to choose from when
+    billing an invoice. Without text the most recently added customers are
+    returned. At most `limit` customers are loaded so this stays fast on any
+    number of customers.
+
+    Parameters
+    ----------
+    text: str
+        The text to search for
+    limit: int
+        Maximum number of customers to return
+
+    Returns
+    -------
+    customers: list[Customer]
+        Customers that are not the company ordered by rank
+
+    """
+    qs = Customer.objects.filter(internal=False)
+    if not text.strip():
+        return await qs.order_by("-id").limit(limit)
+    ids = await search_ids("customer", text, limit)
+    rows = await qs.filter(Customer.objects.table.c.id.in_(ids))
+    lookup = {customer._id: customer for customer in rows}
+    return [lookup[pk] for pk in ids if pk in lookup]
@@ -0,0 +1,585 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+A columnar snapshot of the ledger for analysis with numpy.
+
+The invoices, payments and refunds are loaded straight from the tables into
+numpy arrays, one per column, instead of creating a model for every record.
+Amounts are int64 cents, dates are datetime64 and the status and customer are
+small integer codes so group by, filters and time buckets are vectorized.
+
+The arrays are saved as .npy files in CONFIG_DIR and memory mapped when
+loaded again. Refreshing only reads the rows updated since the last refresh
+and the ids of deleted rows. Run it with `python -m zerobooks snapshot` or
+use it from a python shell eg
+
+    snapshot = await load_snapshot()
+    months, revenue = snapshot.revenue_by("M")
+
+Requires numpy, install it with `pip install zerobooks[analytics]`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+import sqlalchemy as sa
+from atom.api import Atom, Dict, Float, Int, Str, Typed
+
+from .models.invoice import Invoice
+from .models.payment import Payment, Refund
+from .reports import REVENUE_STATUSES
+from .utils import CONFIG_DIR, log
+
+#: Directory the arrays are saved in
+SNAPSHOT_DIR = os.path.join(CONFIG_DIR, "snapshot")
+
+#: Changed when the saved arrays can no longer be used
+VERSION = 1
+
+#: Status of each code of the status column
+STATUSES = tuple(Invoice.status.items)
+
+#: Rows updated this long before the last refresh are read again in case
+#: they were committed after it
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+#: Units of the time buckets, see `bucket`
+UNITS = ("D", "W", "M", "Q", "Y")
+
+
+def seconds(column) -> sa.sql.ColumnElement:
+    """Seconds since the epoch of a datetime column."""
+    return sa.func.coalesce(sa.cast(sa.func.strftime("%s", column), sa.Integer), 0)
+
+
+def cents(column) -> sa.sql.ColumnElement:
+    return sa.cast(sa.func.round(sa.func.coalesce(column, 0) * 100), sa.Integer)
+
+
+def status_code(column) -> sa.sql.ColumnElement:
+    return sa.case(
+        {status: code for code, status in enumerate(STATUSES)},
+        value=column,
+        else_=-1,
+    )
+
+
+#: Columns of a table as the dtype and the expression of each
+Columns = dict[str, tuple[str, sa.sql.ColumnElement]]
+
+
+def invoice_columns() -> Columns:
+    c = Invoice.objects.table.c
+    return {
+        "id": ("int64", c.id),
+        "customer": ("int32", sa.func.coalesce(c.customer, 0)),
+        "status": ("int8", status_code(c.status)),
+        "date": ("datetime64[s]", seconds(c.date)),
+        "due_date": ("datetime64[s]", seconds(c.due_date)),
+        "total": ("int64", cents(c.total_amount)),
+        "tax": ("int64", cents(c.total_tax)),
+        "updated": ("datetime64[s]", seconds(c.updated)),
+    }
+
+
+def payment_columns() -> Columns:
+    c = Payment.objects.table.c
+    return {
+        "id": ("int64", c.id),
+        "invoice": ("int64", sa.func.coalesce(c.invoice, 0)),
+        "customer": ("int32", sa.func.coalesce(c.customer, 0)),
+        "amount": ("int64", cents(c.amount)),
+        "created": ("datetime64[s]", seconds(c.created)),
+        "updated": ("datetime64[s]", seconds(c.updated)),
+    }
+
+
+def refund_columns() -> Columns:
+    c = Refund.objects.table.c
+    return {
+        "id": ("int64", c.id),
+        "payment": ("int64", sa.func.coalesce(c.payment, 0)),
+        "amount": ("int64", cents(c.amount)),
+        "created": ("datetime64[s]", seconds(c.created)),
+        "updated": ("datetime64[s]", seconds(c.updated)),
+    }
+
+
+#: Model and columns of each table
+TABLES: dict[str, tuple[type, Callable[[], Columns]]] = {
+    "invoices": (Invoice, invoice_columns),
+    "payments": (Payment, payment_columns),
+    "refunds": (Refund, refund_columns),
+}
+
+
+class Categories(Atom):
+    """Maps the values of a categorical column to codes. Codes are never
+    reused so new values can be added without changing existing codes.
+
+    """
+
+    #: Value of each code
+    values = Typed(np.ndarray, factory=lambda: np.zeros(0, "int64"))
+
+    #: Code of each value
+    codes = Dict()
+
+    def _observe_values(self, change):
+        self.codes = {v: code for code, v in enumerate(self.values.tolist())}
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        """Return the code of each value adding any that are new."""
+        unique, inverse = np.unique(values, return_inverse=True)
+        new = [v for v in unique.tolist() if v not in self.codes]
+        if new:
+            self.values = np.concatenate([self.values, np.array(new, "int64")])
+        codes = np.array([self.codes[v] for v in unique.tolist()], "int32")
+        return codes[inverse]
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.values[codes]
+
+
+class FactTable(Atom):
+    """Columns of equal length ordered by the id column."""
+
+    #: Array of each column
+    columns = Dict(str, np.ndarray)
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @classmethod
+    def empty(cls, columns: Columns) -> "FactTable":
+        return cls(
+            columns={name: np.zeros(0, dtype) for name, (dtype, _) in columns.items()}
+        )
+
+    def where(self, mask: np.ndarray) -> "FactTable":
+        """Return a table of the rows where the mask (or index array) is set."""
+        return FactTable(columns={k: v[mask] for k, v in self.columns.items()})
+
+    def rows_of(self, ids: np.ndarray) -> np.ndarray:
+        """Return the row of each id or -1 for ids that are not in the table."""
+        pos = np.searchsorted(self["id"], ids)
+        pos[pos >= len(self)] = 0
+        found = len(self) > 0 and self["id"][pos] == ids
+        return np.where(found, pos, -1)
+
+    def upsert(self, rows: "FactTable") -> "FactTable":
+        """Return a table with the rows replaced or added."""
+        pos = self.rows_of(rows["id"])
+        found = pos >= 0
+        columns = {}
+        for name, values in self.columns.items():
+            if found.any():
+                values = np.array(values)  # Copy in case it is memory mapped
+                values[pos[found]] = rows[name][found]
+            columns[name] = np.concatenate([values, rows[name][~found]])
+        table = FactTable(columns=columns)
+        ids = table["id"]
+        if len(ids) > 1 and (ids[1:] < ids[:-1]).any():
+            table = table.where(np.argsort(ids, kind="stable"))
+        return table
+
+
+def bucket(dates: np.ndarray, unit: str = "M") -> np.ndarray:
+    """Return the first day of the bucket of each date.
+
+    Parameters
+    ----------
+    dates: np.ndarray
+        A datetime64 array
+    unit: str
+        One of D (days), W (weeks starting on monday), M (months), Q (quarters)
+        or Y (years)
+
+    Returns
+    -------
+    starts: np.ndarray
+        A datetime64[D] array of the start of the bucket of each date
+
+    """
+    if unit == "D":
+        return dates.astype("datetime64[D]")
+    if unit == "W":
+        days = dates.astype("datetime64[D]")
+        # 1970-01-01 was a thursday
+        return days - (days.astype("int64") + 3) % 7
+    if unit == "M":
+        return dates.astype("datetime64[M]").astype("datetime64[D]")
+    if unit == "Q":
+        months = dates.astype("datetime64[M]").astype("int64")
+        return (months - months % 3).astype("datetime64[M]").astype("datetime64[D]")
+    if unit == "Y":
+        return dates.astype("datetime64[Y]").astype("datetime64[D]")
+    raise ValueError(f"Invalid unit '{unit}', expected one of {UNITS}")
+
+
+def bucket_end(starts: np.ndarray, unit: str = "M") -> np.ndarray:
+    """Return the first day after each bucket."""
+    if unit == "D":
+        return starts + 1
+    if unit == "W":
+        return starts + 7
+    months = {"M": 1, "Q": 3, "Y": 12}[unit]
+    return (starts.astype("datetime64[M]") + months).astype("datetime64[D]")
+
+
+def group_sum(
+    keys: np.ndarray, values: np.ndarray, size: Optional[int] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sum the values of each key.
+
+    Parameters
+    ----------
+    keys: np.ndarray
+        The key of each value. If size is given these are codes from 0 to size
+    values: np.ndarray
+        The int64 values to sum
+    size: int
+        Number of codes
+
+    Returns
+    -------
+    result: tuple[np.ndarray, np.ndarray]
+        The keys (or every code) and the sum of the values of each
+
+    """
+    if size is None:
+        keys, codes = np.unique(keys, return_inverse=True)
+        size = len(keys)
+    else:
+        codes, keys = keys, np.arange(size)
+    sums = np.zeros(size, "int64")
+    np.add.at(sums, codes, values)
+    return keys, sums
+
+
+class RefreshStats(Atom):
+    #: Rows read of each table
+    changed = Dict(str, int)
+
+    #: Rows removed from each table
+    deleted = Dict(str, int)
+
+    #: Seconds taken
+    elapsed = Float()
+
+    def __str__(self) -> str:
+        changed = ", ".join(f"{n} {name}" for name, n in self.changed.items())
+        deleted = sum(self.deleted.values())
+        return f"Read {changed} and removed {deleted} rows in {self.elapsed:.2f}s"
+
+
+class LedgerSnapshot(Atom):
+    #: Invoices with the columns of `invoice_columns`
+    invoices = Typed(FactTable)
+
+    #: Payments with the columns of `payment_columns`
+    payments = Typed(FactTable)
+
+    #: Refunds with the columns of `refund_columns`
+    refunds = Typed(FactTable)
+
+    #: Customer id of each code of the customer columns
+    customers = Typed(Categories, ())
+
+    #: Number of refreshes since it was created
+    refreshes = Int()
+
+    #: Directory it was loaded from
+    path = Str()
+
+    def _default_invoices(self) -> FactTable:
+        return FactTable.empty(invoice_columns())
+
+    def _default_payments(self) -> FactTable:
+        return FactTable.empty(payment_columns())
+
+    def _default_refunds(self) -> FactTable:
+        return FactTable.empty(refund_columns())
+
+    # -------------------------------------------------------------------------
+    # Loading
+    # -------------------------------------------------------------------------
+    async def read(self, name: str, since: Optional[datetime]) -> FactTable:
+        """Read the rows of the table updated since the date or all rows."""
+        Model, columns = TABLES[name]
+        columns = columns()
+        c = Model.objects.table.c
+        q = sa.select(*(expr for _, expr in columns.values())).order_by(c.id)
+        if since is not None:
+            q = q.where(c.updated >= since)
+        rows = await Model.objects.fetchall(q)
+        n = len(columns)
+        values = (row[i] for row in rows for i in range(n))
+        data = np.fromiter(values, "int64", len(rows) * n).reshape(len(rows), n)
+        table = FactTable()
+        for i, (column, (dtype, _)) in enumerate(columns.items()):
+            values = data[:, i]
+            if column == "customer":
+                table.columns[column] = self.customers.encode(values)
+            else:
+                table.columns[column] = values.astype(dtype)
+        return table
+
+    async def refresh_table(self, name: str, stats: RefreshStats):
+        Model = TABLES[name][0]
+        c = Model.objects.table.c
+        table: FactTable = getattr(self, name)
+        since = None
+        if len(table):
+            updated = table["updated"].max().item()
+            since = updated - REFRESH_OVERLAP
+        rows = await self.read(name, since)
+        stats.changed[name] = len(rows)
+        table = table.upsert(rows)
+
+        # Every row still in the table has an id in the snapshot so if the
+        # counts differ some were deleted
+        q = sa.select(sa.func.count(c.id))
+        count = (await Model.objects.fetchall(q))[0][0]
+        stats.deleted[name] = 0
+        if count != len(table):
+            ids = await Model.objects.fetchall(sa.select(c.id))
+            ids = np.fromiter((row[0] for row in ids), "int64", len(ids))
+            keep = np.isin(table["id"], ids, assume_unique=True)
+            stats.deleted[name] = len(table) - int(keep.sum())
+            table = table.where(keep)
+        setattr(self, name, table)
+
+    async def refresh(self) -> RefreshStats:
+        """Read the rows changed since the last refresh.
+
+        Returns
+        -------
+        stats: RefreshStats
+            The number of rows read and removed
+
+        """
+        stats = RefreshStats()
+        start = time.perf_counter()
+        for name in TABLES:
+            await self.refresh_table(name, stats)
+        self.refreshes += 1
+        stats.elapsed = time.perf_counter() - start
+        log.debug(str(stats))
+        return stats
+
+    # -------------------------------------------------------------------------
+    # Saving
+    # -------------------------------------------------------------------------
+    def save(self, path: str = SNAPSHOT_DIR):
+        """Save the arrays to .npy files in the directory."""
+        os.makedirs(path, exist_ok=True)
+        arrays = {"customers": self.customers.values}
+        for name in TABLES:
+            for column, values in getattr(self, name).columns.items():
+                arrays[f"{name}.{column}"] = values
+        for key, values in arrays.items():
+            filename = os.path.join(path, f"{key}.npy")
+            with open(f"{filename}.tmp", "wb") as f:
+                np.save(f, values)
+            os.replace(f"{filename}.tmp", filename)
+        # Written last so files of an interrupted save are not used
+        meta = {
+            "version": VERSION,
+            "statuses": STATUSES,
+            "rows": {key: len(values) for key, values in arrays.items()},
+        }
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str = SNAPSHOT_DIR) -> "LedgerSnapshot":
+        """Memory map the arrays saved in the directory. An empty snapshot is
+        returned if there are none or they cannot be used.
+
+        """
+        snapshot = cls()
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            if meta["version"] != VERSION or tuple(meta["statuses"]) != STATUSES:
+                log.info("Snapshot is out of date")
+                return snapshot
+            arrays = {}
+            for key, rows in meta["rows"].items():
+                filename = os.path.join(path, f"{key}.npy")
+                # Copy on write so changes are never written back to the file
+                values = np.load(filename, mmap_mode="c")
+                if len(values) != rows:
+                    raise ValueError(f"{filename} has {len(values)} rows not {rows}")
+                arrays[key] = values
+        except FileNotFoundError:
+            return snapshot
+        except Exception as e:
+            log.warning(f"Cannot load the snapshot in {path}: {e}")
+            return snapshot
+        snapshot.customers.values = arrays.pop("customers")
+        for name, (Model, columns) in TABLES.items():
+            setattr(
+                snapshot,
+                name,
+                FactTable(
+                    columns={
+                        column: arrays[f"{name}.{column}"] for column in columns()
+                    }
+                ),
+            )
+        snapshot.path = path
+        return snapshot
+
+    # -------------------------------------------------------------------------
+    # Analysis
+    # -------------------------------------------------------------------------
+    def status_mask(self, statuses: Sequence[str] = REVENUE_STATUSES) -> np.ndarray:
+        """Return which invoices have one of the statuses."""
+        codes = [STATUSES.index(status) for status in statuses]
+        return np.isin(self.invoices["status"], codes)
+
+    def revenue_by(
+        self, unit: str = "M", statuses: Sequence[str] = REVENUE_STATUSES
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the start of each time bucket with any invoices and the
+        total in cents of the invoices dated in it.
+
+        """
+        invoices = self.invoices.where(self.status_mask(statuses))
+        return group_sum(bucket(invoices["date"], unit), invoices["total"])
+
+    def revenue_by_customer(
+        self, statuses: Sequence[str] = REVENUE_STATUSES
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the customer id and the total in cents of the invoices of
+        every customer.
+
+        """
+        invoices = self.invoices.where(self.status_mask(statuses))
+        size = len(self.customers.values)
+        codes, totals = group_sum(invoices["customer"], invoices["total"], size)
+        return self.customers.decode(codes), totals
+
+    def received_by(self, unit: str = "M") -> tuple[np.ndarray, np.ndarray]:
+        """Return the start of each time bucket and the payments less the
+        refunds made in it in cents.
+
+        """
+        keys = np.concatenate(
+            [
+                bucket(self.payments["created"], unit),
+                bucket(self.refunds["created"], unit),
+            ]
+        )
+        amounts = np.concatenate([self.payments["amount"], -self.refunds["amount"]])
+        return group_sum(keys, amounts)
+
+    def dso_by(self, unit: str = "M") -> tuple[np.ndarray, np.ndarray]:
+        """Return the days sales outstanding at the end of each time bucket,
+        the receivables at the end divided by the revenue of the bucket times
+        the days in it. Buckets without revenue are nan.
+
+        """
+        months, revenue = self.revenue_by(unit)
+        received_months, received = self.received_by(unit)
+        starts = np.union1d(months, received_months)
+        invoiced = np.zeros(len(starts), "int64")
+        invoiced[np.searchsorted(starts, months)] = revenue
+        paid = np.zeros(len(starts), "int64")
+        paid[np.searchsorted(starts, received_months)] = received
+        receivable = np.cumsum(invoiced) - np.cumsum(paid)
+        days = (bucket_end(starts, unit) - starts).astype("int64")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dso = np.where(invoiced > 0, receivable / invoiced * days, np.nan)
+        return starts, dso
+
+    def cohort_revenue(
+        self, unit: str = "M", statuses: Sequence[str] = REVENUE_STATUSES
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the start of each time bucket and a matrix of the revenue in
+        cents of the customers first invoiced in the bucket of the row in the
+        bucket of the column.
+
+        """
+        invoices = self.invoices.where(self.status_mask(statuses))
+        starts, periods = np.unique(bucket(invoices["date"], unit), return_inverse=True)
+        n = len(starts)
+        first = np.full(len(self.customers.values), n, "int64")
+        np.minimum.at(first, invoices["customer"], periods)
+        cohorts = first[invoices["customer"]]
+        _, totals = group_sum(cohorts * n + periods, invoices["total"], n * n)
+        return starts, totals.reshape(n, n)
+
+
+async def load_snapshot(path: Optional[str] = SNAPSHOT_DIR) -> LedgerSnapshot:
+    """Load the snapshot saved in the directory, refresh it and save it again.
+    If the path is None nothing is loaded or saved.
+
+    """
+    snapshot = LedgerSnapshot() if path is None else LedgerSnapshot.load(path)
+    stats = await snapshot.refresh()
+    changed = any(stats.changed.values()) or any(stats.deleted.values())
+    if path is not None and changed:
+        snapshot.save(path)
+    return snapshot
+
+
+async def run(args: argparse.Namespace) -> LedgerSnapshot:
+    from .db import close_database, open_database
+
+    await open_database(args.db)
+    try:
+        if args.rebuild:
+            return await load_snapshot(None)
+        return await load_snapshot(args.path)
+    finally:
+        await close_database()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m zerobooks snapshot",
+        description="Refresh the ledger snapshot and print revenue and DSO",
+    )
+    parser.add_argument("--unit", choices=UNITS, default="M", help="Time bucket")
+    parser.add_argument("--path", default=SNAPSHOT_DIR, help="Snapshot directory")
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Read every row and save it again"
+    )
+    parser.add_argument("--db", help="Database file, defaults to the app database")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    snapshot = asyncio.run(run(args))
+    if args.rebuild:
+        snapshot.save(args.path)
+    print(
+        f"{len(snapshot.invoices)} invoices, {len(snapshot.payments)} payments and "
+        f"{len(snapshot.refunds)} refunds in {time.perf_counter() - start:.2f}s"
+    )
+    starts, revenue = snapshot.revenue_by(args.unit)
+    dso_starts, dso = snapshot.dso_by(args.unit)
+    dso = dict(zip(dso_starts.tolist(), dso.tolist()))
+    for start, cents in zip(starts.tolist(), revenue.tolist()):
+        print(f"{start} {cents / 100:>14,.2f} {dso[start]:>8.1f} days")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
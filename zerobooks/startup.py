@@ -0,0 +1,137 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Profile how long the app takes to start.
+
+Run the app with `ZEROBOOKS_PROFILE_STARTUP=1` to log the time of each phase
+of `main()` until the window is shown and the modules that took the longest
+to import, eg
+
+    ZEROBOOKS_PROFILE_STARTUP=1 python -m zerobooks
+
+The import times are measured by wrapping `__import__` so the time of a
+module includes the modules it imports, the self time excludes them.
+"""
+import builtins
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+from atom.api import Atom, Bool, Callable, Dict, Float, Int, List
+
+from .utils import log
+
+#: Whether the startup is profiled
+PROFILE_STARTUP = os.environ.get("ZEROBOOKS_PROFILE_STARTUP", "") == "1"
+
+
+class StartupProfile(Atom):
+    #: Whether imports and phases are recorded
+    enabled = Bool()
+
+    #: Time the profile was started and the time of the last phase
+    started = Float()
+    last = Float()
+
+    #: Name and seconds of each phase in the order they finished
+    phases = List()
+
+    #: Total and self seconds of each module imported by name
+    imports = Dict()
+
+    #: Names of the modules being imported and the time spent in the
+    #: modules they imported
+    stack = List()
+
+    #: The import function that was replaced
+    original_import = Callable()
+
+    #: Only imports done by the thread that started the profile are timed
+    thread = Int()
+
+    #: Number of modules listed in the report
+    limit = Int(30)
+
+    def start(self):
+        """Start recording the imports."""
+        if self.enabled:
+            return
+        self.enabled = True
+        self.started = self.last = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        if builtins.__import__ == self.timed_import:
+            builtins.__import__ = self.original_import
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        do_import = self.original_import
+        if threading.get_ident() != self.thread:
+            return do_import(name, globals, locals, fromlist, level)
+        try:
+            if level:
+                package = (globals or {}).get("__package__") or ""
+                name = importlib.util.resolve_name("." * level + name, package)
+                level = 0
+        except (ImportError, ValueError):
+            return do_import(name, globals, locals, fromlist, level)
+        if name in sys.modules:
+            return do_import(name, globals, locals, fromlist, level)
+        frame = [name, 0.0]
+        self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            return do_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1][1] += elapsed
+            if name in sys.modules:
+                total, own = self.imports.get(name, (0.0, 0.0))
+                self.imports[name] = (total + elapsed, own + elapsed - frame[1])
+
+    def phase(self, name: str):
+        """Record the time since the last phase finished."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        lines = ["Startup profile", "Phases"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<40} {seconds * 1000:>10.1f}ms")
+        total = self.last - self.started
+        lines.append(f"  {'total':<40} {total * 1000:>10.1f}ms")
+        lines.append(f"Imports by self time ({len(self.imports)} modules)")
+        lines.append(f"  {'module':<40} {'self':>12} {'total':>12}")
+        imports = sorted(self.imports.items(), key=lambda it: it[1][1], reverse=True)
+        for name, (seconds, own) in imports[: self.limit]:
+            own, seconds = own * 1000, seconds * 1000
+            lines.append(f"  {name:<40} {own:>10.1f}ms {seconds:>10.1f}ms")
+        return "\n".join(lines)
+
+    def finish(self):
+        """Stop recording and log the report."""
+        if not self.enabled:
+            return
+        self.phase("first event")
+        self.stop()
+        log.info(self.report())
+
+
+#: Profile of the startup of the app
+profile = StartupProfile()
@@ -0,0 +1,264 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+from enum import IntEnum
+from typing import Coroutine
+
+from atom.api import (
+    Atom,
+    Bool,
+    Dict,
+    Enum,
+    ForwardTyped,
+    Int,
+    List,
+    Str,
+    Typed,
+    Value,
+)
+
+from .utils import log
+
+
+class Priority(IntEnum):
+    #: Saves and lookups the user is waiting on
+    INTERACTIVE = 0
+
+    #: Anything that was not given a priority
+    NORMAL = 10
+
+    #: Imports, exports and other long running jobs
+    BACKGROUND = 20
+
+
+class TaskHandle(Atom):
+    """A handle to a coroutine submitted to the TaskDispatcher."""
+
+    #: Dispatcher running the task
+    dispatcher = ForwardTyped(lambda: TaskDispatcher)
+
+    #: Coroutine to run. This may be replaced by a newer one with the
+    #: same key while the task is still pending.
+    coro = Value()
+
+    #: Lower numbers are started first
+    priority = Int(Priority.NORMAL)
+
+    #: Order of submission, used to keep tasks of the same priority FIFO
+    seq = Int()
+
+    #: Dedup key. Submitting another coroutine with the same key while this
+    #: one is still pending replaces it.
+    key = Str()
+
+    #: Current state
+    state = Enum("pending", "running", "done", "failed", "cancelled")
+
+    #: Asyncio task while running
+    task = Typed(asyncio.Task)
+
+    #: Result of the coroutine if it completed
+    result = Value()
+
+    #: Error raised by the coroutine if it failed
+    error = Value()
+
+    def __lt__(self, other: "TaskHandle") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def cancel(self):
+        """Cancel the task if it has not finished."""
+        if self.dispatcher is not None:
+            self.dispatcher.cancel(self)
+
+
+class TaskDispatcher(Atom):
+    """Runs coroutines submitted by the UI on the asyncio event loop.
+
+    Submitted coroutines are handed to the loop with `call_soon_threadsafe`
+    and started as soon as there is a free slot. Up to `max_concurrent` tasks
+    run at once and background tasks may only use `max_background` of those
+    slots so slow jobs never block interactive ones. Errors are logged and
+    stored on the task's handle instead of stopping the dispatcher.
+
+    """
+
+    #: Loop the dispatcher is running on
+    loop = Typed(asyncio.AbstractEventLoop)
+
+    #: Heap of tasks waiting for a free slot
+    queue = List()
+
+    #: Pending tasks by dedup key
+    keys = Dict()
+
+    #: Tasks currently running
+    active = List()
+
+    #: Maximum number of tasks running at once
+    max_concurrent = Int(4)
+
+    #: Maximum number of background tasks running at once
+    max_background = Int(2)
+
+    #: Whether the dispatcher is accepting and running coroutines
+    running = Bool()
+
+    #: Set when the dispatcher is stopped
+    stopped = Typed(asyncio.Event)
+
+    #: Protects the queue and keys when submitting from other threads
+    lock = Value(factory=threading.Lock)
+
+    #: Submission counter
+    counter = Value(factory=itertools.count)
+
+    def submit(
+        self,
+        coro: Coroutine,
+        priority: int = Priority.NORMAL,
+        key: str = "",
+    ) -> TaskHandle:
+        """Submit a coroutine to be run on the loop. This is safe to call from
+        any thread.
+
+        Parameters
+        ----------
+        coro: Coroutine
+            The coroutine to run.
+        priority: int
+            The priority of the task, lower numbers are started first.
+        key: str
+            Optional dedup key. If a task with the same key is still pending
+            the coroutine replaces the pending one and its handle is returned.
+
+        Returns
+        -------
+        handle: TaskHandle
+            A handle that can be used to cancel the task or get the result.
+
+        """
+        with self.lock:
+            if key and (handle := self.keys.get(key)):
+                log.debug(f"Task {key} is already pending, replacing it")
+                handle.coro.close()
+                handle.coro = coro
+                return handle
+            handle = TaskHandle(
+                dispatcher=self,
+                coro=coro,
+                priority=priority,
+                key=key,
+                seq=next(self.counter),
+            )
+            if key:
+                self.keys[key] = handle
+            heapq.heappush(self.queue, handle)
+
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.schedule)
+        # Otherwise it is started once the dispatcher is run
+        return handle
+
+    def cancel(self, handle: TaskHandle):
+        """Cancel the given task. Pending tasks are dropped and running tasks
+        are cancelled on the loop. This is safe to call from any thread.
+
+        """
+        with self.lock:
+            if handle.state == "pending":
+                if self.keys.get(handle.key) is handle:
+                    del self.keys[handle.key]
+                handle.coro.close()
+                handle.state = "cancelled"
+                return
+        if handle.state == "running" and (loop := self.loop):
+            loop.call_soon_threadsafe(self._cancel_task, handle)
+
+    def _cancel_task(self, handle: TaskHandle):
+        if task := handle.task:
+            task.cancel()
+
+    def schedule(self):
+        """Start as many queued tasks as the concurrency limits allow."""
+        loop = self.loop
+        if not self.running or loop is None:
+            return
+        queue = self.queue
+        active = self.active
+        with self.lock:
+            while queue and len(active) < self.max_concurrent:
+                handle = queue[0]
+                if handle.state != "pending":
+                    heapq.heappop(queue)
+                    continue  # Cancelled
+                if handle.priority >= Priority.BACKGROUND:
+                    n = sum(1 for h in active if h.priority >= Priority.BACKGROUND)
+                    if n >= self.max_background:
+                        break  # Everything left is background work
+                heapq.heappop(queue)
+                if self.keys.get(handle.key) is handle:
+                    del self.keys[handle.key]
+                handle.state = "running"
+                active.append(handle)
+                handle.task = loop.create_task(self._run_task(handle))
+
+    async def _run_task(self, handle: TaskHandle):
+        try:
+            handle.result = await handle.coro
+            handle.state = "done"
+        except asyncio.CancelledError:
+            handle.state = "cancelled"
+        except Exception as e:
+            log.exception(e)
+            handle.error = e
+            handle.state = "failed"
+        finally:
+            self.active.remove(handle)
+            del handle.task
+            self.schedule()
+
+    def stop(self):
+        """Stop the dispatcher. This is safe to call from any thread."""
+        self.running = False
+        if (loop := self.loop) and (stopped := self.stopped):
+            loop.call_soon_threadsafe(stopped.set)
+
+    async def run(self):
+        """Run submitted coroutines until stopped. Tasks that are still
+        pending or running when stopped are cancelled.
+
+        """
+        self.loop = asyncio.get_running_loop()
+        stopped = self.stopped = asyncio.Event()
+        self.running = True
+        log.debug("TaskDispatcher started")
+        try:
+            self.schedule()
+            await stopped.wait()
+        finally:
+            self.running = False
+            for handle in self.queue:
+                self.cancel(handle)
+            self.queue = []
+            for handle in self.active:
+                self._cancel_task(handle)
+            if self.active:
+                await asyncio.gather(
+                    *(h.task for h in self.active), return_exceptions=True
+                )
+            del self.loop
+            log.debug("TaskDispatcher stopped")
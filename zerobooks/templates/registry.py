@@ -0,0 +1,268 @@
+"""
+Copyright (c) 2023, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Compile invoice templates once and render them to html quickly.
+
+The `registry` compiles each template module the first time it is used and
+again only when its source changes. A template module may define a
+`render_html(invoice)` function that builds the html as a string from an
+`InvoiceSnapshot`, which is what `render_invoice` uses so rendering for a PDF
+or an export does not create the declarative `InvoiceTemplate` and its
+bindings. Templates without one are rendered with the `InvoiceTemplate`.
+"""
+import hashlib
+import importlib
+import importlib.util
+import os
+import sys
+import types
+from datetime import datetime
+from decimal import Decimal as D
+from typing import Any, Optional
+
+import enaml
+from atom.api import Atom, Callable, Dict, Instance, List, Str, Typed, Value
+
+from zerobooks.utils import log
+
+#: Template used when the template of an invoice cannot be loaded
+DEFAULT_TEMPLATE = "zerobooks.templates.simple"
+
+
+class ContactSnapshot(Atom):
+    """The fields of a customer and their billing address that templates
+    use.
+
+    """
+
+    display_name = Str()
+    company = Str()
+    email = Str()
+    phone = Str()
+    street = Str()
+    city = Str()
+    state = Str()
+    zipcode = Str()
+
+
+class ItemSnapshot(Atom):
+    name = Str()
+    description = Str()
+    quantity = Typed(D, ())
+    rate = Typed(D, ())
+    amount = Typed(D, ())
+    taxable = Value(False)
+
+
+class InvoiceSnapshot(Atom):
+    """A copy of an invoice, its customers and items as plain values."""
+
+    number = Str()
+    date = Typed(datetime, factory=datetime.now)
+    due_date = Typed(datetime, factory=datetime.now)
+    terms = Str()
+    status = Str()
+    project = Str()
+    notes = Str()
+    owner = Typed(ContactSnapshot, ())
+    customer = Typed(ContactSnapshot, ())
+    items = List(ItemSnapshot)
+    subtotal = Typed(D, ())
+    total_adjustments = Typed(D, ())
+    tax_rate = Typed(D, ())
+    total_tax = Typed(D, ())
+    total_amount = Typed(D, ())
+
+
+def snapshot_contact(customer) -> ContactSnapshot:
+    if customer is None:
+        return ContactSnapshot()
+    contact = ContactSnapshot(
+        display_name=customer.display_name,
+        company=customer.company,
+        email=customer.email,
+        phone=customer.phone,
+    )
+    if address := customer.billing_address:
+        contact.street = address.street
+        contact.city = address.city
+        contact.state = address.state
+        contact.zipcode = address.zipcode
+    return contact
+
+
+def snapshot_invoice(invoice) -> InvoiceSnapshot:
+    """Copy what the templates use of the invoice. The items and customers
+    must already be loaded.
+
+    """
+    return InvoiceSnapshot(
+        number=invoice.number,
+        date=invoice.date,
+        due_date=invoice.due_date,
+        terms=invoice.terms,
+        status=invoice.status,
+        project=invoice.project,
+        notes=invoice.notes,
+        owner=snapshot_contact(invoice.owner),
+        customer=snapshot_contact(invoice.customer),
+        items=[
+            ItemSnapshot(
+                name=item.name,
+                description=item.description,
+                quantity=item.quantity,
+                rate=item.rate,
+                amount=item.amount,
+                taxable=item.taxable,
+            )
+            for item in invoice.items
+        ],
+        subtotal=invoice.subtotal,
+        total_adjustments=invoice.total_adjustments,
+        tax_rate=invoice.tax_rate,
+        total_tax=invoice.total_tax,
+        total_amount=invoice.total_amount,
+    )
+
+
+def snapshot_state(value: Any) -> Any:
+    """Return the values of a snapshot as nested tuples, eg to hash them."""
+    if isinstance(value, Atom):
+        return tuple(
+            (name, snapshot_state(getattr(value, name))) for name in value.members()
+        )
+    if isinstance(value, list):
+        return tuple(snapshot_state(v) for v in value)
+    return value
+
+
+class CompiledTemplate(Atom):
+    #: Name of the template module
+    name = Str()
+
+    #: Hash of the source it was compiled from
+    digest = Str()
+
+    #: The compiled module
+    module = Instance(types.ModuleType)
+
+    #: The declarative template
+    template = Value()
+
+    #: Function rendering an `InvoiceSnapshot` to html if the module has one
+    render_html = Callable()
+
+
+class TemplateRegistry(Atom):
+    #: Compiled templates by the module name and the hash of the source
+    templates = Dict()
+
+    #: Path, modified time, size and hash of the source of each module so it
+    #: is only read again when the file changes
+    sources = Dict()
+
+    def source_digest(self, name: str) -> tuple[str, str]:
+        """Return the path of the source of the module and its hash."""
+        if (entry := self.sources.get(name)) is None:
+            with enaml.imports():
+                spec = importlib.util.find_spec(name)
+            if spec is None or not spec.origin:
+                raise ImportError(f"No template named {name}")
+            path = spec.origin
+        else:
+            path = entry[0]
+        stat = os.stat(path)
+        if entry is None or entry[1:3] != (stat.st_mtime_ns, stat.st_size):
+            with open(path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            entry = self.sources[name] = (path, stat.st_mtime_ns, stat.st_size, digest)
+        return path, entry[3]
+
+    def compile(self, name: str, path: str, digest: str) -> types.ModuleType:
+        module = sys.modules.get(name)
+        if module is None or getattr(module, "__template_digest__", "") == digest:
+            # Import it normally the first time so the enaml cache is used
+            if module is None:
+                with enaml.imports():
+                    module = importlib.import_module(name)
+                module.__template_digest__ = digest  # type: ignore
+            return module
+        # The source changed since it was imported
+        from enaml.core.enaml_compiler import EnamlCompiler
+        from enaml.core.parser import parse
+
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        if path.endswith(".enaml"):
+            code = EnamlCompiler.compile(parse(source, path), path)
+        else:
+            code = compile(source, path, "exec")
+        module = types.ModuleType(name)
+        module.__file__ = path
+        module.__template_digest__ = digest  # type: ignore
+        with enaml.imports():
+            exec(code, module.__dict__)
+        return module
+
+    def load(self, name: str) -> CompiledTemplate:
+        """Return the compiled template module, compiling it if it is new or
+        the source changed.
+
+        """
+        path, digest = self.source_digest(name)
+        key = (name, digest)
+        if (compiled := self.templates.get(key)) is None:
+            module = self.compile(name, path, digest)
+            compiled = CompiledTemplate(
+                name=name,
+                digest=digest,
+                module=module,
+                template=module.InvoiceTemplate,
+                render_html=getattr(module, "render_html", None),
+            )
+            # Drop the versions compiled from older source
+            for old in [k for k in self.templates if k[0] == name]:
+                del self.templates[old]
+            self.templates[key] = compiled
+        return compiled
+
+    def get(self, name: Optional[str]) -> CompiledTemplate:
+        """Return the template or the default template if it cannot be
+        loaded.
+
+        """
+        try:
+            return self.load(name or DEFAULT_TEMPLATE)
+        except Exception as e:
+            if name == DEFAULT_TEMPLATE:
+                raise
+            log.exception(e)
+            return self.load(DEFAULT_TEMPLATE)
+
+
+#: Compiled templates
+registry = TemplateRegistry()
+
+
+def render_invoice(invoice: Any) -> str:
+    """Render the invoice with its template without keeping a view. The items
+    and customers must already be loaded.
+
+    """
+    compiled = registry.get(invoice.template_module)
+    if compiled.render_html is not None:
+        return compiled.render_html(snapshot_invoice(invoice))
+    from web.core.app import WebApplication
+
+    # The view is built with the html components of enaml-web
+    if WebApplication.instance() is None:
+        WebApplication()
+    view = compiled.template(invoice=invoice)
+    try:
+        return view.render()
+    finally:
+        view.destroy()
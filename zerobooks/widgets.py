@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2018, Jairus Martin.
+
+Distributed under the terms of the GPL v3 License.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Icons and dock widgets used by the views. These import the enaml widgets so
+they are kept out of `zerobooks.utils`, which the command line tools use.
+"""
+import os
+import sys
+from typing import Optional
+
+from atom.api import ForwardTyped, Int, Typed, observe
+from enaml.core.declarative import d_, d_func
+from enaml.icon import Icon, IconImage
+from enaml.image import Image
+from enaml.widgets.api import DockArea as CoreDockArea
+from enaml.widgets.api import DockItem as CoreDockItem
+from enamlx.widgets.table_view import ProxyTableView, TableView
+
+# -----------------------------------------------------------------------------
+# Icon and Image helpers
+# -----------------------------------------------------------------------------
+#: Cache for icons
+_IMAGE_CACHE = {}
+
+
+def icon_path(name: str) -> str:
+    """Load an icon from the res/icons folder using the name
+    without the .png
+
+    """
+    path = os.path.dirname(__file__)
+    return os.path.join(path, "assets", "icons", "%s.png" % name)
+
+
+def load_image(name: str) -> Image:
+    """Get and cache an enaml Image for the given icon name."""
+    path = icon_path(name)
+    global _IMAGE_CACHE
+    if path not in _IMAGE_CACHE:
+        with open(path, "rb") as f:
+            data = f.read()
+        _IMAGE_CACHE[path] = Image(data=data)
+    return _IMAGE_CACHE[path]
+
+
+def load_icon(name: str) -> Icon:
+    img = load_image(name)
+    icg = IconImage(image=img)
+    return Icon(images=[icg])
+
+
+def menu_icon(name: str) -> Optional[str]:
+    """Icons don't look good on Linux/osx menu's"""
+    if sys.platform == "win32":
+        return load_icon(name)
+    return None
+
+
+# -----------------------------------------------------------------------------
+# Table of a data source
+# -----------------------------------------------------------------------------
+class ProxyModelTableView(ProxyTableView):
+    declaration = ForwardTyped(lambda: ModelTableView)
+
+    def set_row_count(self, count: int):
+        raise NotImplementedError
+
+
+class ModelTableView(TableView):
+    """A table view of the rows of a ModelDataSource. The number of rows is
+    set with `row_count` instead of the items so a table with many rows does
+    not need a list with an entry for each of them.
+
+    """
+
+    #: Proxy reference
+    proxy = Typed(ProxyModelTableView)
+
+    #: Number of rows in the table
+    row_count = d_(Int())
+
+    @observe("row_count")
+    def _update_proxy(self, change):
+        """An observer which sends state change to the proxy."""
+        if change["name"] == "row_count":
+            self._update_visible_area()
+        super()._update_proxy(change)
+
+    def _update_visible_area(self):
+        self.visible_rows = min(100, self.row_count)
+        self.visible_columns = min(100, len(self.horizontal_headers))
+
+
+# -----------------------------------------------------------------------------
+# Dock items
+# -----------------------------------------------------------------------------
+#: Version of the layout state, a saved layout of another version is not
+#: restored
+LAYOUT_VERSION = 1
+
+
+class DockItem(CoreDockItem):
+    """A dock item that is saved in the layout state."""
+
+    @d_func
+    def save_state(self) -> dict:
+        """Return what is needed to open the item again. An item showing a
+        model returns the kind of item and the uuid of the model so it can be
+        loaded again and never the model itself.
+
+        """
+        return {
+            "kind": self.name,
+            "title": self.title,
+        }
+
+
+class DockArea(CoreDockArea):
+    """A dock area that saves its layout and which items are open."""
+
+    def get_save_items(self):
+        """Get the list of dock items to save with this dock area."""
+        return [c for c in self.children if isinstance(c, DockItem)]
+
+    def save_state(self) -> dict:
+        """Return the layout state of the dock area. It only has plain
+        values so it can be saved and loaded without creating any items.
+
+        """
+        return {
+            "version": LAYOUT_VERSION,
+            "layout": self.save_layout(),
+            "items": [item.save_state() for item in self.get_save_items()],
+        }